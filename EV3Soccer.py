@@ -15,21 +15,26 @@
 # Code to detect a missing motor (B and C are required) and display an appropriate error message
 # Code to handle optional motors on ports A and D using the L1/L2 and R1/R2 buttons
 
-from pybricks import ev3brick as brick
-from pybricks.hubs import EV3Brick
-from pybricks.ev3devices import (Motor, TouchSensor, ColorSensor,
-                                 InfraredSensor, UltrasonicSensor, GyroSensor)
-from pybricks.parameters import (Port, Stop, Direction, Button, Color,
-                                 SoundFile, ImageFile, Align)
-from pybricks.tools import print, wait, StopWatch
-from pybricks.robotics import DriveBase
-
 # from EV3SoccerUtil import scale, getInputFilename, getMotors
 from EV3SoccerUtil import *
-
-import struct
-
-def handle_options_menu( values, in_file ):
+from EV3SoccerBackend import get_backend
+from EV3SoccerInput import EventReader, EV_SYN, SYN_REPORT
+from EV3SoccerMotors import MotorOutput
+from EV3SoccerRecord import EventRecorder
+from EV3SoccerControl import SoccerControl, FixedRateLoop, InputWatchdog, CONTROL_PERIOD_MS
+from EV3SoccerScreen import Display, DISPLAY_INTERVAL_MS
+from EV3SoccerAsync import Runtime, add_input_task
+from EV3SoccerGyro import (find_gyros, calibrate_gyros, CalibrationStore, CompensatedGyro, FusedGyro,
+                           GyroSampler, HeadingHold, GYRO_PERIOD_MS)
+from EV3SoccerStraight import EncoderSampler, DriveStraight, ENCODER_PERIOD_MS
+from EV3SoccerLog import log, DEBUG, INFO
+from EV3SoccerMenu import Menu, MenuItem, run_menu
+from EV3SoccerTraction import SlewLimiter, TractionControl
+from EV3SoccerMux import InputMux, RoleRouter, open_event_file
+from EV3SoccerDevices import CONTROLLER_NAME
+from EV3SoccerStats import InputLatency, TimedReader, StageProfiler, STAGE_SCREEN, STAGE_LOG
+
+def handle_options_menu( values, reader ):
     """
     Displays a menu on the EV3 screen that allows the user to
     optionally enable the A and/or D motors.  It modifies the
@@ -39,129 +44,132 @@ def handle_options_menu( values, in_file ):
     Example values ["N"]["N"] indicates that motors are not enabled
     by default.
 
-    in_file - The file handle for the input from the PS4 controller (already open)
+    reader - The EventReader for the input from the PS4 controller
 
-    Example: handle_options_menu( values, in_file )
+    Example: handle_options_menu( values, reader )
              User selects both motors to be enabled
              return ["Y"]["Y"]
     """
-    selection = 0
-    done = False
-
-    # Display the screen constants
-    ev3.screen.clear()
-    ev3.screen.draw_text( 5, 1, "Port" )
-    ev3.screen.draw_text( 95,1, "Enabled" )
-    ev3.screen.draw_text( 10,20,"A")
-    ev3.screen.draw_text( 10,40,"D")
-
-    # Display the default menu values
-    ev3.screen.draw_text( 100, 20, values[0] )
-    ev3.screen.draw_text( 100, 40, values[1] )
-    
-    # Display the current selection marker
-    ev3.screen.draw_text( 85, 20, "*")
-
-    # Display instructions
-    ev3.screen.draw_text( 1, 80, "DirPad to select")
-    ev3.screen.draw_text( 1, 100, "Option when done")
-
-    # Read from the file (controller)
-    # long int, long int, unsigned short, unsigned short, unsigned int
-    FORMAT = 'llHHI'    
-    EVENT_SIZE = struct.calcsize(FORMAT)
-    event = in_file.read(EVENT_SIZE)
-
-    while event:
-        (tv_sec, tv_usec, ev_type, code, value) = struct.unpack(FORMAT, event)
-
-        # For debugging purposes
-        # if ev_type != 0:
-        #     outtext = str(ev_type) + ":" + str(code) + ":" + str(value)
-        #     print(outtext)
-        #     print( str(selection) + " " + str( values) )
-
-        # Directional Pad Vertical
-        if ev_type == EVENT_RANGE and code == CODE_DPAD_VRANGE and value != VALUE_BUTTON_RELEASED:
-            # Clear the current selection indicator
-            ev3.screen.draw_text( 85, 20+selection*20, "  ", background_color=Color.WHITE)
-            # Toggle the selection
-            selection = ( selection + 1 ) % 2
-            # Display the new selection indicator
-            ev3.screen.draw_text( 85, 20+selection*20, "*", background_color=Color.WHITE )
-
-        # Directional Pad Horizontal - toggle value
-        if ev_type == EVENT_RANGE and code == CODE_DPAD_HRANGE and value != VALUE_BUTTON_RELEASED:
-            # Toggle the value selected
-            if values[selection] == "Y":
-                values[selection] = "N"
-            else:
-                values[selection] = "Y"
-            # Display the updated value
-            ev3.screen.draw_text( 100, 20+20*selection, values[selection], background_color=Color.WHITE )
-
-        # Option Button to exit menu
-        if ev_type == EVENT_BUTTON and code == CODE_OPTION and value == VALUE_BUTTON_PRESSED:
-            # All done.  Stick around until the option button is released
-            done = True
-
-        # Make sure to clear out the button up event from the queue
-        if done and ev_type == EVENT_BUTTON and code == CODE_OPTION and value == VALUE_BUTTON_RELEASED:
-            ev3.screen.clear()
-            return values
-
-        # Finally, read another event
-        event = in_file.read(EVENT_SIZE)
+    items = [MenuItem(10, 20, "A", ("N", "Y"), values[0]),
+             MenuItem(10, 40, "D", ("N", "Y"), values[1])]
+    menu = Menu(display, items,
+                header=((5, 1, "Port"), (95, 1, "Enabled")),
+                footer=((1, 80, "DirPad to select"), (1, 100, "Option when done")),
+                wait_release=True)
+
+    # Start from a blank screen.  After that, only the marker and the values are redrawn
+    display.clear()
+    if run_menu(menu, reader, display) is None:
+        return
 
-    return 
+    values[0] = items[0].value
+    values[1] = items[1].value
+    display.clear()
+    display.flush(force=True)
+    return values
 
-def EV3Soccer( enableMotorA, enableMotorB, enableMotorC, enableMotorD):
+def EV3Soccer( enableMotorA, enableMotorB, enableMotorC, enableMotorD, controlRate=0, watchdogMs=0, recordPath="", useTasks=False, headingHold=False, driveStraight=False, analogTriggers=False, triggerCurve=0, slewLimit=False, tractionControl=False,
+               coDriver=False, latencyStats=False, profileStages=False, debugLog=False):
+    """
+    Drives the robot with the PS4 controller.
+
+    enableMotorA .. enableMotorD - Which motors to use.  B and C are the wheels, A and D are optional
+    controlRate - How many times a second to update the motors.  0 updates them whenever
+                  the controller sends something
+    watchdogMs - Stop the motors if the controller sends nothing for this many milliseconds.
+                 0 turns the watchdog off.  The controller is quiet while the sticks are
+                 held still, so this has to be longer than that ever happens
+    recordPath - Record the controller events to this file, to replay them later with
+                 EV3SoccerRecord.replay().  The null string turns recording off
+    useTasks - Run the controller, the wheels, the optional motors and the screen as
+               separate tasks (see EV3SoccerAsync).  The wheels are updated controlRate
+               times a second, 100 if controlRate is 0
+    headingHold - Use a gyro on any sensor port to keep the robot driving straight in
+                  arcade mode while the steering stick is in the middle.  The gyros are
+                  calibrated while the instructions are on the screen, so keep the robot
+                  still then.  Two gyros are used together
+    driveStraight - In arcade mode, the left stick drives dead straight forward and backward,
+                    using the wheel encoders to keep both wheels turning the same amount.
+                    Pushing it sideways turns on the spot
+    analogTriggers - Run the optional A and D motors backwards as far as L2 and R2 are
+                     pressed, instead of full speed.  L1 and R1 still run them forwards
+    triggerCurve - 0 to 100.  How much expo curve to put on the triggers, for finer
+                   control with them pressed lightly
+    slewLimit - Speed the wheels up and slow them down gradually instead of all at once,
+                at the rates in EV3SoccerTraction.RAMPS for each drive mode
+    tractionControl - Read the wheel speeds and hold the duty cycles back when the wheels
+                      would spin, for the quickest starts and turnarounds
+    coDriver - If a second controller is connected, it runs the optional A and D motors
+               and the first one only drives (see EV3SoccerMux).  Both are read at once.
+               The driver's controller is looked for again when it goes away, like
+               without a co-driver.  The co-driver's is not
+    latencyStats - Measure how long the controller events wait to be handled, and how long
+                   from an event to the motor write it causes (see EV3SoccerStats).  The
+                   Share button shows them on the screen, and they are printed at the end
+    profileStages - Time every stage of the loop: reading, unpacking and handling the events,
+                    working out and writing the duty cycles, the log and the screen (see
+                    EV3SoccerStats.StageProfiler).  The PS button switches it off and on again.
+                    The times are printed at the end
+    debugLog - Log every controller event, not just the warnings and the changes of state.
+               Costs time on every event, so only for finding out what the controller sent
+
+    example: EV3Soccer(False, True, True, False, controlRate=100)
+    """
 
     # Control type A = Arcade (Default), T=Tank
     ctrltype = "Arc"
 
-    # The deadband means ignore any settings below this.  Prevents the robot from moving unless the joystick
-    # is really being toggled
-    STICK_THRESHOLD = 10
-
     # The turn multiplier can be used to slow down turning.  The values are between 10 and 100
     # 100 means no throttling.  10 means only 10% turning speed.
     turn_multiplier = 100
 
     # Display Controls and Status
-    ev3.screen.clear()
-    ev3.screen.draw_text(1,1,   "Circle/Square")
-    ev3.screen.draw_text(1,21,  "  - Turn Change")
-    ev3.screen.draw_text(1,41,  "Triangl - Arc/Tank")
-    ev3.screen.draw_text(1,80,  "Option - +Motors", background_color=Color.WHITE)
-    ev3.screen.draw_text(1,100, "Turn:" + str(turn_multiplier) + " " + ctrltype, background_color=Color.WHITE)
-
-    wait(2000)
-
-    # Find the gamepad event filename
-    infile_path = getInputFilename()
-    print ( infile_path )
+    display.clear()
+    display.text(1,1,   "Circle/Square")
+    display.text(1,21,  "  - Turn Change")
+    display.text(1,41,  "Triangl - Arc/Tank")
+    display.text(1,80,  "Option - +Motors")
+    display.text(1,100, "Turn:" + str(turn_multiplier) + " " + ctrltype)
+    display.flush(force=True)
+
+    # Calibrate the gyros while the instructions are up, instead of just waiting
+    startup = StopWatch()
+    gyros = []
+    if headingHold:
+        # The stored calibrations stand in for any gyro that is moving now
+        store = CalibrationStore()
+        store.load()
+        gyros = calibrate_gyros(find_gyros(backend), StopWatch(), wait, store)
+        for (port, gyro, calibration) in gyros:
+            log.info("Gyro %s", calibration)
+    wait(max(0, 2000 - startup.time()))
+
+    # Find the gamepad and open its event file.  If the controller disconnects later on,
+    # the session waits for it to come back instead of ending the program
+    session = backend.open_input()
+    recorder = None
+    if recordPath:
+        recorder = EventRecorder(recordPath)
+        session.recorder = recorder
 
     # Display an error if couldn't find the event handler filename (probably not connected)
-    if ( infile_path == "" ) :
-        ev3.screen.clear()
-        ev3.screen.draw_text(10,70,"ERR Controller")
-        ev3.screen.draw_text(10,90," ? connected ?")
+    if not session.connect():
+        display.clear()
+        display.text(10,70,"ERR Controller")
+        display.text(10,90," ? connected ?")
+        display.flush(force=True)
         # prints go to the debug screen when connected to a laptop
         print("ERROR: Could not find Wireless Controller entry in the devices file")
         print("ERROR: Controller connected?")
         wait(5000)
         return
 
-    # open file in binary mode
-    in_file = open(infile_path, "rb")
-
-    # Read from the file
-    # long int, long int, unsigned short, unsigned short, unsigned int
-    FORMAT = 'llHHI'    
-    EVENT_SIZE = struct.calcsize(FORMAT)
-    event = in_file.read(EVENT_SIZE)
-    (tv_sec, tv_usec, ev_type, code, value) = struct.unpack(FORMAT, event)
+    # Read from the controller.  The reader grabs every event that is waiting in one go
+    reader = session
+    event = reader.read()
+    if event is None:
+        return
+    (tv_sec, tv_usec, ev_type, code, value) = event
 
     # Check if the Option button was pressed.  This is the user's chance to enable the
     # optional A and/or D motors
@@ -171,7 +179,7 @@ def EV3Soccer( enableMotorA, enableMotorB, enableMotorC, enableMotorD):
             values[0] = "Y"
         if enableMotorD:
             values[1] = "Y"
-        handle_options_menu( values, in_file )
+        handle_options_menu( values, reader )
         if values[0] == "Y":
             enableMotorA = True
         else:
@@ -187,7 +195,7 @@ def EV3Soccer( enableMotorA, enableMotorB, enableMotorC, enableMotorD):
     foundMotorC = False
     foundMotorA = False
     foundMotorD = False
-    motors = getMotors()
+    motors = getMotors(backend.motor_dir)
     print(motors)
     for item in motors:
         if ( item == "B") : foundMotorB = True
@@ -208,8 +216,9 @@ def EV3Soccer( enableMotorA, enableMotorB, enableMotorC, enableMotorD):
 
     if enableMotorB or enableMotorC:
         if ( foundMotorB == False or foundMotorC == False ):
-            ev3.screen.draw_text(10,70,"ERR Motors B+C")
-            ev3.screen.draw_text(10,90,"not connected")
+            display.text(10,70,"ERR Motors B+C")
+            display.text(10,90,"not connected")
+            display.flush(force=True)
             if ( foundMotorB == False):
                 print( "ERROR: No motor found on Port B")
             if ( foundMotorC == False):
@@ -217,169 +226,312 @@ def EV3Soccer( enableMotorA, enableMotorB, enableMotorC, enableMotorD):
             wait(5000)
             return
 
+    # All motor duty cycles go through here, so that unchanged values are never resent
+    outputs = MotorOutput()
+
     # Check for Optional Motors
     if ( enableMotorA):
         if ( foundMotorA == False ):
-            ev3.sceen.draw_text("MISSING MOTOR A")
+            display.text(10,70,"MISSING MOTOR A")
+            display.flush(force=True)
             wait(2000)
             enableMotorA = False
         else:
-            motorA = Motor(Port.A)
+            outputs.add("A", Motor(Port.A))
 
     if ( enableMotorD):
         if ( foundMotorD == False ):
-            ev3.sceen.draw_text("MISSING MOTOR D")
+            display.text(10,70,"MISSING MOTOR D")
+            display.flush(force=True)
             wait(2000)
             enableMotorD = False
         else:
-            motorD = Motor(Port.D)
+            outputs.add("D", Motor(Port.D))
 
-    # Declare required wheel motors
+    # Declare required wheel motors.  B is the left motor, C is the right motor
     if enableMotorB: 
-        left_motor = Motor(Port.B)
+        outputs.add("B", Motor(Port.B))
     if enableMotorC:
-        right_motor = Motor(Port.C)
-
-    # Initialize variables. 
-    # Assuming sticks are in the middle when starting.
-    right_stick_x = 124
-    right_stick_y = 124
-    left_stick_y = 124
-
-    # Process Optional Motors
-    left_button_up_pressing = 0
-    left_button_down_pressing = 0
-    right_button_up_pressing = 0
-    right_button_down_pressing = 0
-
-    # Wait for an event to be reported in the event file
-    while event:
-        (tv_sec, tv_usec, ev_type, code, value) = struct.unpack(FORMAT, event)
-
-        # Used to only update screen if circle/square/triangle pressed
-        ctrlchange = False
-
-        # Right Horizontal stick value change
-        if ev_type == EVENT_RANGE and code == CODE_RSTICK_HRANGE:
-            right_stick_x = value
-        # Right Vertical stick value change
-        if ev_type == EVENT_RANGE and code == CODE_RSTICK_VRANGE:
-            right_stick_y = value
-        # Left Vertical stick value change
-        if ev_type == EVENT_RANGE and code == CODE_LSTICK_VRANGE:
-            left_stick_y = value
-
-        # Modify turn multiplier with the Square and Circle buttons
-        if ev_type == EVENT_BUTTON and code == CODE_CIRCLE and value == VALUE_BUTTON_PRESSED:
-            # Circle Button.  Increase turning speed.  Make sure we only read the circle_button_press once per press
-            # increase by .10 within limit
-            turn_multiplier = min( (turn_multiplier + 10), 100 )
-            ctrlchange = True
-
-        if ev_type == EVENT_BUTTON and code == CODE_SQUARE and value == VALUE_BUTTON_PRESSED:
-            # Square Button.  Decrease turning speed.
-            # decrease by .10 within limit
-            ctrlchange = True
-            turn_multiplier = max( (turn_multiplier - 10), 10 )
-
-        if ev_type == EVENT_BUTTON and code == CODE_TRIANGLE and value == VALUE_BUTTON_PRESSED:
-            # Triangle button. Toggle Arcade / Tank mode
-            ctrlchange = True
-            if ctrltype == "Arc":
-                ctrltype = "Tank"
-            else:
-                ctrltype = "Arc"
-
-        if ev_type != 0:
-            outtext = str(ev_type) + ":" + str(code) + ":" + str(value)
-            print(outtext)
-
-        #Left 1 (up)
-        if ev_type == EVENT_BUTTON and code == CODE_L1:  #Up
-            left_button_up_pressing = value
-            #print("L Up")
-        #Left 2 (down)
-        if ev_type == EVENT_BUTTON and code == CODE_L2:  #Down
-            left_button_down_pressing = value
-            #print("L Down")
-        #Right 1 (up)
-        if ev_type == EVENT_BUTTON and code == CODE_R1:  #Up
-            #print("R Up")
-            right_button_up_pressing = value
-        #Right 2 (down)
-        if ev_type == EVENT_BUTTON and code == CODE_R2:  #Up
-            #print("R Down")
-            right_button_down_pressing = value
-
-        if ( enableMotorA):    
-            if ( left_button_up_pressing == 1):
-                motorA.dc(100)
-            elif ( left_button_down_pressing == 1):
-                motorA.dc(-100)
+        outputs.add("C", Motor(Port.C))
+
+    # Keeps track of the controller and works out the motor duty cycles
+    control = SoccerControl(outputs, enableMotorA, enableMotorB, enableMotorC, enableMotorD)
+    control.turn_multiplier = turn_multiplier
+    control.ctrltype = ctrltype
+    # The log is written out when the program has nothing else to do.  Every controller event
+    # only goes in it when asked for
+    log.clock = StopWatch()
+    if debugLog:
+        log.set_level(DEBUG)
+    else:
+        log.set_level(INFO)
+
+    def show_ctrlchange():
+        # Update the display if the control mode changed
+        if control.ctrlchange:
+            display.text(1,80, "Turn:" + str(control.turn_multiplier) + "% " + control.ctrltype)
+            log.info("Turn:%d Control Type:%s", control.turn_multiplier, control.ctrltype)
+            control.ctrlchange = False
+
+    def update_motors():
+        writes = outputs.writes
+        control.update_motors()
+        if latency is not None:
+            latency.updated(outputs.writes > writes)
+        show_ctrlchange()
+
+    def update_drive():
+        writes = outputs.writes
+        control.update_drive()
+        if latency is not None:
+            latency.updated(outputs.writes > writes)
+        show_ctrlchange()
+
+    def controller_lost():
+        # Stop right away, and forget what the sticks and buttons were doing
+        control.release()
+        outputs.stop()
+        display.text(1,80, "Controller lost")
+        display.flush(force=True)
+        log.warning("Controller lost.  Waiting for it to come back")
+        log.flush(0)
+        # Nothing else to do while waiting, so save the recording now
+        if recorder:
+            recorder.save()
+
+    def controller_found():
+        # Drive mode and turn multiplier are kept, so just show them again
+        display.text(1,80, "Turn:" + str(control.turn_multiplier) + "% " + control.ctrltype)
+        log.info("Controller back")
+
+    def idle():
+        # Slow work that waits until the motors are up to date
+        start = None
+        if profiler is not None and profiler.enabled:
+            start = profiler.start()
+        display.flush()
+        if start is not None:
+            start = profiler.stop(STAGE_SCREEN, start)
+        log.flush()
+        if start is not None:
+            profiler.stop(STAGE_LOG, start)
+        if gyro is not None:
+            # Keep measuring the gyro drift while the robot sits still
+            if outputs.moving():
+                gyro.moving()
             else:
-                motorA.dc(0)        
-            
-        if ( enableMotorD):    
-            if ( right_button_up_pressing == 1):
-                motorD.dc(100)
-            elif ( right_button_down_pressing == 1):
-                motorD.dc(-100)
+                gyro.at_rest()
+
+    session.on_lost = controller_lost
+    session.on_found = controller_found
+
+    # With a co-driver, read both controllers at once.  Each controller's events only
+    # reach the controls that controller is in charge of
+    handle_event = control.handle_event
+    mux = None
+    if coDriver and getattr(session, "reader", None) is not None:
+        paths = backend.input_devices.find_event_files(CONTROLLER_NAME)
+        if len(paths) > 1:
+            def source_lost(source):
+                # Only the co-driver.  The session looks after the driver's controller
+                router.release(source.role)
+                log.warning("Co-driver controller lost")
+            mux = InputMux(on_lost=source_lost)
+            mux.add("driver", "driver", session)
+            try:
+                mux.add("co-driver", "attachments", EventReader(open_event_file(paths[1])))
+            except OSError:
+                log.warning("Could not open the co-driver controller")
+            def handle_codriver(ev_type, code, value):
+                # Only the driver keeps the watchdog happy
+                control.handle_event(ev_type, code, value, False)
+            router = RoleRouter(mux, control.handle_event, handle_codriver)
+            handle_event = router.handle_event
+            reader = mux
+        else:
+            log.warning("No co-driver controller found")
+
+    # Time every event from when it came in to when the motors were told about it
+    latency = None
+    if latencyStats:
+        latency = InputLatency(backend.event_time_us)
+        reader = TimedReader(reader, latency)
+        histograms = [latency.lag, latency.wait]
+
+        def show_latency(value):
+            # Every press shows the next one, as p50/p99/max
+            histogram = histograms[0]
+            histograms.reverse()
+            display.text(1,100, histogram.name + " " + histogram.short())
+        control.dispatcher.register_press(CODE_SHARE, show_latency)
+
+    # Time every stage of the loop, from reading the controller to drawing the screen
+    profiler = None
+    if profileStages:
+        profiler = StageProfiler()
+        control.profiler = profiler
+        session.profiler = profiler
+        if getattr(session, "reader", None) is not None:
+            session.reader.profiler = profiler
+
+        def toggle_profiler(value):
+            if profiler.toggle():
+                display.text(1,100, "Profiling")
             else:
-                motorD.dc(0)        
-
-        if ( ctrltype == "Arc"):
-            # Arcade Controls
-
-            # Scale stick positions from 0-255 into 100,-100
-            # This can be used to reverse the forward direction by changing 100,-100 to -100,100
-            forward = scale(right_stick_y, (0,255), (100,-100))
-            left = scale(right_stick_x, (0,255), (100,-100))
-
-            # If none of the stick directions is significant, don't move at all
-            if (abs(forward) < STICK_THRESHOLD and abs(left) < STICK_THRESHOLD ) :
-                forward = 0
-                left = 0
-
-            # Set motor voltages. If we're steering left, the left motor
-            # must run backwards so it has a -left component
-            # It has a forward component for going forward too. 
-            if enableMotorB:
-                left_motor.dc(forward - left*turn_multiplier/100)
-            if enableMotorC:
-                right_motor.dc(forward + left*turn_multiplier/100)
+                display.text(1,100, "Profiling off")
+        control.dispatcher.register_press(CODE_HOME, toggle_profiler)
+
+    # Check the controller is still there every motor update.  Without the watchdog,
+    # the reader can wait for the next event forever
+    check_ms = -1
+    if watchdogMs:
+        control.watchdog = InputWatchdog(StopWatch(), watchdogMs)
+        check_ms = CONTROL_PERIOD_MS
+
+    # The heading hold has to keep correcting while the stick is held still and the
+    # controller is quiet, so the motors are updated at least every control period
+    sampler = None
+    gyro = None
+    if headingHold:
+        if not gyros:
+            display.text(10,70,"MISSING GYRO")
+            display.flush(force=True)
+            log.warning("No gyro found.  Driving without heading hold")
+            wait(2000)
         else:
-            # Tank controls
-
-            # Scale stick positions to -100,100
-            right_speed = scale(right_stick_y, (0,255), (100,-100))
-            left_speed = scale(left_stick_y, (0,255), (100,-100))
-
-            # Don't move if the joystick is really close to 0,0
-            if abs(right_speed) < STICK_THRESHOLD and abs(left_speed) < STICK_THRESHOLD:
-                right_speed = 0
-                left_speed = 0 
-
-            if enableMotorB:
-                left_motor.dc(left_speed)
-            if enableMotorC:
-                right_motor.dc(right_speed)
-
-        # Update the display if the control mode changed
-        if ctrlchange:
-            ev3.screen.draw_text(1,80, "Turn:" + str(turn_multiplier) + "% " + ctrltype + "    ", background_color=Color.WHITE)
-            print("Turn:" + str(turn_multiplier) + " Control Type:" + ctrltype )
-            
-        # Finally, read another event
-        event = in_file.read(EVENT_SIZE)
-
-    in_file.close()
+            # Drift and bias taken out, and two gyros averaged together
+            compensated = [CompensatedGyro(raw, calibration, StopWatch()) for (port, raw, calibration) in gyros]
+            gyro = compensated[0]
+            if len(compensated) > 1:
+                gyro = FusedGyro(compensated)
+            sampler = GyroSampler(gyro, StopWatch())
+            control.heading_hold = HeadingHold(sampler)
+            check_ms = CONTROL_PERIOD_MS
+
+    # The triggers are only looked at every control period, however many events they send.
+    # Check at that rate too, so the last trigger position is used once the events stop
+    if analogTriggers and ( enableMotorA or enableMotorD ):
+        control.use_triggers(triggerCurve, StopWatch())
+        check_ms = CONTROL_PERIOD_MS
+
+    # The ramps and traction control keep changing the duty cycles while the sticks are still
+    if slewLimit:
+        control.ramp = SlewLimiter(StopWatch())
+        check_ms = CONTROL_PERIOD_MS
+    if tractionControl:
+        if not ( enableMotorB and enableMotorC ):
+            display.text(10,70,"NO WHEELS B+C")
+            display.flush(force=True)
+            log.warning("Motors B and C not enabled.  Driving without traction control")
+            wait(2000)
+        else:
+            control.traction = {"B": TractionControl(outputs.motors["B"], StopWatch()),
+                                "C": TractionControl(outputs.motors["C"], StopWatch())}
+            check_ms = CONTROL_PERIOD_MS
+
+    # Drive straight corrects all the time too, from the wheel encoders
+    encoders = None
+    if driveStraight:
+        if not ( enableMotorB and enableMotorC ):
+            display.text(10,70,"NO WHEELS B+C")
+            display.flush(force=True)
+            log.warning("Motors B and C not enabled.  Driving without drive straight")
+            wait(2000)
+        else:
+            encoders = EncoderSampler(outputs.motors["B"], outputs.motors["C"], StopWatch())
+            control.straight = DriveStraight(encoders)
+            check_ms = CONTROL_PERIOD_MS
+
+    try:
+        if useTasks or controlRate:
+            # The loops below read their own events, so hand over the one read at the start
+            handle_event(event[2], event[3], event[4])
+        if useTasks:
+            # Every job gets its own task, with its own rate
+            period = CONTROL_PERIOD_MS
+            if controlRate:
+                period = 1000 // controlRate
+            wait_ms = None
+            if backend.virtual_time:
+                wait_ms = wait
+            runtime = Runtime(StopWatch(), wait_ms)
+            add_input_task(runtime, reader, handle_event)
+            runtime.every("drive", period, update_drive)
+            if enableMotorA or enableMotorD:
+                runtime.every("attachments", 2 * period, control.update_attachments)
+            if sampler is not None:
+                runtime.every("gyro", GYRO_PERIOD_MS, sampler.sample)
+            if encoders is not None:
+                runtime.every("encoders", ENCODER_PERIOD_MS, encoders.sample)
+            runtime.every("screen", DISPLAY_INTERVAL_MS, idle)
+            runtime.run()
+            print(runtime.report())
+        elif controlRate:
+            # Update the motors at a fixed rate, and read the controller in between
+            loop = FixedRateLoop(StopWatch(), 1000 // controlRate)
+            loop.run(reader, handle_event, update_motors, idle)
+            print(loop.report())
+        else:
+            # Wait for an event to be reported in the event file
+            while not reader.eof:
+                if event is None:
+                    # Nothing came in for a while.  Let the watchdog stop the motors if needed
+                    update_motors()
+                else:
+                    (tv_sec, tv_usec, ev_type, code, value) = event
+
+                    handle_event(ev_type, code, value)
+
+                    # The controller finishes every group of changes with a sync event.  Only update
+                    # the motors then, and only for the newest group if several are already waiting
+                    if ev_type == EV_SYN and code == SYN_REPORT and not reader.pending():
+                        update_motors()
+
+                # Draw any changes to the screen and write out the log, once the motors are up
+                # to date and nothing is waiting
+                if not reader.pending():
+                    idle()
+
+                # Finally, read another event.  Stop waiting early if something still has to be drawn
+                timeout = display.due_in()
+                if check_ms >= 0 and ( timeout < 0 or check_ms < timeout ):
+                    timeout = check_ms
+                event = reader.read(timeout)
+    finally:
+        # Make sure the recording is saved and the log written out however the program ends
+        if recorder:
+            recorder.save()
+        log.flush(0)
+
+    session.close()
+    if mux is not None:
+        mux.close()
+        print(mux.report())
+    if latency is not None:
+        print(latency.report())
+    if profiler is not None:
+        print(profiler.report())
+    print("Motor writes:" + str(outputs.writes) + " Skipped:" + str(outputs.suppressed))
+    print(log.report())
     return
 
-# Used to display on the brick screen
-ev3 = EV3Brick()
-
-ev3.screen.draw_text(10,10,"Soccer")
-ev3.screen.draw_text(10,30,"07/11/25")
+# The brick, or the simulator when not running on the brick
+backend = get_backend()
+Motor = backend.Motor
+Port = backend.Port
+Color = backend.Color
+StopWatch = backend.StopWatch
+wait = backend.wait
+
+# Used to display on the brick screen.  Only the text that changed is drawn, and only
+# when the program is not busy with the controller
+ev3 = backend.ev3
+display = Display(ev3.screen, StopWatch(), background=Color.WHITE)
+
+display.text(10,10,"Soccer")
+display.text(10,30,"07/11/25")
+display.flush(force=True)
 wait(1000)
 
-EV3Soccer(False, False, False, False)
\ No newline at end of file
+EV3Soccer(False, False, False, False)
+backend.close()
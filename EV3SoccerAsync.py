@@ -0,0 +1,168 @@
+# Cooperative tasks for the EV3Soccer group of programs
+#
+# Instead of one loop that does everything in turn, the program is split into tasks that
+# each run every so many milliseconds: reading the controller, driving, the optional A/D
+# motors, drawing the screen, reading sensors.  They take turns on uasyncio on the brick
+# (asyncio on a regular computer), so a slow task only holds up the others for as long as
+# one of its turns takes.  Every task keeps track of how late its turns start.
+#
+# example: runtime = Runtime(StopWatch())
+#          add_input_task(runtime, session, control.handle_event)
+#          runtime.every("drive", 10, control.update_drive)
+#          runtime.every("screen", 100, display.flush)
+#          runtime.run()
+#          print(runtime.report())
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+# How often the controller is checked for new events
+INPUT_POLL_MS = 5
+
+# uasyncio has sleep_ms().  asyncio only has sleep(), in seconds
+if hasattr(asyncio, "sleep_ms"):
+    sleep_ms = asyncio.sleep_ms
+else:
+    def sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+
+class TaskStats():
+    """
+    How one task has been doing.  late is how many milliseconds after it was due
+    each turn started, and overruns is how many turns were skipped because the
+    task fell a whole period or more behind.
+    """
+    def __init__(self, name, period_ms):
+        self.name = name
+        self.period_ms = period_ms
+        self.runs = 0
+        self.overruns = 0
+        self.late_total = 0
+        self.late_max = 0
+
+    def report(self):
+        average = 0
+        if self.runs:
+            average = round(self.late_total / self.runs, 2)
+        return (self.name + " every " + str(self.period_ms) + "ms Runs:" + str(self.runs) +
+                " Overruns:" + str(self.overruns) + " Late avg:" + str(average) +
+                "ms max:" + str(self.late_max) + "ms")
+
+
+class Runtime():
+    """
+    Runs functions every so many milliseconds as cooperative tasks, until stop()
+    is called.
+
+    clock - A StopWatch.  The tasks are scheduled by this clock
+    wait - Only for clocks that move when something waits, like the simulator's.
+           The wait() that moves the clock.  The runtime then moves the clock
+           straight to the next task that is due, so nothing waits for real
+
+    example: runtime = Runtime(StopWatch())
+             runtime.every("gyro", 20, read_gyro)
+             runtime.run()
+    """
+    def __init__(self, clock, wait=None):
+        self.clock = clock
+        self.wait = wait
+        self.tasks = []
+        self.running = False
+        # When each task is next due, for moving virtual time forward
+        self.due = {}
+
+    def every(self, name, period_ms, function):
+        """
+        Calls function() every period_ms milliseconds once run() starts.  Returns
+        the TaskStats for it.
+        """
+        stats = TaskStats(name, period_ms)
+        self.tasks.append((stats, function))
+        return stats
+
+    def stop(self):
+        """
+        Makes run() return once the task that is running now finishes its turn.
+        """
+        self.running = False
+
+    def run(self):
+        """
+        Runs the tasks until stop() is called.
+        """
+        self.running = True
+        if hasattr(asyncio, "run"):
+            asyncio.run(self.main())
+        else:
+            asyncio.get_event_loop().run_until_complete(self.main())
+
+    async def main(self):
+        loop = asyncio.get_event_loop()
+        for (stats, function) in self.tasks:
+            loop.create_task(self.periodic(stats, function))
+        while self.running:
+            if self.wait is not None:
+                # Every task has had its turn and is waiting.  Move the clock to the next one due
+                await sleep_ms(0)
+                if self.due:
+                    ahead = min(self.due.values()) - self.clock.time()
+                    if ahead > 0:
+                        self.wait(ahead)
+            else:
+                await sleep_ms(100)
+        # Give the tasks a moment to see that they should stop
+        await sleep_ms(0)
+
+    async def periodic(self, stats, function):
+        clock = self.clock
+        period = stats.period_ms
+        due = clock.time()
+        while self.running:
+            now = clock.time()
+            if now < due:
+                self.due[stats.name] = due
+                if self.wait is not None:
+                    await sleep_ms(0)
+                else:
+                    await sleep_ms(due - now)
+                continue
+            late = now - due
+            stats.runs += 1
+            stats.late_total += late
+            if late > stats.late_max:
+                stats.late_max = late
+            function()
+            due += period
+            # Fell a whole period behind.  Skip the turns that were missed
+            now = clock.time()
+            if now >= due:
+                missed = (now - due) // period + 1
+                stats.overruns += missed
+                due += missed * period
+        if stats.name in self.due:
+            del self.due[stats.name]
+
+    def report(self):
+        """
+        Returns the statistics for every task as text, one line each.
+        """
+        return "\n".join(stats.report() for (stats, function) in self.tasks)
+
+
+def add_input_task(runtime, reader, handle_event, period_ms=INPUT_POLL_MS):
+    """
+    Adds a task that hands every controller event that is waiting to
+    handle_event(ev_type, code, value), without ever waiting for one.  Stops
+    the runtime when the reader reaches the end of its file.
+    """
+    def poll():
+        event = reader.read(0)
+        while event:
+            handle_event(event[2], event[3], event[4])
+            event = reader.read(0)
+        if reader.eof:
+            runtime.stop()
+    return runtime.every("input", period_ms, poll)
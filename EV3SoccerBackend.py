@@ -0,0 +1,690 @@
+# Hardware backends for the EV3Soccer group of programs
+#
+# The programs get their screen, motors, sensors, controller input and clock from a backend
+# instead of importing pybricks directly.  On the brick that is PybricksBackend.  On a regular
+# computer it is SimBackend, which has virtual motors that turn when you give them a duty
+# cycle, virtual sensors, a made up /sys/class tree and a clock that only moves forward when
+# the program waits.  That way the whole program can run (and be profiled) off the brick,
+# much faster than real time.
+#
+# example: backend = get_backend()
+#          motor = backend.Motor(backend.Port.B)
+
+import math
+import struct
+import time
+
+from EV3SoccerDevices import InputDevices, DEVICES_FILE, INPUT_DIR, CONTROLLER_NAME
+from EV3SoccerInput import InputSession, EVENT_FORMAT, EVENT_SIZE
+
+# Where ev3dev lists the motors and sensors that are plugged in
+MOTOR_DIR = "/sys/class/tacho-motor"
+SENSOR_DIR = "/sys/class/lego-sensor"
+
+# The Riley Rover.  Used by the simulator to work out which way the robot is facing
+WHEEL_DIAMETER = 56
+AXLE_TRACK = 120
+
+# How a simulated motor runs to a target and holds it.  Its controller asks for this many
+# degrees per second for every degree off target.  Asked for less than TARGET_FRICTION
+# degrees per second, a standing motor does not move at all, so it stops a little off
+# target.  run_target() is done once it is within TARGET_TOLERANCE degrees and slower
+# than TARGET_FRICTION, like pybricks, so the rest of the settling happens while holding
+TARGET_GAIN = 20
+TARGET_FRICTION = 30
+TARGET_TOLERANCE = 5
+
+
+class PybricksBackend():
+    """
+    The real thing.  Everything comes from pybricks and the ev3dev file system.
+    """
+    name = "pybricks"
+    # The clock runs by itself
+    virtual_time = False
+
+    def __init__(self):
+        from pybricks.hubs import EV3Brick
+        from pybricks.ev3devices import (Motor, TouchSensor, ColorSensor,
+                                         InfraredSensor, UltrasonicSensor, GyroSensor)
+        from pybricks.parameters import (Port, Stop, Color)
+        from pybricks.tools import wait, StopWatch
+
+        self.ev3 = EV3Brick()
+        self.Motor = Motor
+        self.TouchSensor = TouchSensor
+        self.ColorSensor = ColorSensor
+        self.InfraredSensor = InfraredSensor
+        self.UltrasonicSensor = UltrasonicSensor
+        self.GyroSensor = GyroSensor
+        self.Port = Port
+        self.Stop = Stop
+        self.Color = Color
+        self.StopWatch = StopWatch
+        self.wait = wait
+        self.motor_dir = MOTOR_DIR
+        self.sensor_dir = SENSOR_DIR
+        self.input_devices = InputDevices(DEVICES_FILE, INPUT_DIR)
+
+    def close(self):
+        # Nothing to tidy up on the brick
+        pass
+
+    def open_input(self):
+        """
+        Returns an InputSession for the controller.  Call connect() on it to open it.
+        """
+        return InputSession(self.StopWatch(), devices=self.input_devices, wait=self.wait)
+
+    def event_time_us(self):
+        """
+        Returns the time the controller events are stamped with (the time of day),
+        in microseconds.
+        """
+        if hasattr(time, "time_ns"):
+            return time.time_ns() // 1000
+        return int(time.time() * 1000000)
+
+
+class SimPort():
+    A = "A"
+    B = "B"
+    C = "C"
+    D = "D"
+    S1 = "1"
+    S2 = "2"
+    S3 = "3"
+    S4 = "4"
+
+
+class SimStop():
+    COAST = "coast"
+    BRAKE = "brake"
+    HOLD = "hold"
+
+
+class SimColor():
+    BLACK = "black"
+    WHITE = "white"
+    RED = "red"
+    GREEN = "green"
+    BLUE = "blue"
+    YELLOW = "yellow"
+    BROWN = "brown"
+
+
+class SimClock():
+    """
+    The simulator's clock.  Time only moves forward when something waits.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def advance(self, ms):
+        if ms > 0:
+            self.now += ms
+
+
+class WallClock(SimClock):
+    """
+    A SimClock that keeps up with the computer's own clock, and waiting really
+    waits.  For benchmarks that talk to real files and threads.
+
+    example: clock = SimStopWatch(WallClock())
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+
+    @property
+    def now(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def advance(self, ms):
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+
+class SimStopWatch():
+    """
+    A pybricks StopWatch that runs on the simulator's clock.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.start = clock.now
+
+    def time(self):
+        return int(self.clock.now - self.start)
+
+    def reset(self):
+        self.start = self.clock.now
+
+
+class SimScreen():
+    """
+    Stands in for the EV3 screen.  Remembers what text is where, and counts
+    the calls so the cost of drawing can be measured.
+    """
+    def __init__(self):
+        self.cells = {}
+        self.draws = 0
+        self.clears = 0
+
+    def clear(self):
+        self.cells = {}
+        self.clears += 1
+
+    def draw_text(self, x, y, text, text_color=None, background_color=None):
+        self.cells[(x, y)] = str(text)
+        self.draws += 1
+
+
+class SimSpeaker():
+    def __init__(self):
+        self.beeps = 0
+
+    def beep(self, frequency=500, duration=100):
+        self.beeps += 1
+
+
+class SimBrick():
+    def __init__(self):
+        self.screen = SimScreen()
+        self.speaker = SimSpeaker()
+
+
+class SimMotor():
+    """
+    A virtual EV3 motor.  The speed follows the duty cycle (or the speed asked
+    for) with a short delay, and the encoder angle is the speed added up over
+    time.  It catches up with the simulator's clock whenever it is used.
+
+    max_speed - Degrees per second at full duty cycle with no load
+    time_constant - Seconds it takes to get most of the way to a new speed
+    gain - How strong this motor is compared to a perfect one.  Two motors with
+           different gains drive a robot in a curve
+    grip - For a wheel on the ground: the most degrees per second per second the
+           tyre can speed the robot up or slow it down by.  Pushed harder, the wheel
+           spins (see ground).  None for a motor with nothing on it, that never slips
+
+    With grip, the motor carries its share of the robot, so it gets up to speed
+    loaded_time_constant seconds instead of time_constant, as long as the tyre grips.
+    Once it slips, the tyre only pushes the robot with kinetic times grip, and the
+    rest of what the motor has spins the wheel up, until the robot catches up.
+    """
+    def __init__(self, clock, port, max_speed=1050, time_constant=0.05, gain=1.0, grip=None,
+                 loaded_time_constant=0.25, kinetic=0.7):
+        self.clock = clock
+        self.port = port
+        self.max_speed = max_speed
+        self.time_constant = time_constant
+        self.gain = gain
+        self.grip = grip
+        self.loaded_time_constant = loaded_time_constant
+        self.kinetic = kinetic
+        self.position = 0.0
+        self.velocity = 0.0
+        # Where the robot really is and how fast it goes, in wheel degrees.  The same as
+        # position and velocity while the tyre grips
+        self.ground_position = 0.0
+        self.ground_velocity = 0.0
+        self.slipping = False
+        # Statistics.  How many times the wheel broke loose
+        self.slips = 0
+        self.offset = 0.0
+        self.last = clock.now
+        # What the motor is doing: "dc", "speed", "target" or "stop"
+        self.mode = "stop"
+        self.duty = 0
+        self.run_speed = 0
+        self.target = 0
+        # Statistics.  How many commands were written to the motor
+        self.writes = 0
+
+    def update(self):
+        """
+        Moves the motor forward to the simulator's current time.
+        """
+        dt = (self.clock.now - self.last) / 1000
+        self.last = self.clock.now
+        if dt <= 0:
+            return
+        if self.mode == "target":
+            self.settle(dt)
+            return
+        if self.mode == "dc":
+            goal = self.duty * self.max_speed * self.gain / 100
+        elif self.mode == "speed":
+            goal = max(-self.max_speed, min(self.max_speed, self.run_speed))
+        else:
+            goal = 0.0
+        if self.grip is not None:
+            self.ground(goal, dt)
+            return
+        # The speed gets closer to the goal the way a real motor spins up
+        fade = math.exp(-dt / self.time_constant)
+        self.position += goal * dt + (self.velocity - goal) * self.time_constant * (1 - fade)
+        self.velocity = goal + (self.velocity - goal) * fade
+
+    def settle(self, dt):
+        # Runs to the target and holds it there, forward by dt seconds a millisecond at a
+        # time.  The motor takes time_constant to get to the speed its controller asks for,
+        # so it runs past the target and comes back before it settles
+        top = min(abs(self.run_speed), self.max_speed * self.gain)
+        while dt > 0:
+            h = min(dt, 0.001)
+            dt -= h
+            goal = max(-top, min(top, TARGET_GAIN * (self.target - self.position)))
+            if abs(goal) < TARGET_FRICTION and abs(self.velocity) < TARGET_FRICTION:
+                self.velocity = 0.0
+                continue
+            self.velocity += (goal - self.velocity) * h / self.time_constant
+            self.position += self.velocity * h
+
+    def done(self):
+        # True once run_target() would return
+        return abs(self.target - self.position) <= TARGET_TOLERANCE and abs(self.velocity) < TARGET_FRICTION
+
+    def ground(self, goal, dt):
+        # Moves a wheel that is on the ground forward by dt seconds, a millisecond at a time
+        while dt > 0:
+            h = min(dt, 0.001)
+            dt -= h
+            if not self.slipping:
+                accel = (goal - self.velocity) / self.loaded_time_constant
+                if abs(accel) <= self.grip:
+                    self.velocity += accel * h
+                    self.position += self.velocity * h
+                    self.ground_velocity = self.velocity
+                    self.ground_position += self.velocity * h
+                    continue
+                # Pushed harder than the tyre can take
+                self.slipping = True
+                self.slips += 1
+            friction = self.grip * self.kinetic
+            difference = self.velocity - self.ground_velocity
+            if difference < 0:
+                friction = -friction
+            accel = (goal - self.velocity) / self.loaded_time_constant - friction
+            self.velocity += accel * self.loaded_time_constant / self.time_constant * h
+            self.position += self.velocity * h
+            step = self.grip * self.kinetic * h
+            difference = self.velocity - self.ground_velocity
+            if abs(difference) <= step:
+                # The tyre grips again
+                self.ground_velocity = self.velocity
+                self.slipping = False
+            elif difference > 0:
+                self.ground_velocity += step
+            else:
+                self.ground_velocity -= step
+            self.ground_position += self.ground_velocity * h
+
+    def dc(self, duty):
+        self.update()
+        self.writes += 1
+        self.mode = "dc"
+        self.duty = max(-100, min(100, duty))
+
+    def run(self, speed):
+        self.update()
+        self.writes += 1
+        self.mode = "speed"
+        self.run_speed = speed
+
+    def stop(self):
+        self.update()
+        self.writes += 1
+        self.mode = "stop"
+
+    def brake(self):
+        self.stop()
+
+    def hold(self):
+        self.update()
+        self.writes += 1
+        self.mode = "target"
+        self.target = self.position
+        self.run_speed = self.max_speed
+
+    def run_target(self, speed, target_angle, then=None, wait=True):
+        self.update()
+        self.writes += 1
+        self.mode = "target"
+        self.run_speed = speed
+        self.target = target_angle + self.offset
+        if wait:
+            distance = abs(self.target - self.position)
+            self.clock.advance(1000 * distance / max(abs(speed), 1) + 1)
+            self.update()
+            # Then however long it takes to settle.  Give up after a second, in case it never does
+            for _ in range(1000):
+                if self.done():
+                    break
+                self.clock.advance(1)
+                self.update()
+
+    def run_angle(self, speed, rotation_angle, then=None, wait=True):
+        self.update()
+        self.run_target(speed, self.position - self.offset + rotation_angle, then, wait)
+
+    def run_time(self, speed, time, then=None, wait=True):
+        self.run(speed)
+        if wait:
+            self.clock.advance(time)
+            self.stop()
+
+    def angle(self):
+        self.update()
+        return int(self.position - self.offset)
+
+    def speed(self):
+        self.update()
+        return int(self.velocity)
+
+    def reset_angle(self, angle=0):
+        self.update()
+        self.offset = self.position - angle
+
+
+class SimGyroSensor():
+    """
+    A virtual gyro.  It reads how far the robot has turned (worked out from the
+    B and C wheel encoders), plus a steady drift and some noise, like a real one.
+    """
+    def __init__(self, backend, port):
+        self.backend = backend
+        self.port = port
+        self.offset = 0.0
+        self.drift = backend.gyro_drift
+        self.noise = backend.gyro_noise
+        import random
+        self.random = random.Random(port)
+        self.reads = 0
+
+    def heading(self):
+        return self.backend.heading() + self.drift * self.backend.clock.now / 1000
+
+    def angle(self):
+        self.reads += 1
+        return int(round(self.heading() - self.offset + self.random.gauss(0, self.noise)))
+
+    def speed(self):
+        self.reads += 1
+        return int(round(self.backend.turn_rate() + self.drift + self.random.gauss(0, self.noise)))
+
+    def reset_angle(self, angle=0):
+        self.offset = self.heading() - angle
+
+
+class SimSensor():
+    """
+    A virtual sensor for the sensors the simulator has no model for.  Every
+    reading returns the same value.
+    """
+    def __init__(self, backend, port, value=0):
+        self.backend = backend
+        self.port = port
+        self.value = value
+        self.reads = 0
+
+    def read(self, *args):
+        self.reads += 1
+        return self.value
+
+    # Color, touch, infrared and ultrasonic sensor readings
+    color = read
+    reflection = read
+    ambient = read
+    pressed = read
+    distance = read
+    buttons = read
+
+
+class SimEventSource():
+    """
+    Plays controller events into the program on the simulator's clock.  Works like
+    an InputSession: read(timeout) returns the next event once the clock gets to it,
+    and moves the clock forward by timeout when nothing is due.
+
+    events - A list of (time_ms, ev_type, code, value), or the name of a recording
+    """
+    def __init__(self, clock, events=None):
+        self.clock = clock
+        self.on_lost = None
+        self.on_found = None
+        self.recorder = None
+        self.disconnects = 0
+        self.events = []
+        if isinstance(events, str):
+            self.load(events)
+        elif events:
+            self.events = list(events)
+        self.index = 0
+        self.eof = False
+
+    def load(self, path):
+        # Recording timestamps are turned into milliseconds since the first event
+        with open(path, "rb") as in_file:
+            data = in_file.read()
+        first = None
+        for offset in range(0, len(data) - EVENT_SIZE + 1, EVENT_SIZE):
+            (tv_sec, tv_usec, ev_type, code, value) = struct.unpack_from(EVENT_FORMAT, data, offset)
+            when = tv_sec * 1000 + tv_usec / 1000
+            if first is None:
+                first = when
+            self.events.append((when - first, ev_type, code, value))
+
+    def connect(self):
+        return True
+
+    def connected(self):
+        return not self.eof
+
+    def close(self):
+        pass
+
+    def pending(self):
+        return self.index < len(self.events) and self.events[self.index][0] <= self.clock.now
+
+    def read(self, timeout=-1):
+        if self.index >= len(self.events):
+            self.eof = True
+            return None
+        (when, ev_type, code, value) = self.events[self.index]
+        if timeout >= 0 and when > self.clock.now + timeout:
+            self.clock.advance(timeout)
+            return None
+        self.clock.advance(when - self.clock.now)
+        self.index += 1
+        # Stamped with when it came in, like the kernel does, even if the program gets to it later
+        tv_sec = int(when // 1000)
+        tv_usec = int((when % 1000) * 1000)
+        if self.recorder is not None:
+            self.recorder.record(struct.pack(EVENT_FORMAT, tv_sec, tv_usec, ev_type, code, value), EVENT_SIZE)
+        return (tv_sec, tv_usec, ev_type, code, value)
+
+
+class SimBackend():
+    """
+    Runs the programs on a regular computer.  The motors, sensors and controller
+    are all virtual, and there is a made up /sys/class and devices file so the
+    code that looks for devices finds them.
+
+    motors - Ports with a motor plugged in, and its type: {"B": "lego-ev3-l-motor", ...}
+    sensors - Ports with a sensor plugged in, and its type: {"1": "lego-ev3-gyro", ...}
+    events - Controller events to play.  See SimEventSource
+    gyro_drift - Degrees per second the virtual gyros drift
+    gyro_noise - How noisy the virtual gyros are, in degrees
+    root - The folder to put the made up /sys/class in.  A new temporary folder by default,
+           removed again by close()
+
+    example: backend = SimBackend(events="session.bin")
+             motor = backend.Motor(backend.Port.B)
+             motor.dc(50)
+             backend.wait(1000)
+             print(motor.angle())
+             backend.close()
+    """
+    name = "sim"
+    # The clock only moves when something waits
+    virtual_time = True
+
+    def __init__(self, motors=None, sensors=None, events=None, gyro_drift=0.0, gyro_noise=0.0, root=None):
+        if motors is None:
+            motors = {"B": "lego-ev3-l-motor", "C": "lego-ev3-l-motor"}
+        if sensors is None:
+            sensors = {}
+        self.clock = SimClock()
+        self.ev3 = SimBrick()
+        self.Port = SimPort
+        self.Stop = SimStop
+        self.Color = SimColor
+        self.gyro_drift = gyro_drift
+        self.gyro_noise = gyro_noise
+        self.motor_types = motors
+        self.sensor_types = sensors
+        self.events = events
+        # Each physical motor and sensor only exists once, however many times it is asked for
+        self.motors = {}
+        self.sensors = {}
+        # How strong each motor is, and how well its tyre grips.  Set before the motor is first used
+        self.motor_gains = {}
+        self.motor_grip = {}
+        # The temporary folder, if the backend made one
+        self.temp_root = None
+        self.make_tree(root)
+
+    def make_tree(self, root):
+        # Writes the made up /sys/class/tacho-motor, /sys/class/lego-sensor and devices file
+        import os
+        import tempfile
+        if root is None:
+            root = tempfile.mkdtemp(prefix="ev3sim")
+            self.temp_root = root
+        self.root = root
+        self.motor_dir = root + "/tacho-motor"
+        self.sensor_dir = root + "/lego-sensor"
+        for folder, prefix, types, address in ((self.motor_dir, "motor", self.motor_types, "ev3-ports:out"),
+                                               (self.sensor_dir, "sensor", self.sensor_types, "ev3-ports:in")):
+            os.makedirs(folder, exist_ok=True)
+            for number, port in enumerate(sorted(types)):
+                device = folder + "/" + prefix + str(number)
+                os.makedirs(device, exist_ok=True)
+                with open(device + "/driver_name", "w") as out:
+                    out.write(types[port] + "\n")
+                with open(device + "/address", "w") as out:
+                    out.write(address + port + "\n")
+        os.makedirs(root + "/input", exist_ok=True)
+        with open(root + "/devices", "w") as out:
+            out.write('I: Bus=0005 Vendor=054c Product=09cc Version=8100\n')
+            out.write('N: Name="' + CONTROLLER_NAME + '"\n')
+            out.write('H: Handlers=kbd event4 js0\n\n')
+        self.input_devices = InputDevices(root + "/devices", root + "/input")
+
+    def close(self):
+        """
+        Removes the made up /sys/class and devices file, if they went in a
+        temporary folder.
+        """
+        if self.temp_root is not None:
+            import shutil
+            shutil.rmtree(self.temp_root, ignore_errors=True)
+            self.temp_root = None
+
+    def StopWatch(self):
+        return SimStopWatch(self.clock)
+
+    def wait(self, time):
+        self.clock.advance(time)
+
+    def Motor(self, port, positive_direction=None, gears=None):
+        if port not in self.motor_types:
+            raise OSError("No motor on port " + str(port))
+        if port not in self.motors:
+            max_speed = 1050
+            time_constant = 0.05
+            if self.motor_types[port] == "lego-ev3-m-motor":
+                max_speed = 1560
+                time_constant = 0.03
+            self.motors[port] = SimMotor(self.clock, port, max_speed, time_constant, self.motor_gains.get(port, 1.0),
+                                         self.motor_grip.get(port))
+        return self.motors[port]
+
+    def sensor(self, port, kind):
+        if self.sensor_types.get(port) != kind:
+            raise OSError("No " + kind + " sensor on port " + str(port))
+        if port not in self.sensors:
+            if kind == "lego-ev3-gyro":
+                self.sensors[port] = SimGyroSensor(self, port)
+            else:
+                self.sensors[port] = SimSensor(self, port)
+        return self.sensors[port]
+
+    def GyroSensor(self, port, positive_direction=None):
+        return self.sensor(port, "lego-ev3-gyro")
+
+    def ColorSensor(self, port):
+        return self.sensor(port, "lego-ev3-color")
+
+    def TouchSensor(self, port):
+        return self.sensor(port, "lego-ev3-touch")
+
+    def InfraredSensor(self, port):
+        return self.sensor(port, "lego-ev3-ir")
+
+    def UltrasonicSensor(self, port):
+        return self.sensor(port, "lego-ev3-us")
+
+    def open_input(self):
+        """
+        Returns the SimEventSource that plays the controller events.
+        """
+        return SimEventSource(self.clock, self.events)
+
+    def event_time_us(self):
+        """
+        Returns the time the controller events are stamped with, in microseconds.
+        """
+        return int(self.clock.now * 1000)
+
+    def heading(self):
+        """
+        How many degrees the robot has turned clockwise, from the B (left) and C (right) wheels.
+        """
+        if "B" not in self.motors or "C" not in self.motors:
+            return 0.0
+        left = self.motors["B"]
+        right = self.motors["C"]
+        left.update()
+        right.update()
+        return (left.position - right.position) * WHEEL_DIAMETER / (2 * AXLE_TRACK)
+
+    def turn_rate(self):
+        """
+        How fast the robot is turning clockwise, in degrees per second.
+        """
+        if "B" not in self.motors or "C" not in self.motors:
+            return 0.0
+        left = self.motors["B"]
+        right = self.motors["C"]
+        left.update()
+        right.update()
+        return (left.velocity - right.velocity) * WHEEL_DIAMETER / (2 * AXLE_TRACK)
+
+
+def get_backend(**sim_options):
+    """
+    Returns the PybricksBackend on the brick, or a SimBackend (made with sim_options)
+    everywhere else.  On a regular computer, the controller events for the simulator
+    can also come from a recording named in the EV3SIM_EVENTS environment variable.
+
+    example: backend = get_backend()
+    """
+    try:
+        return PybricksBackend()
+    except ImportError:
+        pass
+    if "events" not in sim_options:
+        import os
+        sim_options["events"] = os.environ.get("EV3SIM_EVENTS")
+    return SimBackend(**sim_options)
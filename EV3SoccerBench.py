@@ -0,0 +1,2048 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the EV3Soccer group of programs
+#
+# These run on a regular computer (python3 EV3SoccerBench.py), not on the brick.  A recorded
+# event file is replayed through the same code the robot uses, with fake motors standing in
+# for the real ones.  Pass the name of a recorded event file to use it instead of the made up
+# session, for example one copied off the brick with: cat /dev/input/event4 > session.bin
+
+import math
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+
+from EV3SoccerUtil import *
+from EV3SoccerInput import EventReader, InputSession, EVENT_FORMAT, EVENT_SIZE, EV_SYN, SYN_REPORT
+from EV3SoccerDevices import parse_input_devices, InputDevices
+from EV3SoccerMotors import MotorOutput, FakeMotor, DUTY_STEP
+from EV3SoccerControl import SoccerControl, FixedRateLoop, InputWatchdog, WATCHDOG_RAMP_MS
+from EV3SoccerMixing import DriveMixer, STICK_THRESHOLD, STICK_CENTER, build_trigger_table
+from EV3SoccerRecord import EventRecorder, replay
+from EV3SoccerBackend import SimBackend, SimScreen, SimClock, SimStopWatch, SimEventSource, WallClock
+from EV3SoccerScreen import Display
+from EV3SoccerLog import log, DEBUG, OFF
+from EV3SoccerAsync import Runtime, add_input_task
+from EV3SoccerGyro import GyroSampler, HeadingHold, HEADING_KP, HEADING_KI, HEADING_KD
+from EV3SoccerGyro import find_gyros, calibrate_gyros, CalibrationStore, CompensatedGyro, FusedGyro, GyroCalibration
+from EV3SoccerStraight import EncoderSampler, DriveStraight, STRAIGHT_KP, STRAIGHT_KI
+from EV3SoccerInventory import DeviceFolder, Inventory, SensorType, SENSOR_CLASSES, MotorType
+from EV3SoccerMotorTest import characterize, MotorResults, SWEEP_DUTIES
+from EV3SoccerSensorTest import FakeSensor, test_sensor, load, LOAD_PERIOD_MS
+from EV3SoccerMenu import Menu, MenuItem, run_menu
+from EV3SoccerTraction import SlewLimiter, TractionControl, RAMPS, TRACTION_GRIP, TRACTION_HEADROOM
+from EV3SoccerMux import InputMux, RoleRouter
+from EV3SoccerStats import InputLatency, TimedReader, LatencyHistogram, StageProfiler, STAGE_SCREEN, STAGE_LOG, \
+    STAGE_UNPACK, STAGE_DISPATCH, STAGE_MOTORS
+
+
+def check(ok, message):
+    """
+    Stops the benchmarks with an error when a check fails, so that the run ends
+    with a non-zero exit code.
+    """
+    if not ok:
+        raise AssertionError(message)
+
+
+def make_recording(path, frames=5000):
+    """
+    Writes a made up driving session to path.  The right stick sweeps around
+    while the triangle button is pressed now and then.  Every group of changes
+    ends with a sync event, just like the controller does it.
+    """
+    with open(path, "wb") as out:
+        for frame in range(frames):
+            t = frame * 0.004
+            sec = int(t)
+            usec = int((t - sec) * 1000000)
+            out.write(struct.pack(EVENT_FORMAT, sec, usec, EVENT_RANGE, CODE_RSTICK_HRANGE, (frame * 7) % 256))
+            out.write(struct.pack(EVENT_FORMAT, sec, usec, EVENT_RANGE, CODE_RSTICK_VRANGE, (frame * 3) % 256))
+            if frame % 500 == 0:
+                out.write(struct.pack(EVENT_FORMAT, sec, usec, EVENT_BUTTON, CODE_TRIANGLE, VALUE_BUTTON_PRESSED))
+            # Hold L1 for a while now and then to run the optional A motor
+            if frame % 250 == 0:
+                out.write(struct.pack(EVENT_FORMAT, sec, usec, EVENT_BUTTON, CODE_L1, (frame // 250) % 2))
+            out.write(struct.pack(EVENT_FORMAT, sec, usec, EV_SYN, SYN_REPORT, 0))
+
+
+def arcade(stick_x, stick_y, left_motor, right_motor):
+    # Same arcade mixing as EV3Soccer
+    forward = scale(stick_y, (0,255), (100,-100))
+    left = scale(stick_x, (0,255), (100,-100))
+    if abs(forward) < 10 and abs(left) < 10:
+        forward = 0
+        left = 0
+    left_motor.dc(forward - left)
+    right_motor.dc(forward + left)
+
+
+def per_event_loop(in_file, left_motor, right_motor, lags):
+    # The way EV3Soccer used to do it.  One read, one unpack and the motors for every event.
+    # Returns the number of reads from the file
+    stick_x = 128
+    stick_y = 128
+    reads = 1
+    event = in_file.read(EVENT_SIZE)
+    while event:
+        (tv_sec, tv_usec, ev_type, code, value) = struct.unpack(EVENT_FORMAT, event)
+        if ev_type == EVENT_RANGE and code == CODE_RSTICK_HRANGE:
+            stick_x = value
+        if ev_type == EVENT_RANGE and code == CODE_RSTICK_VRANGE:
+            stick_y = value
+        arcade(stick_x, stick_y, left_motor, right_motor)
+        lags.append(time.time() - tv_sec - tv_usec / 1000000)
+        reads += 1
+        event = in_file.read(EVENT_SIZE)
+    return reads
+
+
+def batched_loop(in_file, left_motor, right_motor, lags):
+    # The batched reader, with the motors updated once per sync event.  Returns the number
+    # of reads from the file
+    stick_x = 128
+    stick_y = 128
+    reader = EventReader(in_file)
+    event = reader.read()
+    while event:
+        (tv_sec, tv_usec, ev_type, code, value) = event
+        if ev_type == EVENT_RANGE and code == CODE_RSTICK_HRANGE:
+            stick_x = value
+        if ev_type == EVENT_RANGE and code == CODE_RSTICK_VRANGE:
+            stick_y = value
+        if ev_type == EV_SYN and code == SYN_REPORT and not reader.pending():
+            arcade(stick_x, stick_y, left_motor, right_motor)
+            lags.append(time.time() - tv_sec - tv_usec / 1000000)
+        event = reader.read()
+    return reader.fills
+
+
+def replay_into_pipe(path, write_fd, seconds=None):
+    # Push the recording into the pipe one group of events at a time, as fast as the
+    # pipe takes them.  The timestamps are replaced with the time the group was sent,
+    # the same as the kernel does when the controller event arrives.
+    # With seconds, the groups are sent at the times they were recorded, up to that many seconds in
+    with open(path, "rb") as recording:
+        data = recording.read()
+    frame = bytearray()
+    first = None
+    start = time.perf_counter()
+    for offset in range(0, len(data) - EVENT_SIZE + 1, EVENT_SIZE):
+        (tv_sec, tv_usec, ev_type, code, value) = struct.unpack_from(EVENT_FORMAT, data, offset)
+        frame += struct.pack(EVENT_FORMAT, 0, 0, ev_type, code, value)
+        if ev_type == EV_SYN and code == SYN_REPORT:
+            if seconds is not None:
+                recorded = tv_sec + tv_usec / 1000000
+                if first is None:
+                    first = recorded
+                if recorded - first > seconds:
+                    break
+                delay = start + recorded - first - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.time()
+            sec = int(now)
+            usec = int((now - sec) * 1000000)
+            for event_start in range(0, len(frame), EVENT_SIZE):
+                struct.pack_into('ll', frame, event_start, sec, usec)
+            os.write(write_fd, frame)
+            frame = bytearray()
+    os.close(write_fd)
+
+
+def bench_reader(path, write_cost_us=100):
+    """
+    Replays the recording through the old per event loop and the batched
+    reader.  Reports events per second and the lag from input to motor command.
+    """
+    print("Reader benchmark (" + str(write_cost_us) + "us per motor write)")
+    events = os.path.getsize(path) // EVENT_SIZE
+    results = {}
+    for name, loop in (("per event", per_event_loop), ("batched", batched_loop)):
+        read_fd, write_fd = os.pipe()
+        writer = threading.Thread(target=replay_into_pipe, args=(path, write_fd))
+        in_file = open(read_fd, "rb")
+        left_motor = FakeMotor(write_cost_us)
+        right_motor = FakeMotor(write_cost_us)
+        lags = []
+        start = time.perf_counter()
+        writer.start()
+        reads = loop(in_file, left_motor, right_motor, lags)
+        elapsed = time.perf_counter() - start
+        writer.join()
+        in_file.close()
+        lags.sort()
+        writes = left_motor.writes + right_motor.writes
+        print("  %-10s %9.0f events/s  lag avg %7.2f ms  p99 %7.2f ms  max %7.2f ms  motor writes %d  reads %d" % (
+            name, events / elapsed, 1000 * sum(lags) / len(lags), 1000 * lags[len(lags) * 99 // 100],
+            1000 * lags[-1], writes, reads))
+        results[name] = (reads, writes, sum(lags) / len(lags))
+    (reads, writes, lag) = results["batched"]
+    # The writer sends whole frames of three events or more, and each read takes at least one
+    check(reads <= events // 3, "the batched reader read %d times for %d events" % (reads, events))
+    check(writes < results["per event"][1], "batching wrote to the motors %d times, every event %d" %
+          (writes, results["per event"][1]))
+    check(lag < results["per event"][2], "batching did not cut the lag")
+
+
+def replay_session(path, motor_a, left_motor, right_motor, flush):
+    # Replays the recording through the EV3Soccer motor logic, one frame at a time
+    stick_x = 128
+    stick_y = 128
+    l1 = 0
+    with open(path, "rb") as in_file:
+        reader = EventReader(in_file)
+        event = reader.read()
+        while event:
+            (tv_sec, tv_usec, ev_type, code, value) = event
+            if ev_type == EVENT_RANGE and code == CODE_RSTICK_HRANGE:
+                stick_x = value
+            if ev_type == EVENT_RANGE and code == CODE_RSTICK_VRANGE:
+                stick_y = value
+            if ev_type == EVENT_BUTTON and code == CODE_L1:
+                l1 = value
+            if ev_type == EV_SYN and code == SYN_REPORT:
+                if l1 == 1:
+                    motor_a.dc(100)
+                else:
+                    motor_a.dc(0)
+                arcade(stick_x, stick_y, left_motor, right_motor)
+                flush()
+            event = reader.read()
+
+
+class PortMotor():
+    # Lets arcade() call dc() on a MotorOutput port as if it were a motor
+    def __init__(self, outputs, port):
+        self.outputs = outputs
+        self.port = port
+
+    def dc(self, duty):
+        self.outputs.dc(self.port, duty)
+
+
+def bench_motor_output(path):
+    """
+    Replays the recording with every dc() going straight to the motors, and then
+    through MotorOutput with a few step sizes.  Reports the motor writes saved.
+    """
+    print("Motor output benchmark")
+    motors = [FakeMotor(), FakeMotor(), FakeMotor()]
+    replay_session(path, motors[0], motors[1], motors[2], lambda: None)
+    direct = sum(motor.writes for motor in motors)
+    print("  direct       motor writes %6d" % direct)
+    written = {}
+    for step in (0, DUTY_STEP, 2 * DUTY_STEP):
+        motors = [FakeMotor(), FakeMotor(), FakeMotor()]
+        outputs = MotorOutput(step)
+        for port, motor in zip("ABC", motors):
+            outputs.add(port, motor)
+        replay_session(path, PortMotor(outputs, "A"), PortMotor(outputs, "B"), PortMotor(outputs, "C"), outputs.flush)
+        outputs.stop()
+        written[step] = sum(motor.writes for motor in motors)
+        print("  step %-3d     motor writes %6d  skipped %6d  saved %5.1f%%" % (
+            step, written[step], outputs.suppressed, 100.0 * (direct - written[step]) / direct))
+        check(outputs.writes == written[step], "MotorOutput counted %d writes, the motors got %d" % (outputs.writes, written[step]))
+        check(outputs.suppressed > 0, "step %d skipped no writes" % step)
+        check(not outputs.moving() and all(motor.duty == 0 for motor in motors), "stop() left a motor running")
+    check(written[0] < direct, "sending only the changes saved no writes")
+    check(written[DUTY_STEP] < written[0], "DUTY_STEP %d saved no writes over sending every change" % DUTY_STEP)
+
+
+def bench_fixed_rate(path, seconds=3, write_cost_us=100):
+    """
+    Replays the recording in real time through EV3Soccer's control logic, once
+    updating the motors for every group of events and once at 100 updates a second.
+    Reports the motor writes and the jitter of the fixed rate updates.
+    """
+    print("Fixed rate benchmark (" + str(seconds) + "s real time)")
+    writes = {}
+    for rate in (0, 100):
+        read_fd, write_fd = os.pipe()
+        writer = threading.Thread(target=replay_into_pipe, args=(path, write_fd, seconds))
+        in_file = open(read_fd, "rb")
+        outputs = MotorOutput()
+        outputs.add("B", FakeMotor(write_cost_us))
+        outputs.add("C", FakeMotor(write_cost_us))
+        control = SoccerControl(outputs, False, True, True, False)
+        reader = EventReader(in_file)
+        writer.start()
+        if rate:
+            loop = FixedRateLoop(SimStopWatch(WallClock()), 1000 // rate)
+            loop.run(reader, control.handle_event, control.update_motors)
+            name = "%d Hz" % rate
+        else:
+            event = reader.read()
+            while event:
+                control.handle_event(event[2], event[3], event[4])
+                if event[2] == EV_SYN and event[3] == SYN_REPORT and not reader.pending():
+                    control.update_motors()
+                event = reader.read()
+            name = "per frame"
+        writer.join()
+        in_file.close()
+        print("  %-10s motor writes %5d  skipped %5d" % (name, outputs.writes, outputs.suppressed))
+        writes[rate] = outputs.writes
+        check(outputs.suppressed >= 0, "%s skipped %d writes" % (name, outputs.suppressed))
+        if rate:
+            print("             " + loop.report())
+            # A busy computer can hold up a few updates, but the loop has to keep its rate
+            expected = seconds * rate
+            check(abs(loop.ticks + loop.overruns - expected) <= expected // 10,
+                  "%s ran %d updates and missed %d in %ds" % (name, loop.ticks, loop.overruns, seconds))
+            check(loop.overruns <= loop.ticks // 20, "%s missed %d of %d updates" % (name, loop.overruns, loop.ticks))
+            check(loop.jitter_total <= loop.ticks * loop.period_ms / 2,
+                  "%s updates were late by %.1fms on average" % (name, loop.jitter_total / loop.ticks))
+    check(writes[100] < writes[0], "updating at 100 Hz wrote to the motors more often than every frame")
+
+
+def scale_arcade(stick_x, stick_y, turn_multiplier):
+    # The arcade mixing the way EV3Soccer did it with scale()
+    forward = scale(stick_y, (0,255), (100,-100))
+    left = scale(stick_x, (0,255), (100,-100))
+    if (abs(forward) < STICK_THRESHOLD and abs(left) < STICK_THRESHOLD ) :
+        forward = 0
+        left = 0
+    return (forward - left*turn_multiplier/100, forward + left*turn_multiplier/100)
+
+
+def scale_tank(left_stick_y, right_stick_y):
+    # The tank mixing the way EV3Soccer did it with scale()
+    right_speed = scale(right_stick_y, (0,255), (100,-100))
+    left_speed = scale(left_stick_y, (0,255), (100,-100))
+    if abs(right_speed) < STICK_THRESHOLD and abs(left_speed) < STICK_THRESHOLD:
+        right_speed = 0
+        left_speed = 0
+    return (left_speed, right_speed)
+
+
+def bench_mixing(rounds=20):
+    """
+    Checks that the lookup tables give the same duty cycles as scale() for every
+    stick position and turn multiplier (give or take rounding), then times both.
+    """
+    print("Mixing benchmark")
+    mixer = DriveMixer()
+    worst = 0
+    for turn_multiplier in range(10, 101, 10):
+        for x in range(256):
+            for y in range(256):
+                expected = scale_arcade(x, y, turn_multiplier)
+                got = mixer.arcade(x, y, turn_multiplier)
+                worst = max(worst, abs(expected[0] - got[0]), abs(expected[1] - got[1]))
+                expected = scale_tank(x, y)
+                got = mixer.tank(x, y)
+                worst = max(worst, abs(expected[0] - got[0]), abs(expected[1] - got[1]))
+    print("  largest difference from scale(): %.3f" % worst)
+    check(worst <= 1, "the tables are %.3f off scale()" % worst)
+
+    sticks = [(x, (x * 37) % 256) for x in range(256)]
+    for name, arcade_mix in (("scale()", scale_arcade), ("tables", mixer.arcade)):
+        start = time.perf_counter()
+        for i in range(rounds):
+            for (x, y) in sticks:
+                arcade_mix(x, y, 70)
+        elapsed = time.perf_counter() - start
+        print("  %-10s %7.3f us per arcade mix" % (name, 1000000 * elapsed / (rounds * len(sticks))))
+
+
+class ChainState():
+    # The controller state the old if-chain updated
+    def __init__(self):
+        self.right_stick_x = STICK_CENTER
+        self.right_stick_y = STICK_CENTER
+        self.left_stick_y = STICK_CENTER
+        self.turn_multiplier = 100
+        self.ctrltype = "Arc"
+        self.ctrlchange = False
+        self.left_button_up_pressing = 0
+        self.left_button_down_pressing = 0
+        self.right_button_up_pressing = 0
+        self.right_button_down_pressing = 0
+
+
+def if_chain(state, ev_type, code, value):
+    # The way EV3Soccer used to sort out events.  Every event goes through every test
+    if ev_type == EVENT_RANGE and code == CODE_RSTICK_HRANGE:
+        state.right_stick_x = value
+    if ev_type == EVENT_RANGE and code == CODE_RSTICK_VRANGE:
+        state.right_stick_y = value
+    if ev_type == EVENT_RANGE and code == CODE_LSTICK_VRANGE:
+        state.left_stick_y = value
+    if ev_type == EVENT_BUTTON and code == CODE_CIRCLE and value == VALUE_BUTTON_PRESSED:
+        state.turn_multiplier = min( (state.turn_multiplier + 10), 100 )
+        state.ctrlchange = True
+    if ev_type == EVENT_BUTTON and code == CODE_SQUARE and value == VALUE_BUTTON_PRESSED:
+        state.ctrlchange = True
+        state.turn_multiplier = max( (state.turn_multiplier - 10), 10 )
+    if ev_type == EVENT_BUTTON and code == CODE_TRIANGLE and value == VALUE_BUTTON_PRESSED:
+        state.ctrlchange = True
+        if state.ctrltype == "Arc":
+            state.ctrltype = "Tank"
+        else:
+            state.ctrltype = "Arc"
+    if ev_type == EVENT_BUTTON and code == CODE_L1:
+        state.left_button_up_pressing = value
+    if ev_type == EVENT_BUTTON and code == CODE_L2:
+        state.left_button_down_pressing = value
+    if ev_type == EVENT_BUTTON and code == CODE_R1:
+        state.right_button_up_pressing = value
+    if ev_type == EVENT_BUTTON and code == CODE_R2:
+        state.right_button_down_pressing = value
+
+
+def bench_dispatch(path, rounds=9):
+    """
+    Times how long it takes to sort out one controller event with the old
+    if-chain and with the EventDispatcher, using the events in the recording.
+    """
+    print("Dispatch benchmark")
+    events = []
+    with open(path, "rb") as in_file:
+        reader = EventReader(in_file)
+        event = reader.read()
+        while event:
+            events.append((event[2], event[3], event[4]))
+            event = reader.read()
+
+    # The best of several rounds each, taking turns, so something else running on the
+    # computer does not decide which one wins
+    state = ChainState()
+    control = SoccerControl(MotorOutput(), False, True, True, False)
+    dispatch = control.dispatcher.dispatch
+    chain_time = None
+    dict_time = None
+    for i in range(rounds):
+        start = time.perf_counter()
+        for (ev_type, code, value) in events:
+            if_chain(state, ev_type, code, value)
+        elapsed = time.perf_counter() - start
+        if chain_time is None or elapsed < chain_time:
+            chain_time = elapsed
+
+        start = time.perf_counter()
+        for (ev_type, code, value) in events:
+            dispatch(ev_type, code, value)
+        elapsed = time.perf_counter() - start
+        if dict_time is None or elapsed < dict_time:
+            dict_time = elapsed
+
+    check((state.right_stick_x, state.right_stick_y, state.ctrltype) ==
+          (control.right_stick_x, control.right_stick_y, control.ctrltype),
+          "the dispatcher ended up in a different state than the if-chain")
+    print("  if-chain   %7.3f us per event" % (1000000 * chain_time / len(events)))
+    print("  dispatcher %7.3f us per event" % (1000000 * dict_time / len(events)))
+    check(dict_time < chain_time, "the dispatcher is no faster than the if-chain")
+
+
+def stall_writer(write_fd, stall_ms):
+    # Full forward on the right stick, then nothing at all for stall_ms, then the stick again
+    def send(code, value):
+        os.write(write_fd, struct.pack(EVENT_FORMAT, 0, 0, EVENT_RANGE, code, value) +
+                 struct.pack(EVENT_FORMAT, 0, 0, EV_SYN, SYN_REPORT, 0))
+    send(CODE_RSTICK_VRANGE, 0)
+    time.sleep(stall_ms / 1000)
+    send(CODE_RSTICK_VRANGE, 1)
+    time.sleep(0.2)
+    os.close(write_fd)
+
+
+def bench_watchdog(timeout_ms=300, stall_ms=1000):
+    """
+    Sends full forward and then stalls the event stream, with the fixed rate loop
+    and the input watchdog running.  Reports when the motors reached 0, and when
+    they were back after the stall.  Also times one watchdog check.
+    """
+    print("Watchdog benchmark (" + str(timeout_ms) + "ms timeout, " + str(stall_ms) + "ms stall)")
+    read_fd, write_fd = os.pipe()
+    in_file = open(read_fd, "rb")
+    outputs = MotorOutput()
+    motor = FakeMotor()
+    outputs.add("B", motor)
+    control = SoccerControl(outputs, False, True, False, False)
+    clock = SimStopWatch(WallClock())
+    control.watchdog = InputWatchdog(clock, timeout_ms)
+    trace = []
+
+    def tick():
+        control.update_motors()
+        trace.append((clock.time(), motor.duty))
+
+    writer = threading.Thread(target=stall_writer, args=(write_fd, stall_ms))
+    writer.start()
+    FixedRateLoop(clock, 10).run(EventReader(in_file), control.handle_event, tick)
+    writer.join()
+    in_file.close()
+
+    stopped = None
+    resumed = None
+    for (when, duty) in trace:
+        if stopped is None and duty == 0 and when > 0:
+            stopped = when
+        if stopped is not None and resumed is None and duty != 0:
+            resumed = when
+    print("  stopped at %s ms, moving again at %s ms, trips %d" % (stopped, resumed, control.watchdog.trips))
+    # Stopped once the timeout and the ramp are over, and moving as soon as the stick is back
+    due = timeout_ms + WATCHDOG_RAMP_MS
+    check(stopped is not None and due - 20 <= stopped <= due + 150,
+          "the motors stopped at %s ms instead of %d ms" % (stopped, due))
+    check(resumed is not None and stall_ms <= resumed <= stall_ms + 150,
+          "the motors were moving again at %s ms instead of %d ms" % (resumed, stall_ms))
+    check(control.watchdog.trips == 1, "the watchdog tripped %d times" % control.watchdog.trips)
+
+    watchdog = InputWatchdog(clock, timeout_ms)
+    start = time.perf_counter()
+    for i in range(100000):
+        watchdog.percent()
+    print("  %.3f us per watchdog check" % ((time.perf_counter() - start) * 10))
+
+
+def bench_replay(path, ring_events=4096):
+    """
+    Records the session through a small ring, checks that the saved file holds
+    exactly the newest events, then replays the whole session as fast as possible
+    through SoccerControl with fake motors.
+    """
+    print("Record and replay benchmark")
+    saved = "/tmp/ev3soccer_recorded.bin"
+    recorder = EventRecorder(saved, ring_events)
+    with open(path, "rb") as in_file:
+        reader = EventReader(in_file)
+        reader.recorder = recorder
+        while reader.fill():
+            pass
+    recorder.save()
+    with open(path, "rb") as original, open(saved, "rb") as copy:
+        newest = original.read()[-ring_events * EVENT_SIZE:]
+        check(copy.read() == newest, "the recording does not match the newest events")
+    print("  recorded %d events, kept the newest %d" % (recorder.events, ring_events))
+
+    outputs = MotorOutput()
+    for port in "ABCD":
+        outputs.add(port, FakeMotor())
+    control = SoccerControl(outputs, True, True, True, True)
+    start = time.perf_counter()
+    events = replay(path, control)
+    elapsed = time.perf_counter() - start
+    print("  replay %9.0f events/s  motor writes %d  skipped %d" % (events / elapsed, outputs.writes, outputs.suppressed))
+
+
+def recording_seconds(path):
+    # Seconds from the first event in the recording to the last
+    with open(path, "rb") as in_file:
+        data = in_file.read()
+    first = struct.unpack_from(EVENT_FORMAT, data, 0)
+    last = struct.unpack_from(EVENT_FORMAT, data, len(data) - EVENT_SIZE)
+    return (last[0] - first[0]) + (last[1] - first[1]) / 1000000
+
+
+def bench_sim(path):
+    """
+    Drives the simulated robot through the whole session on the simulator's
+    clock, once with the event loop EV3Soccer uses by default and once with the
+    100 Hz control loop.  Shows how much faster than real time the simulator
+    runs, and where the robot ended up.  The virtual motors work out their angle
+    from the time since they were last used, so time with no events costs nothing
+    in the event loop.
+    """
+    print("Simulator benchmark")
+    # The simulated time is how long the recording runs for
+    recorded = recording_seconds(path)
+    states = []
+    for rate in (0, 100):
+        backend = SimBackend(events=path)
+        outputs = MotorOutput()
+        outputs.add("B", backend.Motor(backend.Port.B))
+        outputs.add("C", backend.Motor(backend.Port.C))
+        control = SoccerControl(outputs, False, True, True, False)
+        source = backend.open_input()
+        start = time.perf_counter()
+        if rate:
+            loop = FixedRateLoop(backend.StopWatch(), 1000 // rate)
+            loop.run(source, control.handle_event, control.update_motors)
+            name = "%d Hz loop" % rate
+        else:
+            event = source.read()
+            while event:
+                control.handle_event(event[2], event[3], event[4])
+                if event[2] == EV_SYN and event[3] == SYN_REPORT and not source.pending():
+                    control.update_motors()
+                event = source.read()
+            name = "event loop"
+        elapsed = time.perf_counter() - start
+        simulated = backend.clock.now / 1000
+        print("  %-11s simulated %.1f s in %.3f s  (%.0fx real time)  heading %.0f degrees" %
+              (name, simulated, elapsed, simulated / elapsed, backend.heading()))
+        check(abs(simulated - recorded) <= 0.1, "%s simulated %.2f s of a %.2f s recording" % (name, simulated, recorded))
+        check(simulated > 10 * elapsed, "%s ran only %.1fx real time" % (name, simulated / elapsed))
+        check(backend.heading() != 0, "%s never turned the robot" % name)
+        states.append((control.right_stick_x, control.right_stick_y, control.ctrltype, control.turn_multiplier))
+        backend.close()
+    check(states[0] == states[1], "the two loops ended with different controller states: %s" % states)
+
+
+def bench_display(path):
+    """
+    Plays the session into a fake screen the way EV3Tester shows every event and
+    EV3Soccer shows the drive mode: once drawing straight onto the screen for every
+    change, and once through a Display.  Counts the draw calls.
+    """
+    print("Screen drawing benchmark")
+    draws = {}
+    shown = {}
+    for buffered in (False, True):
+        backend = SimBackend(events=path)
+        screen = SimScreen()
+        display = Display(screen, backend.StopWatch())
+        control = SoccerControl(MotorOutput(), False, False, False, False)
+        source = backend.open_input()
+        updates = 0
+        start = time.perf_counter()
+        event = source.read()
+        while event or not source.eof:
+            if event is not None:
+                (tv_sec, tv_usec, ev_type, code, value) = event
+                control.handle_event(ev_type, code, value)
+                if ev_type != 0:
+                    updates += 1
+                    outtext = str(ev_type) + ":" + str(code) + ":" + str(value)
+                    if buffered:
+                        display.text(10, 100, outtext)
+                    else:
+                        screen.draw_text(10, 100, outtext + "     ")
+                if control.ctrlchange:
+                    status = "Turn:" + str(control.turn_multiplier) + "% " + control.ctrltype
+                    if buffered:
+                        display.text(1, 80, status)
+                    else:
+                        screen.draw_text(1, 80, status + "    ")
+                    control.ctrlchange = False
+            if buffered and not source.pending():
+                display.flush()
+            event = source.read(display.due_in() if buffered else -1)
+        display.flush(force=True)
+        elapsed = time.perf_counter() - start
+        name = "display" if buffered else "direct"
+        print("  %-8s %6d changes  %6d draw calls  (%.1f per simulated second)  %.3f s" %
+              (name, updates, screen.draws, screen.draws * 1000 / backend.clock.now, elapsed))
+        draws[name] = screen.draws
+        shown[name] = dict((spot, text.rstrip()) for (spot, text) in screen.cells.items())
+        if buffered:
+            # At most the two lines of text every interval, and once more at the end
+            most = 2 * (backend.clock.now // display.interval_ms + 2)
+            check(screen.draws <= most, "the display drew %d times, at most %d expected" % (screen.draws, most))
+        backend.close()
+    check(draws["display"] < draws["direct"] // 10, "the display only cut the draws from %d to %d" %
+          (draws["direct"], draws["display"]))
+    check(shown["display"] == shown["direct"], "the screens ended up different: %s" % shown)
+
+
+class PrintingControl(SoccerControl):
+    """
+    SoccerControl the way it used to print every event straight away.
+    """
+    def handle_event(self, ev_type, code, value):
+        if ev_type != 0:
+            outtext = str(ev_type) + ":" + str(code) + ":" + str(value)
+            print(outtext)
+        SoccerControl.handle_event(self, ev_type, code, value)
+
+
+class SlowConsole():
+    """
+    Stands in for the VS Code debug console.  Every write takes write_cost_us.
+    """
+    def __init__(self, write_cost_us):
+        self.write_cost_us = write_cost_us
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        end = time.perf_counter() + self.write_cost_us / 1000000
+        while time.perf_counter() < end:
+            pass
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def bench_logging(path, write_cost_us=100):
+    """
+    Replays the session with every event printed straight away, and with the log
+    off, on but never written out, and on and written out in small pieces the way
+    the program does it.  Printing goes to a console where every write takes
+    write_cost_us.
+    """
+    print("Logging benchmark")
+    saved_stdout = sys.stdout
+    rates = {}
+    writes = {}
+    for name in ("print", "off", "kept", "written"):
+        outputs = MotorOutput()
+        for port in "BC":
+            outputs.add(port, FakeMotor())
+        if name == "print":
+            control = PrintingControl(outputs, False, True, True, False)
+            log.set_level(OFF)
+        else:
+            control = SoccerControl(outputs, False, True, True, False)
+            log.set_level(OFF if name == "off" else DEBUG)
+        log.clock = SimStopWatch(WallClock())
+        log.last = 0
+        console = SlowConsole(write_cost_us)
+        sys.stdout = console
+        try:
+            start = time.perf_counter()
+            if name == "written":
+                events = replay_with_flush(path, control)
+            else:
+                events = replay(path, control)
+            elapsed = time.perf_counter() - start
+            log.flush(0)
+        finally:
+            sys.stdout = saved_stdout
+        print("  %-8s %9.0f events/s  console writes %d  log records %d  dropped %d" %
+              (name, events / elapsed, console.writes, log.records, log.dropped))
+        rates[name] = events / elapsed
+        writes[name] = console.writes
+        # However many records come in, the ring stays the same size and loses the oldest
+        check(len(log.times) == len(log.levels) == len(log.formats) == len(log.arguments) == log.size,
+              "%s: the log ring grew past %d records" % (name, log.size))
+        check(log.waiting == 0 and log.records == log.written + log.dropped,
+              "%s: %d records, %d written, %d dropped" % (name, log.records, log.written, log.dropped))
+        if name == "off" or name == "print":
+            check(log.records == 0, "%s: kept %d log records" % (name, log.records))
+        elif name == "kept":
+            check(log.written == min(log.records, log.size), "kept: wrote %d of %d records" % (log.written, log.records))
+        else:
+            check(log.dropped == 0, "written: dropped %d records" % log.dropped)
+        log.records = log.written = log.dropped = log.waiting = 0
+    log.set_level(OFF)
+    log.clock = None
+    check(writes["off"] == 0 and writes["written"] < writes["print"] // 10,
+          "the console was written %d times with the log off, %d written out, %d printing" %
+          (writes["off"], writes["written"], writes["print"]))
+    check(rates["off"] > rates["print"] and rates["written"] > rates["print"], "logging was slower than printing")
+
+
+def replay_with_flush(path, control):
+    # replay(), with the log written out after every group of events like EV3Soccer does
+    events = 0
+    with open(path, "rb") as in_file:
+        reader = EventReader(in_file)
+        event = reader.read()
+        while event:
+            control.handle_event(event[2], event[3], event[4])
+            if event[2] == EV_SYN and event[3] == SYN_REPORT:
+                control.update_motors()
+                log.flush()
+            events += 1
+            event = reader.read()
+    return events
+
+
+def busy(ms):
+    # Keeps the processor busy for ms milliseconds, like a slow screen update or sensor read
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+def bench_tasks(path, seconds=2, screen_ms=5, sensor_ms=1):
+    """
+    Runs the program's tasks with the runtime.  First for real, with a screen
+    task that takes screen_ms and a sensor task that takes sensor_ms each turn,
+    to show how late the drive task gets.  Then the whole session on the
+    simulator, to show how fast it goes.
+    """
+    print("Task runtime benchmark")
+    clock = SimStopWatch(WallClock())
+    runtime = Runtime(clock)
+    outputs = MotorOutput()
+    for port in "ABCD":
+        outputs.add(port, FakeMotor(write_cost_us=100))
+    control = SoccerControl(outputs, True, True, True, True)
+
+    def stop_later():
+        if clock.time() >= seconds * 1000:
+            runtime.stop()
+
+    drive = runtime.every("drive", 10, control.update_drive)
+    runtime.every("attachments", 20, control.update_attachments)
+    runtime.every("screen", 100, lambda: busy(screen_ms))
+    runtime.every("sensor", 20, lambda: busy(sensor_ms))
+    runtime.every("stop", 100, stop_later)
+    runtime.run()
+    for line in runtime.report().split("\n"):
+        print("  " + line)
+    # Every task keeps its rate, and the slow ones only hold up the drive a little
+    for (stats, function) in runtime.tasks:
+        expected = seconds * 1000 // stats.period_ms + 1
+        check(abs(stats.runs + stats.overruns - expected) <= expected // 10 + 1,
+              "%s ran %d times and missed %d, %d expected" % (stats.name, stats.runs, stats.overruns, expected))
+    check(drive.overruns <= drive.runs // 20, "drive missed %d of %d turns" % (drive.overruns, drive.runs))
+    check(drive.late_total <= drive.runs * (screen_ms + sensor_ms) / 2,
+          "drive was late by %.1fms on average" % (drive.late_total / drive.runs))
+
+    backend = SimBackend(events=path)
+    outputs = MotorOutput()
+    outputs.add("B", backend.Motor(backend.Port.B))
+    outputs.add("C", backend.Motor(backend.Port.C))
+    control = SoccerControl(outputs, False, True, True, False)
+    runtime = Runtime(backend.StopWatch(), backend.wait)
+    add_input_task(runtime, backend.open_input(), control.handle_event)
+    drive = runtime.every("drive", 10, control.update_drive)
+    runtime.every("screen", 100, lambda: None)
+    start = time.perf_counter()
+    runtime.run()
+    elapsed = time.perf_counter() - start
+    simulated = backend.clock.now / 1000
+    print("  simulator  simulated %.1f s in %.3f s  (%.0fx real time)  heading %.0f degrees" %
+          (simulated, elapsed, simulated / elapsed, backend.heading()))
+    backend.close()
+    # On the simulator's clock nothing is ever late
+    recorded = recording_seconds(path)
+    check(abs(simulated - recorded) <= 0.1, "simulated %.2f s of a %.2f s recording" % (simulated, recorded))
+    check(simulated > 10 * elapsed, "the simulator ran only %.1fx real time" % (simulated / elapsed))
+    check(drive.late_max == 0 and drive.overruns == 0, "drive was late on the simulator: " + drive.report())
+
+
+def drive_straight(gains, seconds=10, drift=0.2, noise=0.5, weak_right=0.9):
+    """
+    Drives the simulated robot full speed ahead in arcade mode with the steering
+    stick in the middle for seconds, with a right motor weak_right as strong as the
+    left one.  gains is (kp, ki, kd), or None for no heading hold.  Returns the worst
+    and the final heading error, in degrees, from where the robot really points.
+    """
+    backend = SimBackend(sensors={"1": "lego-ev3-gyro"}, gyro_drift=drift, gyro_noise=noise)
+    backend.motor_gains["C"] = weak_right
+    outputs = MotorOutput()
+    outputs.add("B", backend.Motor(backend.Port.B))
+    outputs.add("C", backend.Motor(backend.Port.C))
+    control = SoccerControl(outputs, False, True, True, False)
+    if gains is not None:
+        sampler = GyroSampler(backend.GyroSensor(backend.Port.S1), backend.StopWatch())
+        control.heading_hold = HeadingHold(sampler, gains[0], gains[1], gains[2])
+    control.handle_event(EVENT_RANGE, CODE_RSTICK_HRANGE, 128)
+    control.handle_event(EVENT_RANGE, CODE_RSTICK_VRANGE, 0)
+    worst = 0
+    for tick in range(seconds * 100):
+        control.update_motors()
+        backend.wait(10)
+        error = abs(backend.heading())
+        if error > worst:
+            worst = error
+    backend.close()
+    return (worst, backend.heading())
+
+
+def bench_heading():
+    """
+    How far off course the robot gets driving straight with a weak right motor,
+    without the heading hold and with a few sets of gains.  The gyro drifts and
+    is noisy, so even a perfect hold ends up off by the drift (2 degrees).
+    """
+    print("Heading hold benchmark (10 s full speed, gyro drift 0.2 deg/s)")
+    print("                         right motor 90%          right motor 70%")
+    for gains in (None, (1.0, 0, 0), (3.0, 0, 0), (3.0, 1.0, 0.1), (HEADING_KP, HEADING_KI, HEADING_KD), (20.0, 4.0, 1.0)):
+        (worst, final) = drive_straight(gains)
+        (weak_worst, weak_final) = drive_straight(gains, weak_right=0.7)
+        if gains is None:
+            name = "no hold"
+        else:
+            name = "kp %.1f ki %.1f kd %.1f" % gains
+        print("  %-22s worst %5.1f final %6.1f  worst %5.1f final %6.1f" % (name, worst, final, weak_worst, weak_final))
+        if gains is None:
+            check(worst > 45 and weak_worst > 45, "the robot drove straight without the heading hold")
+        elif gains == (HEADING_KP, HEADING_KI, HEADING_KD):
+            # Off by no more than the gyro drifted, with either motor
+            check(max(worst, weak_worst) <= 3 and max(abs(final), abs(weak_final)) <= 2.5,
+                  "the default gains let the robot get %.1f degrees off" % max(worst, weak_worst))
+
+
+def gyro_trace_run(which, drifts=(0.4, -0.2), noises=(1.0, 0.3), seconds=30, budget_ms=1000):
+    """
+    Calibrates two drifting simulated gyros, then drives straight for seconds with
+    the heading hold on the raw front gyro ("raw"), the compensated front gyro
+    ("front"), or both fused ("fused").  Returns (calibrations, final heading error).
+    """
+    backend = SimBackend(sensors={"1": "lego-ev3-gyro", "2": "lego-ev3-gyro"})
+    backend.motor_gains["C"] = 0.9
+    gyros = find_gyros(backend)
+    for i in range(len(gyros)):
+        gyros[i][1].drift = drifts[i]
+        gyros[i][1].noise = noises[i]
+    clock = backend.StopWatch()
+    store = CalibrationStore("/tmp/ev3soccer_gyro_calibration.txt")
+    results = calibrate_gyros(gyros, clock, backend.wait, store, budget_ms)
+    calibrations = [(calibration, clock.time()) for (port, gyro, calibration) in results]
+    compensated = [CompensatedGyro(gyro, calibration, clock) for (port, gyro, calibration) in results]
+    if which == "raw":
+        gyro = gyros[0][1]
+    elif which == "front":
+        gyro = compensated[0]
+    else:
+        gyro = FusedGyro(compensated)
+
+    outputs = MotorOutput()
+    outputs.add("B", backend.Motor(backend.Port.B))
+    outputs.add("C", backend.Motor(backend.Port.C))
+    control = SoccerControl(outputs, False, True, True, False)
+    control.heading_hold = HeadingHold(GyroSampler(gyro, backend.StopWatch()))
+    control.handle_event(EVENT_RANGE, CODE_RSTICK_HRANGE, 128)
+    control.handle_event(EVENT_RANGE, CODE_RSTICK_VRANGE, 0)
+    for tick in range(seconds * 100):
+        control.update_motors()
+        backend.wait(10)
+    backend.close()
+    return (calibrations, backend.heading())
+
+
+def bench_gyro_calibration():
+    """
+    Checks the calibration against simulated gyros with a known drift, and shows
+    how far off course the heading hold gets in 30 s with and without it.  Checks
+    that the drift found is within 0.1 deg/s of the real one, that the compensated
+    gyros end up far closer to the course than the raw one, and that measuring
+    again at rest gets closer still.
+    """
+    drifts = (0.4, -0.2)
+    print("Gyro calibration benchmark (drift 0.4 and -0.2 deg/s, noise 1.0 and 0.3)")
+    (calibrations, raw_final) = gyro_trace_run("raw", drifts)
+    for ((calibration, took), drift) in zip(calibrations, drifts):
+        print("  " + str(calibration) + "  done at " + str(took) + " ms")
+        check(abs(calibration.drift - drift) <= 0.1, "calibration found a drift of %.3f deg/s, really %.1f" %
+              (calibration.drift, drift))
+    print("  raw front gyro      final heading %6.1f degrees" % raw_final)
+    for which in ("front", "fused"):
+        (calibrations, final) = gyro_trace_run(which, drifts)
+        print("  %-19s final heading %6.1f degrees" % (which + " compensated" if which == "front" else "both fused", final))
+        check(abs(final) < abs(raw_final) / 4, "the %s gyro ended %.1f degrees off course, the raw one %.1f" %
+              (which, final, raw_final))
+    # Drift measured again every second while sitting still
+    backend = SimBackend(sensors={"1": "lego-ev3-gyro"}, gyro_drift=0.4, gyro_noise=1.0)
+    (port, raw) = find_gyros(backend)[0]
+    clock = backend.StopWatch()
+    gyro = CompensatedGyro(raw, calibrate_gyros([(port, raw)], clock, backend.wait, None, 200)[0][2], clock)
+    before = gyro.drift
+    rate = 0
+    for tick in range(2000):
+        gyro.at_rest()
+        rate += gyro.speed()
+        backend.wait(10)
+    rate /= 2000
+    print("  at rest for 20 s    drift estimate %.3f -> %.3f deg/s (really 0.4), rate read %.3f deg/s" %
+          (before, gyro.drift, rate))
+    check(abs(gyro.drift - 0.4) <= 0.05 and abs(gyro.drift - 0.4) <= abs(before - 0.4),
+          "the drift measured at rest went from %.3f to %.3f deg/s, really 0.4" % (before, gyro.drift))
+    check(abs(rate) <= 0.1, "the compensated gyro reads %.3f deg/s sitting still" % rate)
+
+    # Calibrating again keeps the stored calibrations of the ports that were not calibrated
+    path = "/tmp/ev3soccer_gyro_store.txt"
+    store = CalibrationStore(path)
+    store.put(GyroCalibration("4", 0.25, 0.5, 0.1, 100))
+    store.save()
+    store = CalibrationStore(path)
+    store.load()
+    calibrate_gyros([(port, raw)], clock, backend.wait, store, 200)
+    again = CalibrationStore(path)
+    again.load()
+    kept = again.get("4")
+    print("  stored port 4 after calibrating port 1: %s" % kept)
+    check(kept is not None and kept.drift == 0.25 and again.get(port) is not None,
+          "calibrating port 1 lost the stored calibration of port 4")
+    backend.close()
+
+
+def encoder_straight(gains, seconds=10, weak_right=0.8, forward=0):
+    """
+    Drives the simulated robot with the left stick at forward (0 is full speed
+    ahead) in arcade mode for seconds, with a right motor weak_right as strong as
+    the left one.  gains is (kp, ki).  (0, 0) drives on the left stick without
+    correcting.  Returns how many degrees the left wheel ended up ahead of the right one, the
+    final heading and how many times the encoders were read.
+    """
+    backend = SimBackend()
+    backend.motor_gains["C"] = weak_right
+    outputs = MotorOutput()
+    outputs.add("B", backend.Motor(backend.Port.B))
+    outputs.add("C", backend.Motor(backend.Port.C))
+    control = SoccerControl(outputs, False, True, True, False)
+    sampler = EncoderSampler(outputs.motors["B"], outputs.motors["C"], backend.StopWatch())
+    control.straight = DriveStraight(sampler, gains[0], gains[1])
+    control.handle_event(EVENT_RANGE, CODE_LSTICK_VRANGE, forward)
+    for tick in range(seconds * 100):
+        control.update_motors()
+        # The drive loop asks more often than the encoders are read
+        backend.wait(5)
+        control.update_motors()
+        backend.wait(5)
+    difference = outputs.motors["B"].angle() - outputs.motors["C"].angle()
+    backend.close()
+    return (difference, backend.heading(), sampler.reads)
+
+
+def bench_drive_straight():
+    """
+    How far apart the wheels get driving straight on the left stick with mismatched
+    motors, with no correction, with only the proportional part and with the whole PI correction.
+    Checks that the default PI correction ends up within a few degrees of straight with
+    both mismatches, and that no correction does not.
+    """
+    print("Drive straight benchmark (10 s on the left stick, wheel angle difference and heading)")
+    print("                          right motor 80%                right motor 60%, half speed")
+    for gains in ((0, 0), (0.2, 0), (STRAIGHT_KP, 0), (STRAIGHT_KP, STRAIGHT_KI), (2.0, 4.0)):
+        (difference, heading, reads) = encoder_straight(gains)
+        (slow_difference, slow_heading, slow_reads) = encoder_straight(gains, weak_right=0.6, forward=64)
+        print("  kp %.1f ki %.1f  wheels %5d deg heading %6.1f  wheels %5d deg heading %6.1f  reads %d" %
+              (gains[0], gains[1], difference, heading, slow_difference, slow_heading, reads))
+        worst = max(abs(heading), abs(slow_heading))
+        if gains == (STRAIGHT_KP, STRAIGHT_KI):
+            check(worst <= 2 and max(abs(difference), abs(slow_difference)) <= 5,
+                  "the PI correction ended up %.1f degrees off straight" % worst)
+        elif gains == (0, 0):
+            check(worst > 45, "the uncorrected run only ended up %.1f degrees off straight" % worst)
+
+
+def make_sysfs(root, count, first=0):
+    """
+    Writes a made up /sys/class/lego-sensor with count sensor folders, numbered from
+    first, going round the ports and sensor types.  Returns a list of
+    (folder name, type, port name).
+    """
+    folder = root + "/lego-sensor"
+    os.makedirs(folder, exist_ok=True)
+    kinds = sorted(SENSOR_CLASSES)
+    made = []
+    for number in range(first, first + count):
+        name = "sensor" + str(number)
+        kind = kinds[number % len(kinds)]
+        port = str(number % 4 + 1)
+        os.makedirs(folder + "/" + name, exist_ok=True)
+        with open(folder + "/" + name + "/driver_name", "w") as out:
+            out.write(kind + "\n")
+        with open(folder + "/" + name + "/address", "w") as out:
+            # NXT sensors on an I2C address have a third part
+            out.write("ev3-ports:in" + port + (":i2c1" if number % 7 == 0 else "") + "\n")
+        made.append((name, kind, port))
+    return made
+
+
+def old_get_sensors(sensor_dir):
+    # The way EV3Tester used to find the sensors, without making the sensor objects
+    sensors = []
+    for dir in os.listdir(sensor_dir):
+        f = open(sensor_dir + "/" + dir + "/driver_name")
+        sensor_type = f.readline().rstrip()
+        f = open(sensor_dir + "/" + dir + "/address")
+        port = f.readline()[-2:-1]
+        sensors.append((dir, SensorType.COLOR, port))
+    return sensors
+
+
+def bench_inventory(count=400, rounds=20):
+    """
+    Scans a made up sysfs tree with count sensors, checks that every type and port
+    comes out right, and times the old scan against the first, an unchanged and an
+    incremental scan with the inventory.
+    """
+    import tempfile
+    print("Inventory benchmark (%d sensor folders)" % count)
+    root = tempfile.mkdtemp(prefix="ev3inventory")
+    made = make_sysfs(root, count)
+    folder = DeviceFolder(root + "/lego-sensor")
+    found = dict((device.name, device) for device in folder.scan())
+    wrong = 0
+    for (name, kind, port) in made:
+        device = found.get(name)
+        if device is None or device.kind != kind or device.port_name != port:
+            wrong += 1
+    # The old scan called every sensor a color sensor, and read the port off the end of the line
+    old = old_get_sensors(root + "/lego-sensor")
+    old_wrong = len([made_one for made_one in made if made_one[1] != SensorType.COLOR])
+    ports = dict((name, port) for (name, kind, port) in made)
+    old_ports = len([sensor for sensor in old if sensor[2] != ports[sensor[0]]])
+    print("  inventory: %d of %d wrong" % (wrong, count))
+    check(wrong == 0 and len(found) == count, "the inventory got %d of %d sensors wrong" % (wrong, count))
+    print("  old scan: %d of %d types wrong, %d ports wrong" % (old_wrong, count, old_ports))
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        old_get_sensors(root + "/lego-sensor")
+    old_ms = 1000 * (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for i in range(rounds):
+        DeviceFolder(root + "/lego-sensor").scan()
+    first_ms = 1000 * (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for i in range(rounds):
+        folder.scan()
+    same_ms = 1000 * (time.perf_counter() - start) / rounds
+    # Plug one more in each round
+    reads = folder.reads
+    start = time.perf_counter()
+    for i in range(rounds):
+        make_sysfs(root, 1, count + i)
+        folder.scan()
+    changed_ms = 1000 * (time.perf_counter() - start) / rounds
+    print("  old scan      %7.3f ms" % old_ms)
+    print("  first scan    %7.3f ms" % first_ms)
+    print("  unchanged     %7.3f ms" % same_ms)
+    print("  one plugged in %6.3f ms  (%d folders read for %d new)" % (changed_ms, folder.reads - reads, rounds))
+    check(folder.reads - reads == rounds, "read %d folders for %d new ones" % (folder.reads - reads, rounds))
+    shutil.rmtree(root)
+
+    # The sensor objects are only made when asked for
+    backend = SimBackend(sensors={"1": SensorType.GYRO, "2": SensorType.COLOR, "4": SensorType.TOUCH})
+    inventory = Inventory(backend)
+    devices = inventory.sensors()
+    made_before = len(backend.sensors)
+    gyro = inventory.sensor("1").get()
+    same = inventory.sensor("1").get() is gyro
+    print("  sim sensors %s, objects made %d before get(), %d after, same again %s" %
+          (devices, made_before, len(backend.sensors), same))
+    kinds = sorted((device.port_name, device.kind) for device in devices)
+    check(kinds == [("1", SensorType.GYRO), ("2", SensorType.COLOR), ("4", SensorType.TOUCH)],
+          "wrong sensor types or ports: %s" % kinds)
+    check(made_before == 0 and len(backend.sensors) == 1 and same, "sensor objects were not made once, on get()")
+    backend.close()
+
+
+def characterize_sim(port, kind, results, gain=1.0):
+    # Characterizes a simulated motor, compares it with the earlier runs and adds it to them
+    backend = SimBackend(motors={port: kind})
+    backend.motor_gains[port] = gain
+    result = characterize(backend.Motor(port), port, kind, backend.StopWatch(), backend.wait)
+    problems = results.compare(result)
+    results.add(result)
+    backend.close()
+    return (result, problems, backend.clock.now)
+
+
+def bench_motor_test(path):
+    """
+    Characterizes simulated large and medium motors a few times, then a worn one,
+    and checks that only the worn one is flagged.  Then runs EV3Tester itself on
+    the simulator, picking port B from the menu.
+    """
+    import subprocess
+    print("Motor characterization benchmark")
+    results_dir = "/tmp/ev3soccer_motor_results"
+    shutil.rmtree(results_dir, ignore_errors=True)
+    os.mkdir(results_dir)
+    results = MotorResults(results_dir)
+    for (port, kind, gain) in (("B", MotorType.LARGE, 1.0), ("B", MotorType.LARGE, 1.0), ("A", MotorType.MEDIUM, 1.0),
+                               ("A", MotorType.MEDIUM, 1.0), ("B", MotorType.LARGE, 0.75)):
+        start = time.perf_counter()
+        (result, problems, sim_ms) = characterize_sim(port, kind, results, gain)
+        elapsed = time.perf_counter() - start
+        print("  gain %.2f %s  (%d ms simulated in %.3f s)" % (gain, result, sim_ms, elapsed))
+        for problem in problems:
+            print("    " + problem)
+        # The motor overshoots and settles a little off target, but not far
+        check(0 < result.hold_error <= 5, "%s held %d degrees off target" % (port, result.hold_error))
+        check(bool(problems) == (gain < 1.0), "%s gain %.2f flagged as %s" % (port, gain, problems))
+    print("  sweep %s" % (" ".join("%d:%d" % pair for pair in zip(SWEEP_DUTIES, result.sweep))))
+    # Reading the files back gives the same runs, each port and motor type in its own file
+    again = MotorResults(results_dir)
+    files = sorted(os.listdir(results_dir))
+    runs = (len(again.history("B", MotorType.LARGE)), len(again.history("A", MotorType.MEDIUM)))
+    print("  results files: %s, %d and %d runs" % (" ".join(files), runs[0], runs[1]))
+    check(files == [os.path.basename(results.path("A", MotorType.MEDIUM)), os.path.basename(results.path("B", MotorType.LARGE))],
+          "wrong results files: %s" % files)
+    check(runs == (3, 2) and not again.history("A", MotorType.LARGE), "read back %s runs" % (runs,))
+
+    # The whole tester, with the controller picking B (right one, down one) and pressing Option
+    events = "/tmp/ev3soccer_tester_events.bin"
+    with open(events, "wb") as out:
+        for (t, ev_type, code, value) in ((100, EVENT_RANGE, CODE_DPAD_HRANGE, 1), (300, EVENT_RANGE, CODE_DPAD_VRANGE, 1),
+                                          (500, EVENT_BUTTON, CODE_OPTION, VALUE_BUTTON_PRESSED)):
+            out.write(struct.pack(EVENT_FORMAT, 0, t * 1000, ev_type, code, value))
+            out.write(struct.pack(EVENT_FORMAT, 0, t * 1000, EV_SYN, SYN_REPORT, 0))
+    environment = dict(os.environ)
+    environment["EV3SIM_EVENTS"] = events
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "EV3Tester.py"], env=environment, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = time.perf_counter() - start
+    lines = output.stdout.strip().split("\n")
+    print("  EV3Tester on the simulator (%.2f s): %s" % (elapsed, lines[0] if lines else ""))
+    check(output.returncode == 0, "EV3Tester failed\n" + output.stderr)
+
+
+def bench_sensor_test():
+    """
+    Runs the sensor benchmark on fake sensors that take about as long to read as the
+    real ones, and checks that it finds the read costs and noise they were given.
+    Then shows how much of the control period reading them every update would take.
+    """
+    print("Sensor benchmark (fake sensors)")
+    sensors = (("1", FakeSensor(SensorType.GYRO, read_cost_us=300, switch_cost_us=2000, noise=0.5)),
+               ("2", FakeSensor(SensorType.COLOR, read_cost_us=400, switch_cost_us=5000, noise=2.0, value=40)),
+               ("3", FakeSensor(SensorType.ULTRASONIC, read_cost_us=600, noise=5.0, value=500)),
+               ("4", FakeSensor(SensorType.TOUCH, read_cost_us=200)))
+    for (port, sensor) in sensors:
+        for result in test_sensor(sensor, port, sensor.kind):
+            print("  " + str(result))
+            # Busy waits only ever take longer than asked, so only allow for slowness
+            cost = sensor.read_cost_us
+            check(cost <= result.p50_us <= 2 * cost + 100,
+                  "%s %s read in %dus, really %dus" % (port, result.mode, result.p50_us, cost))
+            cost = sensor.read_cost_us + sensor.switch_cost_us
+            check(cost <= result.switch_us <= 2 * cost + 100,
+                  "%s %s switched in %dus, really %dus" % (port, result.mode, result.switch_us, cost))
+            # The readings are rounded to whole numbers, which adds noise of its own
+            noise = 0.0
+            if sensor.noise:
+                noise = math.sqrt(sensor.noise * sensor.noise + 1 / 12)
+            check(result.noise is None or abs(result.noise - noise) <= 0.25 * noise,
+                  "%s %s noise %.2f, really %.2f" % (port, result.mode, result.noise, noise))
+    readers = [sensor.angle for (port, sensor) in sensors if sensor.kind == SensorType.GYRO]
+    readers += [sensor.reflection for (port, sensor) in sensors if sensor.kind == SensorType.COLOR]
+    readers += [sensor.distance for (port, sensor) in sensors if sensor.kind == SensorType.ULTRASONIC]
+    readers += [sensor.pressed for (port, sensor) in sensors if sensor.kind == SensorType.TOUCH]
+    costs = [0]
+    for (port, sensor) in sensors:
+        costs.append(costs[-1] + sensor.read_cost_us)
+    for (count, average, worst, percent) in load(readers):
+        print("  %d sensors every update: %5dus avg %5dus worst  %5.1f%% of %dms" %
+              (count, average, worst, percent, LOAD_PERIOD_MS))
+        check(costs[count] <= average <= 2 * costs[count] + 100,
+              "%d sensors took %dus every update, really %dus" % (count, average, costs[count]))
+    # Switching modes every update costs the switch every time
+    color = sensors[1][1]
+    for (count, average, worst, percent) in load([color.reflection, color.ambient])[2:]:
+        print("  color reflection and ambient every update: %5dus avg  %5.1f%% of %dms" %
+              (average, percent, LOAD_PERIOD_MS))
+        check(average >= 2 * (color.read_cost_us + color.switch_cost_us),
+              "switching the color sensor's mode every update only took %dus" % average)
+
+
+def scripted_menu(menu_items, presses, columns=1, wait_release=False, tick_ms=-1):
+    """
+    Runs a menu on the simulator's screen with a scripted controller.  presses is a
+    list of (ev_type, code, value), one every 500 ms, each followed by a sync event.
+    Returns (selected item, screen draws after the menu was first drawn, screen
+    clears after that, ticks, milliseconds the menu was open).
+    """
+    clock = SimClock()
+    screen = SimScreen()
+    display = Display(screen, SimStopWatch(clock))
+    events = []
+    for i in range(len(presses)):
+        (ev_type, code, value) = presses[i]
+        events.append((500 * (i + 1), ev_type, code, value))
+        events.append((500 * (i + 1), EV_SYN, SYN_REPORT, 0))
+    reader = SimEventSource(clock, events)
+    menu = Menu(display, menu_items, columns=columns, wait_release=wait_release)
+    ticks = [0, 0]
+
+    def tick():
+        # The draws so far, when the menu has just been put up
+        if ticks[0] == 0:
+            ticks[1] = (screen.draws, screen.clears)
+        ticks[0] += 1
+    selected = run_menu(menu, reader, display, tick, tick_ms)
+    return (selected, screen.draws - ticks[1][0], screen.clears - ticks[1][1], ticks[0], clock.now)
+
+
+def bench_menu():
+    """
+    Drives the EV3Tester port menu and the EV3Soccer options menu with scripted
+    controller events, and checks what gets picked, that only the marker and the
+    values are redrawn, and that the tick keeps going while the menu is open.
+    """
+    print("Menu benchmark (scripted controller)")
+    # Left and up come in as -1 read as unsigned
+    RIGHT = (EVENT_RANGE, CODE_DPAD_HRANGE, 1)
+    LEFT = (EVENT_RANGE, CODE_DPAD_HRANGE, 4294967295)
+    DOWN = (EVENT_RANGE, CODE_DPAD_VRANGE, 1)
+    UP = (EVENT_RANGE, CODE_DPAD_VRANGE, VALUE_DPAD_UP)
+    LET_GO = (EVENT_RANGE, CODE_DPAD_HRANGE, 0)
+    PRESS = (EVENT_BUTTON, CODE_OPTION, VALUE_BUTTON_PRESSED)
+    RELEASE = (EVENT_BUTTON, CODE_OPTION, VALUE_BUTTON_RELEASED)
+
+    def ports():
+        return [MenuItem(10 + 90 * (i % 2), 20 + 20 * (i // 2), "1A2B3C4D"[i]) for i in range(8)]
+    for (name, presses, expected) in (("right, down", [RIGHT, LET_GO, DOWN, PRESS], "B"),
+                                      ("up, left", [UP, LEFT, PRESS], "C"),
+                                      ("down x4", [DOWN, DOWN, DOWN, DOWN, PRESS], "1")):
+        (selected, draws, clears, ticks, took) = scripted_menu(ports(), presses, columns=2, tick_ms=10)
+        label = selected.label if selected is not None else None
+        print("  port menu %-12s picked %s (expected %s)  draws:%d clears:%d ticks:%d in %dms" %
+              (name, label, expected, draws, clears, ticks, took))
+        check(label == expected, "the port menu picked %s after %s, not %s" % (label, name, expected))
+        check(clears == 0 and ticks > 0, "the port menu cleared the screen or stopped the tick")
+
+    items = [MenuItem(10, 20, "A", ("N", "Y")), MenuItem(10, 40, "D", ("N", "Y"))]
+    (selected, draws, clears, ticks, took) = scripted_menu(items, [RIGHT, DOWN, RIGHT, RIGHT, RIGHT, PRESS, RELEASE],
+                                                           wait_release=True, tick_ms=10)
+    print("  options menu picked A:%s D:%s (expected Y Y)  draws:%d clears:%d" %
+          (items[0].value, items[1].value, draws, clears))
+    check((items[0].value, items[1].value) == ("Y", "Y"),
+          "the options menu picked A:%s D:%s, not A:Y D:Y" % (items[0].value, items[1].value))
+    (selected, draws, clears, ticks, took) = scripted_menu(ports(), [RIGHT], columns=2, tick_ms=10)
+    print("  controller gone: %s" % selected)
+    check(selected is None, "the port menu picked %s with the controller gone" % selected)
+
+
+def trigger_flood(squeeze_ms=400, every_ms=1):
+    """
+    Makes up the events for squeezing L2 all the way in and letting it go again over
+    squeeze_ms, with a trigger event every every_ms, like the controller floods them.
+    Returns a list of (time_ms, ev_type, code, value), each followed by a sync event.
+    """
+    events = [(0, EVENT_BUTTON, CODE_L2, VALUE_BUTTON_PRESSED)]
+    steps = squeeze_ms // every_ms
+    for step in range(steps):
+        t = step * every_ms
+        value = 255 - abs(255 - 510 * step // steps)
+        events.append((t, EVENT_RANGE, CODE_L2_RANGE, max(1, value)))
+        events.append((t, EV_SYN, SYN_REPORT, 0))
+    t = steps * every_ms
+    events += [(t, EVENT_BUTTON, CODE_L2, VALUE_BUTTON_RELEASED), (t, EVENT_RANGE, CODE_L2_RANGE, 0), (t, EV_SYN, SYN_REPORT, 0)]
+    return events
+
+
+def bench_triggers():
+    """
+    Plays a flood of L2 trigger events into SoccerControl, updating the motors for
+    every sync event, on the buttons only, on the triggers worked out for every
+    event, and on the triggers worked out every control period.  Counts the writes
+    to the A motor and how far its duty cycle ends up from the trigger.
+    """
+    print("Trigger benchmark (L2 squeezed and let go over 400 ms, an event every 1 ms)")
+    events = trigger_flood()
+    span = events[-1][0] - events[0][0]
+    writes = {}
+    for (name, analog, period) in (("buttons", False, 0), ("every event", True, 0), ("every 10ms", True, 10)):
+        clock = SimClock()
+        outputs = MotorOutput()
+        motor = FakeMotor()
+        outputs.add("A", motor)
+        control = SoccerControl(outputs, True, False, False, False)
+        if analog:
+            trigger_clock = None
+            if period:
+                trigger_clock = SimStopWatch(clock)
+            control.use_triggers(0, trigger_clock, period)
+        worst = 0
+        for (t, ev_type, code, value) in events:
+            clock.now = t
+            control.handle_event(ev_type, code, value)
+            if ev_type == EV_SYN:
+                control.update_motors()
+                if analog:
+                    worst = max(worst, abs(motor.duty + control.trigger_table[control.left_trigger]))
+        # One more update a control period after the flood stops
+        clock.now += 10
+        control.update_motors()
+        print("  %-12s A motor writes:%4d for %d events  worst lag:%3d%%  final duty:%d" %
+              (name, motor.writes, len(events), worst, motor.duty))
+        writes[name] = motor.writes
+        check(motor.duty == 0, "%s left the A motor at %d" % (name, motor.duty))
+        check(worst <= 10, "%s lagged the trigger by %d%%" % (name, worst))
+        if period:
+            # At most one write every period, and the last update after the flood
+            most = span // period + 2
+            check(motor.writes <= most, "%s wrote %d times in %d ms" % (name, motor.writes, span))
+    check(writes["buttons"] <= 2, "the buttons wrote %d times for one squeeze" % writes["buttons"])
+    check(writes["every 10ms"] < writes["every event"], "working the triggers out every 10ms saved no writes")
+    for curve in (0, 50, 100):
+        table = build_trigger_table(curve)
+        print("  curve %3d: trigger 32:%3d 64:%3d 128:%3d 192:%3d 255:%3d" %
+              (curve, table[32], table[64], table[128], table[192], table[255]))
+        check(table[0] == 0 and table[255] == 100 and all(table[i] <= table[i + 1] for i in range(255)),
+              "curve %d does not go up from 0 to 100" % curve)
+
+
+def traction_run(ramps=None, traction=None, grip=3000, mode="Arc"):
+    """
+    Drives the simulated robot, with tyres that slip when pushed harder than grip,
+    from standing still to full speed ahead, and after 1.5 s flips the stick to full
+    speed backwards.  In mode "Tank" both sticks are flipped together.  ramps is for
+    a SlewLimiter, traction is (grip, headroom) for
+    TractionControl, None leaves either out.  Returns the ms the robot took to cover
+    720 wheel degrees, the ms from the flip until it was going 900 deg/s backwards,
+    how many times the left wheel broke loose and how many ms it spent spinning.
+    """
+    backend = SimBackend()
+    backend.motor_grip["B"] = grip
+    backend.motor_grip["C"] = grip
+    outputs = MotorOutput()
+    outputs.add("B", backend.Motor(backend.Port.B))
+    outputs.add("C", backend.Motor(backend.Port.C))
+    control = SoccerControl(outputs, False, True, True, False)
+    if ramps is not None:
+        control.ramp = SlewLimiter(backend.StopWatch(), ramps)
+    if traction is not None:
+        control.traction = {}
+        for port in ("B", "C"):
+            control.traction[port] = TractionControl(outputs.motors[port], backend.StopWatch(),
+                                                     grip=traction[0], headroom=traction[1])
+    wheel = outputs.motors["B"]
+    control.ctrltype = mode
+    sticks = [CODE_RSTICK_VRANGE]
+    if mode == "Tank":
+        sticks.append(CODE_LSTICK_VRANGE)
+    for code in sticks:
+        control.handle_event(EVENT_RANGE, code, 0)
+    launch = None
+    reverse = None
+    spinning = 0
+    for tick in range(300):
+        if tick == 150:
+            for code in sticks:
+                control.handle_event(EVENT_RANGE, code, 255)
+        control.update_motors()
+        backend.wait(10)
+        wheel.update()
+        if wheel.slipping:
+            spinning += 10
+        if launch is None and wheel.ground_position >= 720:
+            launch = backend.clock.now
+        if tick >= 150 and reverse is None and wheel.ground_velocity <= -900:
+            reverse = backend.clock.now - 1500
+    backend.close()
+    return (launch, reverse, wheel.slips, spinning)
+
+
+def bench_traction():
+    """
+    Compares launching and reversing the simulated robot with slipping tyres on the
+    raw stick, with a few slew rates, with the default ones in both drive modes, with
+    traction control and with both.  Checks that the default ramps and traction
+    control never let the wheels spin, that traction control gets going and turns
+    around no slower than the raw stick, and that the default ramps turn around no
+    slower than it either.
+    """
+    print("Traction benchmark (tyres grip up to 3000 deg/s/s)")
+    runs = [("raw stick", None, None, "Arc")]
+    for rate in (200, 400, 800):
+        runs.append(("ramp %d%%/s" % rate, {"Arc": (rate, 2 * rate)}, None, "Arc"))
+    for mode in ("Arc", "Tank"):
+        runs.append(("ramp default, " + mode, RAMPS, None, mode))
+    runs.append(("traction", None, (TRACTION_GRIP, TRACTION_HEADROOM), "Arc"))
+    runs.append(("traction, headroom 400", None, (TRACTION_GRIP, 400), "Arc"))
+    runs.append(("ramp and traction", RAMPS, (TRACTION_GRIP, TRACTION_HEADROOM), "Arc"))
+    results = {}
+    for (name, ramps, traction, mode) in runs:
+        (launch, reverse, slips, spinning) = traction_run(ramps, traction, mode=mode)
+        results[name] = (launch, reverse, slips)
+        print("  %-24s 720 deg in %4s ms  reversed in %4s ms  slips:%d spinning %4d ms" %
+              (name, launch, reverse, slips, spinning))
+    (raw_launch, raw_reverse, raw_slips) = results["raw stick"]
+    for name in ("ramp default, Arc", "ramp default, Tank", "traction", "ramp and traction"):
+        check(results[name][2] == 0, name + " let the wheels spin")
+    for name in ("ramp default, Arc", "ramp default, Tank"):
+        check(results[name][1] <= raw_reverse, name + " turned around slower than the raw stick")
+    (launch, reverse, slips) = results["traction"]
+    check(launch <= raw_launch and reverse <= raw_reverse,
+          "traction control got going in %d ms and turned around in %d ms, the raw stick in %d and %d ms" %
+          (launch, reverse, raw_launch, raw_reverse))
+
+
+def timed_writer(write_fd, events, every_ms, seconds):
+    # Writes the group of events every every_ms for seconds, each stamped with the time it was
+    # written, then closes the pipe like a controller going away
+    end = time.time() + seconds
+    while time.time() < end:
+        now = time.time()
+        sec = int(now)
+        usec = int((now - sec) * 1000000)
+        data = b"".join(struct.pack(EVENT_FORMAT, sec, usec, ev_type, code, value)
+                        for (ev_type, code, value) in events)
+        os.write(write_fd, data + struct.pack(EVENT_FORMAT, sec, usec, EV_SYN, SYN_REPORT, 0))
+        time.sleep(every_ms / 1000)
+    os.close(write_fd)
+
+
+def mux_pipe(mux, name, role):
+    # A pipe standing in for an event file.  Returns the end to write to
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    mux.add(name, role, EventReader(open(read_fd, "rb")))
+    return write_fd
+
+
+def bench_mux(seconds=1):
+    """
+    Reads a driver, a co-driver and a flood of motion sensor events through one
+    InputMux, each from its own pipe with a thread writing to it, and reports how
+    late each device's events were handed out.  Then checks the routing: the
+    co-driver's L1 runs the A motor, the driver's does not while there is a
+    co-driver, and does again once the co-driver's pipe closes.
+    """
+    print("Input mux benchmark (driver 250Hz, co-driver 100Hz, motion sensors 1000Hz)")
+    outputs = MotorOutput()
+    motor = FakeMotor()
+    outputs.add("A", motor)
+    outputs.add("B", FakeMotor())
+    control = SoccerControl(outputs, True, True, False, False)
+    mux = InputMux(now=time.time)
+    writers = []
+    for (name, role, events, every_ms) in (
+            ("pad 1", "driver", [(EVENT_RANGE, CODE_RSTICK_VRANGE, 64)], 4),
+            ("pad 2", "attachments", [(EVENT_BUTTON, CODE_L2, VALUE_BUTTON_PRESSED)], 10),
+            ("motion", "motion", [(EVENT_RANGE, 3, 100), (EVENT_RANGE, 4, 100), (EVENT_RANGE, 5, 100)], 1)):
+        write_fd = mux_pipe(mux, name, role)
+        writers.append(threading.Thread(target=timed_writer, args=(write_fd, events, every_ms, seconds)))
+    router = RoleRouter(mux, control.handle_event)
+    router.register("motion", lambda ev_type, code, value: None)
+    for writer in writers:
+        writer.start()
+    event = mux.read()
+    while event is not None:
+        (tv_sec, tv_usec, ev_type, code, value) = event
+        router.handle_event(ev_type, code, value)
+        if ev_type == EV_SYN and not mux.pending():
+            control.update_motors()
+        event = mux.read()
+    for writer in writers:
+        writer.join()
+    for line in mux.report().split("\n"):
+        print("  " + line)
+    print("  polls:%d routed:%d dropped:%d" % (mux.polls, router.routed, router.dropped))
+
+    # Routing.  Both controllers press L1, only the co-driver's counts until it goes away
+    control = SoccerControl(outputs, True, False, False, False)
+    clock = SimClock()
+    control.watchdog = InputWatchdog(SimStopWatch(clock), 1000)
+    mux = InputMux()
+
+    def handle_codriver(ev_type, code, value):
+        control.handle_event(ev_type, code, value, False)
+    router = RoleRouter(mux, control.handle_event, handle_codriver)
+
+    def source_lost(source):
+        router.release(source.role)
+    mux.on_lost = source_lost
+    driver_fd = mux_pipe(mux, "pad 1", "driver")
+    codriver_fd = mux_pipe(mux, "pad 2", "attachments")
+
+    def press(write_fd, code, value):
+        os.write(write_fd, struct.pack(EVENT_FORMAT, 0, 0, EVENT_BUTTON, code, value) +
+                 struct.pack(EVENT_FORMAT, 0, 0, EV_SYN, SYN_REPORT, 0))
+
+    def drain():
+        event = mux.read(0)
+        while event is not None:
+            router.handle_event(event[2], event[3], event[4])
+            event = mux.read(0)
+        control.update_motors()
+        return motor.duty
+    press(driver_fd, CODE_L1, VALUE_BUTTON_PRESSED)
+    driver_ignored = drain() == 0
+    clock.advance(500)
+    press(codriver_fd, CODE_L1, VALUE_BUTTON_PRESSED)
+    codriver_runs = drain() != 0
+    codriver_fed = control.watchdog.last_input != 0
+    os.close(codriver_fd)
+    released = drain() == 0
+    press(driver_fd, CODE_L1, VALUE_BUTTON_PRESSED)
+    driver_takes_over = drain() != 0
+    os.close(driver_fd)
+    drain()
+    print("  driver ignored with a co-driver:%s  co-driver runs A:%s  A let go when co-driver left:%s"
+          "  driver runs A after:%s" % (driver_ignored, codriver_runs, released, driver_takes_over))
+    check(driver_ignored and codriver_runs and released and driver_takes_over,
+          "the events did not go where they belong")
+    check(not codriver_fed, "the co-driver fed the watchdog")
+
+
+def latency_run(reader, control, latency, rate, clock):
+    # Runs the event loop (rate 0) or the fixed rate loop over reader, timing every event
+    outputs = control.outputs
+
+    def update():
+        writes = outputs.writes
+        control.update_motors()
+        latency.updated(outputs.writes > writes)
+    reader = TimedReader(reader, latency)
+    if rate:
+        FixedRateLoop(clock, 1000 // rate).run(reader, control.handle_event, update)
+        return
+    event = reader.read()
+    while event:
+        control.handle_event(event[2], event[3], event[4])
+        if event[2] == EV_SYN and event[3] == SYN_REPORT and not reader.pending():
+            update()
+        event = reader.read()
+
+
+def latency_writer(write_fd, frames, every_ms):
+    # Sweeps the right stick, one group of changes every every_ms, stamped like the kernel does
+    for frame in range(frames):
+        now = time.time()
+        sec = int(now)
+        usec = int((now - sec) * 1000000)
+        value = (frame * 7) % 256
+        os.write(write_fd, struct.pack(EVENT_FORMAT, sec, usec, EVENT_RANGE, CODE_RSTICK_VRANGE, value) +
+                 struct.pack(EVENT_FORMAT, sec, usec, EV_SYN, SYN_REPORT, 0))
+        time.sleep(every_ms / 1000)
+    os.close(write_fd)
+
+
+def check_percentiles(name, histogram):
+    # The percentiles of a histogram can only go up
+    values = [histogram.percentile(part) for part in (0.5, 0.95, 0.99)] + [histogram.max]
+    check(values == sorted(values), "%s %s percentiles out of order: %s" % (name, histogram.name, values))
+
+
+def bench_latency(path, write_cost_us=2000):
+    """
+    Measures how long controller events wait to be handled, and the lag from an
+    event to the motor write it causes.  First on the simulator's clock, with
+    the event loop and with the fixed rate loop at 100 and 50 Hz.  Then in real
+    time from a pipe, with motor writes that take write_cost_us like they do on
+    the brick.  Also times adding to a histogram.
+    """
+    print("Input latency benchmark (p50/p95/p99/max)")
+    for rate in (0, 100, 50):
+        backend = SimBackend(events=path)
+        outputs = MotorOutput()
+        outputs.add("B", backend.Motor(backend.Port.B))
+        outputs.add("C", backend.Motor(backend.Port.C))
+        control = SoccerControl(outputs, False, True, True, False)
+        latency = InputLatency(backend.event_time_us)
+        latency_run(backend.open_input(), control, latency, rate, backend.StopWatch())
+        name = "simulated, %s" % ("%d Hz loop" % rate if rate else "event loop")
+        print("  %-26s %s" % (name, latency.lag.report()))
+        backend.close()
+        check_percentiles(name, latency.lag)
+        # On the simulator's clock, an event waits at most until the next update, a millisecond at a time
+        period = 1000 // rate if rate else 0
+        check(latency.lag.count > 0 and latency.lag.max <= (period + 1) * 1000,
+              "%s lagged up to %.1fms" % (name, latency.lag.max / 1000))
+
+    for rate in (0, 100):
+        read_fd, write_fd = os.pipe()
+        in_file = open(read_fd, "rb")
+        outputs = MotorOutput()
+        outputs.add("B", FakeMotor(write_cost_us))
+        outputs.add("C", FakeMotor(write_cost_us))
+        control = SoccerControl(outputs, False, True, True, False)
+        latency = InputLatency(lambda: int(time.time() * 1000000))
+        writer = threading.Thread(target=latency_writer, args=(write_fd, 200, 4))
+        writer.start()
+        latency_run(EventReader(in_file), control, latency, rate, SimStopWatch(WallClock()))
+        writer.join()
+        in_file.close()
+        name = "real time, %s" % ("%d Hz loop" % rate if rate else "event loop")
+        print("  %-26s %s" % (name, latency.wait.report()))
+        print("  %-26s %s" % ("", latency.lag.report()))
+        check_percentiles(name, latency.wait)
+        check_percentiles(name, latency.lag)
+        # Usually within the period and the two motor writes, with room for a busy computer
+        period = 1000 // rate if rate else 0
+        most = (period + 5) * 1000 + 2 * write_cost_us
+        check(latency.lag.percentile(0.5) <= most, "%s lag p50 %.1fms" % (name, latency.lag.percentile(0.5) / 1000))
+
+    histogram = LatencyHistogram("bench")
+    start = time.perf_counter()
+    for i in range(100000):
+        histogram.add(i % 40000)
+    print("  %.3f us per histogram add, p50 of 0..40ms: %.1fms" %
+          ((time.perf_counter() - start) * 10, histogram.percentile(0.5) / 1000))
+    check_percentiles("0..40ms", histogram)
+    check(abs(histogram.percentile(0.5) - 20000) <= 1000, "the p50 of 0..40ms came out %dus" % histogram.percentile(0.5))
+
+
+def profile_run(reader, control, display, profiler):
+    # The EV3Soccer event loop, timing the screen and the log like its idle() does
+    event = reader.read()
+    while event:
+        control.handle_event(event[2], event[3], event[4])
+        if event[2] == EV_SYN and event[3] == SYN_REPORT and not reader.pending():
+            control.update_motors()
+            if control.ctrlchange:
+                display.text(1, 80, "Turn:" + str(control.turn_multiplier) + "% " + control.ctrltype)
+                control.ctrlchange = False
+            display.text(10, 100, str(control.outputs.writes))
+        if not reader.pending():
+            start = None
+            if profiler is not None and profiler.enabled:
+                start = profiler.start()
+            display.flush()
+            if start is not None:
+                start = profiler.stop(STAGE_SCREEN, start)
+            log.flush()
+            if start is not None:
+                profiler.stop(STAGE_LOG, start)
+        event = reader.read()
+
+
+def profile_once(path, name, write_cost_us, console_cost_us):
+    # One replay for bench_profile.  Returns the seconds it took and the profiler
+    outputs = MotorOutput()
+    for port in "BC":
+        outputs.add(port, FakeMotor(write_cost_us))
+    control = SoccerControl(outputs, False, True, True, False)
+    display = Display(SimScreen(), None)
+    profiler = None
+    if name != "none":
+        profiler = StageProfiler(enabled=(name != "off"))
+    control.profiler = profiler
+    saved_stdout = sys.stdout
+    sys.stdout = SlowConsole(console_cost_us)
+    try:
+        start = time.perf_counter()
+        if name == "simulator":
+            backend = SimBackend(events=path)
+            profile_run(backend.open_input(), control, display, profiler)
+            backend.close()
+        else:
+            with open(path, "rb") as in_file:
+                reader = EventReader(in_file)
+                reader.profiler = profiler
+                profile_run(reader, control, display, profiler)
+        elapsed = time.perf_counter() - start
+        log.flush(0)
+    finally:
+        sys.stdout = saved_stdout
+    log.records = log.written = log.dropped = log.waiting = 0
+    return (elapsed, profiler)
+
+
+def bench_profile(path, write_cost_us=200, console_cost_us=20, rounds=6):
+    """
+    Replays the session through the event loop with no profiler, with one that
+    is switched off and with one that is on, to show what profiling costs, and
+    prints where the time went.  The motor writes take write_cost_us and the log
+    goes to a console where every write takes console_cost_us.  Then does the
+    same on the simulator, which gives the same report.  The times are the best
+    of rounds runs each, taking turns.
+    """
+    print("Stage profiler benchmark")
+    log.set_level(DEBUG)
+    log.clock = SimStopWatch(WallClock())
+    events = os.path.getsize(path) // EVENT_SIZE
+    times = {}
+    profilers = {}
+    names = ["none", "off", "on"]
+    for i in range(rounds):
+        # A different one goes first every round, so none of them always follows the same one
+        for name in names[i % 3:] + names[:i % 3]:
+            (elapsed, profilers[name]) = profile_once(path, name, write_cost_us, console_cost_us)
+            if name not in times or elapsed < times[name]:
+                times[name] = elapsed
+    for name in names:
+        print("  %-9s %.3f s  (%+.1f%%)" % (name, times[name], 100 * (times[name] / times["none"] - 1)))
+    (times["simulator"], profilers["simulator"]) = profile_once(path, "simulator", write_cost_us, console_cost_us)
+    for name in ("on", "simulator"):
+        print("  " + name + ":")
+        for line in profilers[name].report().split("\n"):
+            print("    " + line)
+    log.set_level(OFF)
+    log.clock = None
+
+    # Switched off, the profiler times nothing and costs next to nothing
+    check(sum(profilers["off"].counts) == 0 and profilers["off"].profiled_us == 0, "the switched off profiler timed something")
+    check(times["off"] <= 1.1 * times["none"] + 0.005, "the switched off profiler cost %+.1f%%" %
+          (100 * (times["off"] / times["none"] - 1)))
+    # Switched on, every event is unpacked and dispatched once, the same on the simulator
+    for name in ("on", "simulator"):
+        counts = profilers[name].counts
+        check(counts[STAGE_DISPATCH] == events and counts[STAGE_MOTORS] > 0,
+              "%s: dispatched %d of %d events" % (name, counts[STAGE_DISPATCH], events))
+    check(profilers["on"].counts[STAGE_UNPACK] == events, "unpacked %d of %d events" %
+          (profilers["on"].counts[STAGE_UNPACK], events))
+
+
+# A copy of /proc/bus/input/devices from an EV3 with a PS4 controller connected.  The
+# controller shows up three times, and its event file is not the first handler
+DEVICES_FIXTURE = """I: Bus=0019 Vendor=0001 Product=0001 Version=0100
+N: Name="EV3 Brick Buttons"
+P: Phys=gpio-keys/input0
+S: Sysfs=/devices/platform/gpio_keys/input/input0
+U: Uniq=
+H: Handlers=kbd event0
+B: PROP=0
+B: EV=3
+B: KEY=1680 0 0 10004000
+
+I: Bus=0019 Vendor=0001 Product=0001 Version=0100
+N: Name="EV3 Speaker"
+P: Phys=
+S: Sysfs=/devices/platform/snd-legoev3/input/input1
+U: Uniq=
+H: Handlers=kbd event1
+B: PROP=0
+B: EV=40001
+B: SND=6
+
+I: Bus=0005 Vendor=054c Product=09cc Version=8100
+N: Name="Wireless Controller Touchpad"
+P: Phys=00:17:e9:b2:9e:5f
+S: Sysfs=/devices/platform/serial8250.2/tty/ttyS2/hci0/hci0:1/0005:054C:09CC.0001/input/input2
+U: Uniq=a4:ae:12:34:56:78
+H: Handlers=mouse0 event2
+B: PROP=5
+B: EV=b
+B: KEY=2420 0 10000 0 0 0 0 0 0 0 0
+B: ABS=2608000 3
+
+I: Bus=0005 Vendor=054c Product=09cc Version=8100
+N: Name="Wireless Controller Motion Sensors"
+P: Phys=00:17:e9:b2:9e:5f
+S: Sysfs=/devices/platform/serial8250.2/tty/ttyS2/hci0/hci0:1/0005:054C:09CC.0001/input/input3
+U: Uniq=a4:ae:12:34:56:78
+H: Handlers=event3
+B: PROP=40
+B: EV=19
+B: ABS=3f
+B: MSC=20
+
+I: Bus=0005 Vendor=054c Product=09cc Version=8100
+N: Name="Wireless Controller"
+P: Phys=00:17:e9:b2:9e:5f
+S: Sysfs=/devices/platform/serial8250.2/tty/ttyS2/hci0/hci0:1/0005:054C:09CC.0001/input/input4
+U: Uniq=a4:ae:12:34:56:78
+H: Handlers=kbd js0 event4
+B: PROP=0
+B: EV=20000b
+B: KEY=7fdb000000000000 0 0 0 0
+B: ABS=3003f
+B: FF=107030000 0
+
+"""
+
+# The same, with a second controller connected after the first one
+SECOND_CONTROLLER = """I: Bus=0005 Vendor=054c Product=05c4 Version=8111
+N: Name="Wireless Controller"
+P: Phys=00:17:e9:b2:9e:5f
+S: Sysfs=/devices/platform/serial8250.2/tty/ttyS2/hci0/hci0:2/0005:054C:05C4.0002/input/input7
+U: Uniq=a4:ae:12:9a:bc:de
+H: Handlers=kbd event7 js1
+B: PROP=0
+B: EV=20000b
+
+"""
+
+
+def without_controller():
+    # DEVICES_FIXTURE once the controller has gone away.  The touchpad and motion sensors stay
+    end = DEVICES_FIXTURE.index('N: Name="Wireless Controller"\n')
+    return DEVICES_FIXTURE[:DEVICES_FIXTURE.rindex("I: ", 0, end)]
+
+
+def bench_devices(rounds=1000):
+    """
+    Checks the devices file parsing against a copy of the real file: the handlers
+    on one line, the touchpad and motion sensors that share the controller's
+    name, a second controller, and that the file is only parsed again when it
+    changes.  Then times looking for the controller with and without the cache.
+    """
+    print("Device discovery benchmark")
+    devices = parse_input_devices(DEVICES_FIXTURE)
+    names = [device["name"] for device in devices]
+    check(names == ["EV3 Brick Buttons", "EV3 Speaker", "Wireless Controller Touchpad",
+                    "Wireless Controller Motion Sensors", "Wireless Controller"],
+          "parsed the wrong devices: %s" % names)
+    controller = devices[4]
+    check(controller["handlers"] == ["kbd", "js0", "event4"], "wrong handlers: %s" % controller["handlers"])
+    check(controller["vendor"] == "054c" and controller["product"] == "09cc",
+          "wrong vendor or product: %s %s" % (controller["vendor"], controller["product"]))
+    check(devices[2]["handlers"] == ["mouse0", "event2"] and devices[3]["handlers"] == ["event3"],
+          "wrong touchpad or motion sensor handlers")
+
+    root = "/tmp/ev3soccer_devices"
+    os.makedirs(root, exist_ok=True)
+    path = root + "/devices"
+    with open(path, "w") as out:
+        out.write(DEVICES_FIXTURE)
+    found = InputDevices(path, "/dev/input")
+    check(found.find_event_file() == "/dev/input/event4", "controller event file: " + found.find_event_file())
+    check(found.find_event_file("Wireless Controller Touchpad") == "/dev/input/event2", "touchpad event file")
+    check(found.find_event_file("Wireless Controller Motion Sensors") == "/dev/input/event3", "motion sensors event file")
+    check(found.find_event_files() == ["/dev/input/event4"], "more than one controller: %s" % found.find_event_files())
+    for i in range(rounds):
+        found.find_event_file()
+    check(found.parses == 1, "parsed %d times with the file unchanged" % found.parses)
+
+    # The controller goes away, then comes back with a second one
+    with open(path, "w") as out:
+        out.write(without_controller())
+    check(found.find_event_file() == "", "found a controller that is gone")
+    with open(path, "w") as out:
+        out.write(DEVICES_FIXTURE + SECOND_CONTROLLER)
+    paths = found.find_event_files()
+    check(paths == ["/dev/input/event4", "/dev/input/event7"], "two controllers: %s" % paths)
+    check(found.parses == 3, "parsed %d times for 3 different files" % found.parses)
+    missing = InputDevices(root + "/missing", "/dev/input")
+    check(missing.find_event_file() == "" and missing.scan() == [], "a missing devices file found something")
+    print("  fixture: 5 devices, controller on event4, touchpad event2, motion sensors event3, 2 controllers after replug")
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        found.find_event_file()
+    cached = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(rounds):
+        with open(path) as file:
+            parse_input_devices(file.read())
+    uncached = time.perf_counter() - start
+    print("  look up %.1f us with the cache, %.1f us parsing every time" %
+          (1000000 * cached / rounds, 1000000 * uncached / rounds))
+
+
+def unplug_writer(fifo, devices_path, steps):
+    # Plays the controller side of bench_reconnect.  Each step is ("send", events),
+    # ("unplug", seconds), ("plug", None) or ("wait", threading.Event)
+    out = None
+    for (step, arg) in steps:
+        if step == "send":
+            if out is None:
+                # Blocks until the session opens the event file
+                out = os.open(fifo, os.O_WRONLY)
+            for (ev_type, code, value) in arg:
+                os.write(out, struct.pack(EVENT_FORMAT, 0, 0, ev_type, code, value) +
+                         struct.pack(EVENT_FORMAT, 0, 0, EV_SYN, SYN_REPORT, 0))
+        elif step == "unplug":
+            # The kernel takes the controller out of the devices file, and the event file ends
+            with open(devices_path, "w") as file:
+                file.write(without_controller())
+            os.close(out)
+            out = None
+            time.sleep(arg)
+        elif step == "plug":
+            with open(devices_path, "w") as file:
+                file.write(DEVICES_FIXTURE)
+        else:
+            arg.wait(5)
+    if out is not None:
+        os.close(out)
+
+
+def bench_reconnect(through_mux=False):
+    """
+    Runs an InputSession against a made up devices file and a FIFO standing in
+    for the controller's event file, on its own or read through an InputMux as
+    with a co-driver.  The controller drops out twice, once with the end of the
+    file and once with ENODEV.  Checks that the motors are stopped right away
+    each time, that on_found is called when it is back, and that the drive mode
+    and turn multiplier are kept.  Reports how long the controller was gone for
+    before the session had it again.
+    """
+    if through_mux:
+        print("Reconnect benchmark (FIFO for the event file, through the mux)")
+    else:
+        print("Reconnect benchmark (FIFO for the event file)")
+    root = "/tmp/ev3soccer_reconnect"
+    os.makedirs(root, exist_ok=True)
+    devices_path = root + "/devices"
+    fifo = root + "/event4"
+    if os.path.exists(fifo):
+        os.remove(fifo)
+    os.mkfifo(fifo)
+    with open(devices_path, "w") as file:
+        file.write(DEVICES_FIXTURE)
+
+    outputs = MotorOutput()
+    for port in "BC":
+        outputs.add(port, FakeMotor())
+    control = SoccerControl(outputs, False, True, True, False)
+    wall = WallClock()
+    clock = SimStopWatch(wall)
+    found = []
+    lost = []
+
+    def controller_lost():
+        # What EV3Soccer does
+        control.release()
+        outputs.stop()
+        lost.append((clock.time(), dict(outputs.sent)))
+
+    def controller_found():
+        found.append((clock.time(), control.ctrltype, control.turn_multiplier))
+
+    session = InputSession(clock, controller_lost, controller_found, InputDevices(devices_path, root),
+                           wait=wall.advance)
+    driving = threading.Event()
+    driving_again = threading.Event()
+    steps = [("send", [(EVENT_BUTTON, CODE_TRIANGLE, VALUE_BUTTON_PRESSED), (EVENT_BUTTON, CODE_SQUARE, VALUE_BUTTON_PRESSED),
+                       (EVENT_RANGE, CODE_LSTICK_VRANGE, 0), (EVENT_RANGE, CODE_RSTICK_VRANGE, 0)]),
+             ("wait", driving), ("unplug", 0.3), ("plug", None),
+             ("send", [(EVENT_RANGE, CODE_LSTICK_VRANGE, 0), (EVENT_RANGE, CODE_RSTICK_VRANGE, 0)]),
+             ("wait", driving_again), ("unplug", 0)]
+    writer = threading.Thread(target=unplug_writer, args=(fifo, devices_path, steps))
+    writer.start()
+    check(session.connect(), "could not open the FIFO")
+    reader = session
+    if through_mux:
+        reader = InputMux()
+        reader.add("driver", "driver", session)
+
+    moving = []
+    start = clock.time()
+    while len(lost) < 2 and clock.time() - start < 5000:
+        event = reader.read(50)
+        if event is None:
+            continue
+        control.handle_event(event[2], event[3], event[4])
+        if event[2] == EV_SYN and not reader.pending():
+            control.update_motors()
+            if outputs.sent["B"] and outputs.sent["C"]:
+                moving.append(clock.time())
+                if len(found) == 0:
+                    driving.set()
+                elif len(lost) == 1 and not driving_again.is_set():
+                    # Now the controller goes away with an error instead of the end of the file
+                    driving_again.set()
+                    writer.join()
+
+                    def gone(timeout=-1):
+                        raise OSError(19, "No such device")
+                    session.reader.read = gone
+                    session.reader.fill = gone
+    driving.set()
+    driving_again.set()
+    writer.join()
+    reader.close()
+
+    check(len(lost) == 2 and len(found) == 1 and len(moving) >= 2,
+          "lost %d times, found %d times, drove %d times" % (len(lost), len(found), len(moving)))
+    for (when, sent) in lost:
+        check(sent["B"] == 0 and sent["C"] == 0, "motors still running after the controller was lost: %s" % sent)
+    (when, ctrltype, turn) = found[0]
+    check(ctrltype == "Tank" and turn == 90, "lost the drive mode: %s %d" % (ctrltype, turn))
+    print("  EOF: motors stopped, back after %d ms in %s mode, turn %d%%.  ENODEV: motors stopped.  Disconnects:%d" %
+          (when - lost[0][0], ctrltype, turn, session.disconnects))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        recording = sys.argv[1]
+    else:
+        recording = "/tmp/ev3soccer_session.bin"
+        make_recording(recording)
+    bench_reader(recording)
+    bench_motor_output(recording)
+    bench_fixed_rate(recording)
+    bench_mixing()
+    bench_dispatch(recording)
+    bench_watchdog()
+    bench_replay(recording)
+    bench_sim(recording)
+    bench_display(recording)
+    bench_logging(recording)
+    bench_tasks(recording)
+    bench_heading()
+    bench_gyro_calibration()
+    bench_drive_straight()
+    bench_inventory()
+    bench_motor_test(recording)
+    bench_sensor_test()
+    bench_menu()
+    bench_triggers()
+    bench_traction()
+    bench_mux()
+    bench_latency(recording)
+    bench_profile(recording)
+    bench_devices()
+    bench_reconnect()
+    bench_reconnect(through_mux=True)
@@ -0,0 +1,518 @@
+# Control logic for the EV3Soccer group of programs
+#
+# The controller state (sticks, buttons, drive mode) and the math that turns it into motor
+# duty cycles live here, so that they can be used both when the motors are updated for every
+# group of controller events and when they are updated at a fixed rate.
+
+from EV3SoccerUtil import *
+from EV3SoccerMixing import DriveMixer, STICK_CENTER, correct, build_trigger_table
+from EV3SoccerInput import EventDispatcher
+from EV3SoccerLog import log
+from EV3SoccerStats import STAGE_DISPATCH, STAGE_MIXING, STAGE_MOTORS
+
+# How often the motors are updated in fixed rate mode
+CONTROL_PERIOD_MS = 10
+
+# The input watchdog stops the motors when the controller has been quiet this long,
+# winding them down over WATCHDOG_RAMP_MS
+INPUT_TIMEOUT_MS = 1000
+WATCHDOG_RAMP_MS = 300
+
+
+class SoccerControl():
+    """
+    Holds what the controller is currently telling the robot to do, and turns it
+    into duty cycles for the motors.  handle_event() is called for every controller
+    event, and update_motors() whenever the motors should be brought up to date.
+    More buttons are added by registering them with the dispatcher.
+
+    outputs - The MotorOutput the duty cycles are sent through
+    enableMotorA .. enableMotorD - Which motors to drive.  B is the left wheel, C the right wheel
+    expo - 0 to 100.  How much expo curve to put on the sticks
+
+    example: control = SoccerControl(outputs, False, True, True, False)
+             control.handle_event(EVENT_RANGE, CODE_RSTICK_VRANGE, 0)
+             control.update_motors()
+
+    Call use_triggers() to run the optional motors backwards as far as L2 and R2
+    are pressed, instead of full speed or nothing.
+    """
+    def __init__(self, outputs, enableMotorA, enableMotorB, enableMotorC, enableMotorD, expo=0):
+        self.outputs = outputs
+        self.mixer = DriveMixer(expo)
+        self.enableMotorA = enableMotorA
+        self.enableMotorB = enableMotorB
+        self.enableMotorC = enableMotorC
+        self.enableMotorD = enableMotorD
+
+        # Control type Arc = Arcade (Default), Tank
+        self.ctrltype = "Arc"
+
+        # The turn multiplier can be used to slow down turning.  The values are between 10 and 100
+        # 100 means no throttling.  10 means only 10% turning speed.
+        self.turn_multiplier = 100
+
+        # Set when circle/square/triangle changed the controls, so the screen can be updated
+        self.ctrlchange = False
+
+        # Every event is logged at the DEBUG level
+        self.log = log
+
+        # An InputWatchdog, if the motors should stop when the controller goes quiet
+        self.watchdog = None
+
+        # A HeadingHold, if a gyro should keep arcade mode driving straight
+        self.heading_hold = None
+
+        # A DriveStraight, if the left stick should drive dead straight in arcade mode
+        self.straight = None
+
+        # A SlewLimiter, if the wheels should speed up and slow down gradually, and a
+        # TractionControl for each wheel ("B" and "C"), if they should not spin
+        self.ramp = None
+        self.traction = None
+
+        # A StageProfiler, if handling the events and updating the motors should be timed
+        self.profiler = None
+
+        # Assuming sticks are in the middle when starting.
+        self.right_stick_x = STICK_CENTER
+        self.right_stick_y = STICK_CENTER
+        self.left_stick_y = STICK_CENTER
+        self.left_stick_x = STICK_CENTER
+
+        # Buttons for the optional motors
+        self.left_button_up_pressing = 0
+        self.left_button_down_pressing = 0
+        self.right_button_up_pressing = 0
+        self.right_button_down_pressing = 0
+
+        # How far the L2 and R2 triggers are pressed (0 - 255), and the table that turns
+        # that into a duty cycle.  None keeps the optional motors on the buttons only
+        self.left_trigger = 0
+        self.right_trigger = 0
+        self.trigger_table = None
+        # With a clock, the trigger duty cycles are only worked out again every trigger_period_ms
+        self.trigger_clock = None
+        self.trigger_period_ms = CONTROL_PERIOD_MS
+        self.trigger_time = None
+        self.motorA_trigger = 0
+        self.motorD_trigger = 0
+
+        # Which method handles which controller event
+        dispatcher = EventDispatcher()
+        dispatcher.register(EVENT_RANGE, CODE_RSTICK_HRANGE, self.set_right_stick_x)
+        dispatcher.register(EVENT_RANGE, CODE_RSTICK_VRANGE, self.set_right_stick_y)
+        dispatcher.register(EVENT_RANGE, CODE_LSTICK_VRANGE, self.set_left_stick_y)
+        dispatcher.register(EVENT_RANGE, CODE_LSTICK_HRANGE, self.set_left_stick_x)
+        # Modify turn multiplier with the Square and Circle buttons
+        dispatcher.register_press(CODE_CIRCLE, self.turn_faster)
+        dispatcher.register_press(CODE_SQUARE, self.turn_slower)
+        dispatcher.register_press(CODE_TRIANGLE, self.toggle_ctrltype)
+        # Optional motors
+        dispatcher.register(EVENT_BUTTON, CODE_L1, self.set_left_button_up)
+        dispatcher.register(EVENT_BUTTON, CODE_L2, self.set_left_button_down)
+        dispatcher.register(EVENT_BUTTON, CODE_R1, self.set_right_button_up)
+        dispatcher.register(EVENT_BUTTON, CODE_R2, self.set_right_button_down)
+        dispatcher.register(EVENT_RANGE, CODE_L2_RANGE, self.set_left_trigger)
+        dispatcher.register(EVENT_RANGE, CODE_R2_RANGE, self.set_right_trigger)
+        self.dispatcher = dispatcher
+
+    def use_triggers(self, curve=0, clock=None, period_ms=CONTROL_PERIOD_MS):
+        """
+        Runs the optional motors backwards in proportion to how far L2 (A) and R2 (D)
+        are pressed.  L1 and R1 still run them forwards at full speed.
+
+        curve - 0 to 100.  How much expo curve to put on the triggers
+        clock - A StopWatch.  The triggers send an event for every little change, so
+                with a clock their duty cycles are only worked out again every period_ms,
+                however often the motors are updated
+        """
+        self.trigger_table = build_trigger_table(curve)
+        self.trigger_clock = clock
+        self.trigger_period_ms = period_ms
+
+    def release(self):
+        """
+        Puts the sticks back in the middle and lets go of all the buttons.  Used when
+        the controller goes away or the watchdog stops the motors, so the robot doesn't
+        carry on when it comes back.  The drive mode and turn multiplier are kept.
+        """
+        self.right_stick_x = STICK_CENTER
+        self.right_stick_y = STICK_CENTER
+        self.left_stick_y = STICK_CENTER
+        self.left_stick_x = STICK_CENTER
+        self.left_button_up_pressing = 0
+        self.left_button_down_pressing = 0
+        self.right_button_up_pressing = 0
+        self.right_button_down_pressing = 0
+        self.left_trigger = 0
+        self.right_trigger = 0
+        # The motors are being stopped.  Ramp up from 0 again, not down from where they were
+        if self.ramp is not None:
+            self.ramp.reset("B")
+            self.ramp.reset("C")
+
+    def handle_event(self, ev_type, code, value, feed=True):
+        """
+        Updates the controller state with one event.  Does not touch the motors.
+        feed is False for events that should not keep the watchdog happy, like the
+        co-driver's.
+        """
+        # Timed as one stage, debug log and all.  Costs next to nothing while not profiling
+        profiler = self.profiler
+        start = None
+        if profiler is not None and profiler.enabled:
+            start = profiler.start()
+        if self.log.debug_on and ev_type != 0:
+            self.log.debug("%d:%d:%d", ev_type, code, value)
+        if feed and self.watchdog is not None:
+            self.watchdog.feed()
+        self.dispatcher.dispatch(ev_type, code, value)
+        if start is not None:
+            profiler.stop(STAGE_DISPATCH, start)
+
+    # Right Horizontal stick value change
+    def set_right_stick_x(self, value):
+        self.right_stick_x = value
+
+    # Right Vertical stick value change
+    def set_right_stick_y(self, value):
+        self.right_stick_y = value
+
+    # Left Vertical stick value change
+    def set_left_stick_y(self, value):
+        self.left_stick_y = value
+
+    # Left Horizontal stick value change
+    def set_left_stick_x(self, value):
+        self.left_stick_x = value
+
+    def turn_faster(self, value):
+        # Circle Button.  Increase turning speed.
+        # increase by .10 within limit
+        self.turn_multiplier = min( (self.turn_multiplier + 10), 100 )
+        self.mixer.set_turn(self.turn_multiplier)
+        self.ctrlchange = True
+
+    def turn_slower(self, value):
+        # Square Button.  Decrease turning speed.
+        # decrease by .10 within limit
+        self.turn_multiplier = max( (self.turn_multiplier - 10), 10 )
+        self.mixer.set_turn(self.turn_multiplier)
+        self.ctrlchange = True
+
+    def toggle_ctrltype(self, value):
+        # Triangle button. Toggle Arcade / Tank mode
+        self.ctrlchange = True
+        if self.ctrltype == "Arc":
+            self.ctrltype = "Tank"
+        else:
+            self.ctrltype = "Arc"
+
+    #Left 1 (up)
+    def set_left_button_up(self, value):
+        self.left_button_up_pressing = value
+
+    #Left 2 (down)
+    def set_left_button_down(self, value):
+        self.left_button_down_pressing = value
+
+    #Right 1 (up)
+    def set_right_button_up(self, value):
+        self.right_button_up_pressing = value
+
+    #Right 2 (down)
+    def set_right_button_down(self, value):
+        self.right_button_down_pressing = value
+
+    # Left 2 trigger, how far it is pressed.  Comes in floods, so only remember it
+    def set_left_trigger(self, value):
+        self.left_trigger = value
+
+    # Right 2 trigger
+    def set_right_trigger(self, value):
+        self.right_trigger = value
+
+    def update_motors(self):
+        """
+        Works out the duty cycle for every enabled motor from the controller state
+        and sends the ones that changed.
+        """
+        profiler = self.profiler
+        start = None
+        if profiler is not None and profiler.enabled:
+            start = profiler.start()
+        percent = self.allowed()
+        self.set_attachments(percent)
+        self.set_drive(percent)
+
+        # Send only the duty cycles that changed to the motors
+        self.send(start)
+
+    def update_drive(self):
+        """
+        update_motors() for the wheels (B and C) only.
+        """
+        profiler = self.profiler
+        start = None
+        if profiler is not None and profiler.enabled:
+            start = profiler.start()
+        self.set_drive(self.allowed())
+        self.send(start)
+
+    def update_attachments(self):
+        """
+        update_motors() for the optional motors (A and D) only.
+        """
+        profiler = self.profiler
+        start = None
+        if profiler is not None and profiler.enabled:
+            start = profiler.start()
+        self.set_attachments(self.allowed())
+        self.send(start)
+
+    def send(self, start):
+        # Sends the duty cycles.  If profiling, start is when working them out started,
+        # and the mixing and the motor writes are timed
+        if start is None:
+            self.outputs.flush()
+            return
+        start = self.profiler.stop(STAGE_MIXING, start)
+        self.outputs.flush()
+        self.profiler.stop(STAGE_MOTORS, start)
+
+    def allowed(self):
+        # How much of the duty cycle the motors may have.  If the controller has gone
+        # quiet, the watchdog winds everything down
+        if self.watchdog is None:
+            return 100
+        percent = self.watchdog.percent()
+        if percent == 0:
+            # Forget the old stick positions, so the robot doesn't jump
+            # back to them as soon as anything comes in again
+            self.release()
+        return percent
+
+    def set_attachments(self, percent):
+        outputs = self.outputs
+
+        if self.trigger_table is not None:
+            # Backwards as far as the trigger is pressed, or full speed forwards on the button
+            (motorA_speed, motorD_speed) = self.trigger_speeds()
+            if ( self.left_button_up_pressing == 1):
+                motorA_speed = 100
+            if ( self.right_button_up_pressing == 1):
+                motorD_speed = 100
+        else:
+            # Optional motors run full speed one way or the other while their button is held
+            motorA_speed = 0
+            if ( self.left_button_up_pressing == 1):
+                motorA_speed = 100
+            elif ( self.left_button_down_pressing == 1):
+                motorA_speed = -100
+
+            motorD_speed = 0
+            if ( self.right_button_up_pressing == 1):
+                motorD_speed = 100
+            elif ( self.right_button_down_pressing == 1):
+                motorD_speed = -100
+
+        if percent < 100:
+            motorA_speed = motorA_speed * percent // 100
+            motorD_speed = motorD_speed * percent // 100
+
+        if self.enableMotorA:
+            outputs.dc("A", motorA_speed)
+        if self.enableMotorD:
+            outputs.dc("D", motorD_speed)
+
+    def trigger_speeds(self):
+        # The duty cycles for the A and D motors from the triggers, worked out again at
+        # most every trigger_period_ms
+        clock = self.trigger_clock
+        if clock is not None:
+            now = clock.time()
+            if self.trigger_time is not None and now - self.trigger_time < self.trigger_period_ms:
+                return (self.motorA_trigger, self.motorD_trigger)
+            self.trigger_time = now
+        self.motorA_trigger = -self.trigger_table[self.left_trigger]
+        self.motorD_trigger = -self.trigger_table[self.right_trigger]
+        return (self.motorA_trigger, self.motorD_trigger)
+
+    def set_drive(self, percent):
+        outputs = self.outputs
+
+        straight = self.straight
+        if ( self.ctrltype == "Arc" and straight is not None and
+             not ( self.mixer.dead[self.left_stick_y] and self.mixer.dead[self.left_stick_x] )):
+            # Drive straight.  The left stick drives dead straight forward and backward,
+            # or turns on the spot, and overrides the right stick
+            if not self.mixer.dead[self.left_stick_y]:
+                forward = self.mixer.axis[self.left_stick_y]
+                (left_speed, right_speed) = correct(forward, forward, straight.hold())
+            else:
+                straight.release()
+                left = self.mixer.axis[self.left_stick_x]
+                (left_speed, right_speed) = (-left, left)
+        elif ( self.ctrltype == "Arc"):
+            # Arcade Controls.  The right stick does it all
+            if straight is not None:
+                straight.release()
+            (left_speed, right_speed) = self.mixer.arcade(self.right_stick_x, self.right_stick_y, self.turn_multiplier)
+            heading_hold = self.heading_hold
+            if heading_hold is not None:
+                # Not steering, but driving.  Steer against any curve the gyro sees
+                if self.mixer.dead[self.right_stick_x] and not self.mixer.dead[self.right_stick_y]:
+                    (left_speed, right_speed) = correct(left_speed, right_speed, heading_hold.hold())
+                else:
+                    heading_hold.release()
+        else:
+            # Tank controls.  Each stick drives its own side.  The heading and the encoder
+            # counts from before are no good once tank mode has turned the robot
+            if self.heading_hold is not None:
+                self.heading_hold.release()
+            if straight is not None:
+                straight.release()
+            (left_speed, right_speed) = self.mixer.tank(self.left_stick_y, self.right_stick_y)
+
+        if percent < 100:
+            left_speed = left_speed * percent // 100
+            right_speed = right_speed * percent // 100
+
+        if self.ramp is not None:
+            left_speed = self.ramp.limit("B", left_speed, self.ctrltype)
+            right_speed = self.ramp.limit("C", right_speed, self.ctrltype)
+        traction = self.traction
+        if traction is not None:
+            left_speed = traction["B"].limit(left_speed)
+            right_speed = traction["C"].limit(right_speed)
+
+        if self.enableMotorB:
+            outputs.dc("B", left_speed)
+        if self.enableMotorC:
+            outputs.dc("C", right_speed)
+
+
+class InputWatchdog():
+    """
+    Notices when nothing has come in from the controller for a while, and tells
+    the motors to slow down to a stop over ramp_ms milliseconds.  As soon as
+    something comes in again, full power is back.
+
+    Note that the controller does not send anything while the sticks are held
+    perfectly still, so timeout_ms has to be longer than the driver would ever
+    hold a stick without moving it at all.
+
+    clock - A StopWatch
+    timeout_ms - How long the controller may stay quiet
+    ramp_ms - How long it takes to wind down to a stop after that
+
+    example: watchdog = InputWatchdog(StopWatch(), 1000)
+             watchdog.feed()              # for every controller event
+             percent = watchdog.percent() # every motor update
+    """
+    def __init__(self, clock, timeout_ms=INPUT_TIMEOUT_MS, ramp_ms=WATCHDOG_RAMP_MS):
+        self.clock = clock
+        self.timeout_ms = timeout_ms
+        self.ramp_ms = ramp_ms
+        self.last_input = clock.time()
+        self.tripped = False
+        # Statistics.  How many times the watchdog had to step in
+        self.trips = 0
+
+    def feed(self):
+        """
+        Call for every controller event.
+        """
+        self.last_input = self.clock.time()
+
+    def percent(self):
+        """
+        Returns how much of the duty cycle the motors may have, from 100 (all of it)
+        down to 0 (stopped).
+        """
+        quiet = self.clock.time() - self.last_input - self.timeout_ms
+        if quiet <= 0:
+            self.tripped = False
+            return 100
+        if not self.tripped:
+            self.tripped = True
+            self.trips += 1
+        if quiet >= self.ramp_ms:
+            return 0
+        return 100 - quiet * 100 // self.ramp_ms
+
+
+class FixedRateLoop():
+    """
+    Runs the motor updates at a fixed rate, no matter how many controller events
+    come in.  Between updates, the controller events are read as they arrive and
+    only update the controller state.  The time until the next update is the most
+    the reader waits for an event, so a quiet controller never delays an update.
+
+    clock - A pybricks StopWatch (or anything else with time() in milliseconds)
+    period_ms - Milliseconds between motor updates.  10 is 100 times a second
+
+    Keeps statistics on how late each update ran (jitter), and how many updates
+    had to be skipped because the previous one ran too long (overruns).
+
+    example: loop = FixedRateLoop(StopWatch(), 10)
+             loop.run(reader, control.handle_event, control.update_motors)
+             print(loop.report())
+    """
+    def __init__(self, clock, period_ms=CONTROL_PERIOD_MS):
+        self.clock = clock
+        self.period_ms = period_ms
+        self.ticks = 0
+        self.overruns = 0
+        self.jitter_total = 0
+        self.jitter_max = 0
+
+    def run(self, reader, handle_event, tick, idle=None):
+        """
+        Reads events and calls handle_event(ev_type, code, value) for each one, and
+        calls tick() every period_ms milliseconds.  Returns when the reader reaches
+        the end of the file.
+
+        idle - Called after a tick when no events are waiting, for slow work such as
+               drawing on the screen that should not hold up the motors
+        """
+        clock = self.clock
+        period = self.period_ms
+        deadline = clock.time() + period
+        while not reader.eof:
+            now = clock.time()
+            if now >= deadline:
+                # Time for a motor update.  Keep track of how late it is
+                late = now - deadline
+                self.jitter_total += late
+                if late > self.jitter_max:
+                    self.jitter_max = late
+                self.ticks += 1
+                tick()
+                if idle is not None and not reader.pending():
+                    idle()
+                deadline += period
+                # Took so long that the next update is already due.  Skip the missed ones
+                # rather than running several updates in a row with the same state
+                now = clock.time()
+                if now >= deadline:
+                    missed = (now - deadline) // period + 1
+                    self.overruns += missed
+                    deadline += missed * period
+                continue
+
+            event = reader.read(deadline - now)
+            if event:
+                handle_event(event[2], event[3], event[4])
+
+    def report(self):
+        """
+        Returns the loop statistics as text.
+        """
+        average = 0
+        if self.ticks:
+            average = round(self.jitter_total / self.ticks, 2)
+        return ("Ticks:" + str(self.ticks) + " Overruns:" + str(self.overruns) +
+                " Jitter avg:" + str(average) + "ms max:" + str(self.jitter_max) + "ms")
@@ -0,0 +1,127 @@
+# Device discovery for the EV3Soccer group of programs
+
+# The /proc/bus/input/devices file contains a descriptive listing of the input devices
+# that are attached to this device (EV3 Brain).  Each device is a group of lines like this,
+# with an empty line between devices:
+#
+# I: Bus=0005 Vendor=054c Product=09cc Version=8100
+# N: Name="Wireless Controller"
+# H: Handlers=kbd event4 js0
+#
+# The event file for the device is in the /dev/input folder
+DEVICES_FILE = "/proc/bus/input/devices"
+INPUT_DIR = "/dev/input"
+
+# The name the PS4 (and PS3) controller reports.  The PS4 controller also shows up as
+# "Wireless Controller Motion Sensors" and "Wireless Controller Touchpad"
+CONTROLLER_NAME = "Wireless Controller"
+
+
+def parse_input_devices(text):
+    """
+    Parses the contents of the devices file into a list of devices.  Each device
+    is a dictionary with "name", "vendor", "product" and "handlers" (a list).
+
+    example: print(parse_input_devices(open(DEVICES_FILE).read()))
+    """
+    devices = []
+    device = None
+    for line in text.split("\n"):
+        if len(line) < 3 or line[1] != ":":
+            # An empty line ends the device
+            device = None
+            continue
+        if device is None:
+            device = {"name": "", "vendor": "", "product": "", "handlers": []}
+            devices.append(device)
+        kind = line[0]
+        rest = line[3:].strip()
+        if kind == "N" and rest.startswith("Name="):
+            device["name"] = rest[5:].strip('"')
+        elif kind == "H" and rest.startswith("Handlers="):
+            device["handlers"] = rest[9:].split()
+        elif kind == "I":
+            for field in rest.split():
+                if field.startswith("Vendor="):
+                    device["vendor"] = field[7:]
+                elif field.startswith("Product="):
+                    device["product"] = field[8:]
+    return devices
+
+
+class InputDevices():
+    """
+    Keeps a parsed copy of the devices file.  The file is only parsed again when
+    its contents change, so looking for the controller again after it reconnects
+    is cheap.
+
+    devices_file - Where to read the device listing from
+    input_dir - The folder the event files are in
+
+    example: devices = InputDevices()
+             print(devices.find_event_file())
+    """
+    def __init__(self, devices_file=DEVICES_FILE, input_dir=INPUT_DIR):
+        self.devices_file = devices_file
+        self.input_dir = input_dir
+        self.text = None
+        self.devices = []
+        # Statistics.  How many times the file was read, and how many times it had to be parsed
+        self.scans = 0
+        self.parses = 0
+
+    def scan(self):
+        """
+        Reads the devices file and returns the list of devices.  Returns the
+        list from last time if the file has not changed.
+        """
+        self.scans += 1
+        try:
+            with open(self.devices_file) as file:
+                text = file.read()
+        except OSError:
+            text = ""
+        if text != self.text:
+            self.text = text
+            self.devices = parse_input_devices(text)
+            self.parses += 1
+        return self.devices
+
+    def find(self, name=CONTROLLER_NAME):
+        """
+        Returns the first device with exactly this name, or None.
+        """
+        for device in self.scan():
+            if device["name"] == name:
+                return device
+        return None
+
+    def find_event_file(self, name=CONTROLLER_NAME):
+        """
+        Returns the full path of the event file for the device with this name,
+        for example "/dev/input/event4".  Returns the null string if the device
+        is not found.
+        """
+        device = self.find(name)
+        if device is not None:
+            for handler in device["handlers"]:
+                if handler.startswith("event"):
+                    return self.input_dir + "/" + handler
+        return ""
+
+    def find_event_files(self, name=CONTROLLER_NAME):
+        """
+        Returns the full paths of the event files for every device with this name,
+        in the order they are listed.  Two controllers give two.
+        """
+        paths = []
+        for device in self.scan():
+            if device["name"] == name:
+                for handler in device["handlers"]:
+                    if handler.startswith("event"):
+                        paths.append(self.input_dir + "/" + handler)
+        return paths
+
+
+# Shared by all of the programs
+input_devices = InputDevices()
@@ -0,0 +1,482 @@
+# Gyro helpers for the EV3Soccer group of programs
+#
+# Arcade mode drives "straight" by keeping the steering stick in the middle, but two
+# motors are never exactly the same strength, so the robot curves.  HeadingHold uses a
+# gyro to notice the curve and steer against it while the stick is in the middle.
+
+import math
+
+# How often the gyro is read.  Reading it takes a while, so it is read at this rate and
+# the readings are kept, instead of reading it for every controller event
+GYRO_PERIOD_MS = 10
+
+# Heading hold gains, tuned on the simulator with EV3SoccerBench.bench_heading().  The
+# correction is in duty cycle percent: KP per degree off course, KI per degree second
+# off course, and KD per degree per second of turning
+HEADING_KP = 8.0
+HEADING_KI = 2.0
+HEADING_KD = 0.3
+
+# The most the heading hold may change the duty cycle of either wheel
+HEADING_LIMIT = 30
+
+# Calibration reads the gyro this many times while the robot sits still, but never
+# takes longer than GYRO_CALIBRATION_MS
+GYRO_CALIBRATION_LOOP_COUNT = 200
+GYRO_CALIBRATION_MS = 1000
+
+# A gyro that turns faster than this, or is noisier than this, during calibration
+# was not sitting still, so the calibration is not used
+GYRO_REST_RATE = 5
+GYRO_REST_NOISE = 3
+
+# Where calibrations are kept between runs
+GYRO_CALIBRATION_FILE = "/home/robot/gyro_calibration.txt"
+
+# While the robot sits still, the gyro is read for the drift this often
+GYRO_REST_PERIOD_MS = 100
+
+
+def find_gyros(backend):
+    """
+    Returns a list of (port, GyroSensor) for every sensor port with a gyro plugged in.
+    """
+    gyros = []
+    for port in (backend.Port.S1, backend.Port.S2, backend.Port.S3, backend.Port.S4):
+        try:
+            gyros.append((port, backend.GyroSensor(port)))
+        except OSError:
+            pass
+    return gyros
+
+
+class GyroCalibration():
+    """
+    What calibration found out about one gyro.
+
+    drift - Degrees per second the angle creeps while the gyro is still
+    bias - Degrees per second the rate reads while the gyro is still
+    noise - How much the rate readings wander, in degrees per second
+    samples - How many readings it is based on.  0 means it was not measured
+    """
+    def __init__(self, port, drift=0.0, bias=0.0, noise=1.0, samples=0):
+        self.port = port
+        self.drift = drift
+        self.bias = bias
+        self.noise = noise
+        self.samples = samples
+
+    def at_rest(self):
+        # Whether the gyro looked like it was sitting still
+        return abs(self.bias) < GYRO_REST_RATE and self.noise < GYRO_REST_NOISE
+
+    def __str__(self):
+        return (str(self.port) + " drift:" + str(round(self.drift, 3)) + " bias:" +
+                str(round(self.bias, 3)) + " noise:" + str(round(self.noise, 3)) +
+                " samples:" + str(self.samples))
+
+
+class RestFit():
+    """
+    Works out drift, bias and noise from readings of a gyro that is sitting
+    still.  Only running sums are kept, so it does not matter how many readings
+    go in.
+
+    The angle readings give the drift as the slope of a least squares line, and
+    the rate readings give it as their average.  The two are blended, each by how
+    sure it is, so a short noisy run leans on the rate and a long one on the angle.
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum_t = self.sum_a = self.sum_tt = self.sum_ta = self.sum_aa = 0.0
+        self.sum_r = self.sum_rr = 0.0
+        self.first = None
+
+    def add(self, time, angle, rate):
+        # time in milliseconds
+        if self.first is None:
+            self.first = (time, angle)
+        t = (time - self.first[0]) / 1000
+        a = angle - self.first[1]
+        self.count += 1
+        self.sum_t += t
+        self.sum_a += a
+        self.sum_tt += t * t
+        self.sum_ta += t * a
+        self.sum_aa += a * a
+        self.sum_r += rate
+        self.sum_rr += rate * rate
+
+    def calibration(self, port):
+        """
+        Returns a GyroCalibration for what has been added so far.
+        """
+        n = self.count
+        if n == 0:
+            return GyroCalibration(port)
+        bias = self.sum_r / n
+        # Readings are whole numbers, so never trust them to better than rounding
+        variance = max(self.sum_rr / n - bias * bias, 1 / 12)
+        noise = math.sqrt(variance)
+        drift = bias
+        sxx = self.sum_tt - self.sum_t * self.sum_t / n
+        if n > 2 and sxx > 0:
+            sxy = self.sum_ta - self.sum_t * self.sum_a / n
+            syy = self.sum_aa - self.sum_a * self.sum_a / n
+            slope = sxy / sxx
+            slope_variance = max((syy - slope * sxy) / (n - 2), 1 / 12) / sxx
+            bias_variance = variance / n
+            drift = (bias / bias_variance + slope / slope_variance) / (1 / bias_variance + 1 / slope_variance)
+        return GyroCalibration(port, drift, bias, noise, n)
+
+
+def measure_gyros(gyros, clock, wait, samples=GYRO_CALIBRATION_LOOP_COUNT, budget_ms=GYRO_CALIBRATION_MS):
+    """
+    Reads every (port, gyro) in gyros while they sit still, all of them each time
+    round, samples times spread out over budget_ms, and works out the drift and
+    bias of each (see RestFit).  Stops early when budget_ms is used up, so startup
+    never takes longer than that.  Returns a GyroCalibration for each gyro.
+    """
+    gap = budget_ms // samples
+    start = clock.time()
+    fits = [RestFit() for gyro in gyros]
+    for i in range(samples):
+        now = clock.time()
+        if now - start >= budget_ms:
+            break
+        for (fit, (port, gyro)) in zip(fits, gyros):
+            fit.add(now, gyro.angle(), gyro.speed())
+        if gap:
+            wait(gap)
+    return [fit.calibration(port) for (fit, (port, gyro)) in zip(fits, gyros)]
+
+
+def calibrate(port, gyro, clock, wait, samples=GYRO_CALIBRATION_LOOP_COUNT, budget_ms=GYRO_CALIBRATION_MS):
+    """
+    measure_gyros() for a single gyro.
+
+    example: calibration = calibrate(Port.S1, gyro, StopWatch(), wait)
+    """
+    return measure_gyros([(port, gyro)], clock, wait, samples, budget_ms)[0]
+
+
+class CalibrationStore():
+    """
+    Keeps the newest calibration for each gyro port, in memory and in a file,
+    one line per port: port drift bias noise samples
+
+    example: store = CalibrationStore()
+             store.load()
+             store.put(calibrate(Port.S1, gyro, StopWatch(), wait))
+             store.save()
+    """
+    def __init__(self, path=GYRO_CALIBRATION_FILE):
+        self.path = path
+        self.calibrations = {}
+
+    def get(self, port):
+        """
+        Returns the calibration for port, or None.
+        """
+        return self.calibrations.get(str(port))
+
+    def put(self, calibration):
+        self.calibrations[str(calibration.port)] = calibration
+
+    def load(self):
+        """
+        Reads the file.  A missing or damaged file just means no calibrations.
+        """
+        try:
+            with open(self.path) as file:
+                for line in file.read().split("\n"):
+                    fields = line.split()
+                    if len(fields) == 5:
+                        self.put(GyroCalibration(fields[0], float(fields[1]), float(fields[2]),
+                                                 float(fields[3]), int(fields[4])))
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        """
+        Writes the file.  Returns False if it could not be written.
+        """
+        try:
+            with open(self.path, "w") as out:
+                for key in self.calibrations:
+                    calibration = self.calibrations[key]
+                    out.write(key + " " + str(calibration.drift) + " " + str(calibration.bias) + " " +
+                              str(calibration.noise) + " " + str(calibration.samples) + "\n")
+        except OSError:
+            return False
+        return True
+
+
+def calibrate_gyros(gyros, clock, wait, store=None, budget_ms=GYRO_CALIBRATION_MS):
+    """
+    Calibrates every (port, gyro) in gyros at the same time, each with every
+    sample and the whole of budget_ms.  A gyro that was not sitting still gets
+    its stored calibration instead, or none.  Returns a list of
+    (port, gyro, calibration), and saves the good ones in store.
+    """
+    results = []
+    if not gyros:
+        return results
+    measured = measure_gyros(gyros, clock, wait, GYRO_CALIBRATION_LOOP_COUNT, budget_ms)
+    for ((port, gyro), calibration) in zip(gyros, measured):
+        if calibration.samples and calibration.at_rest():
+            if store is not None:
+                store.put(calibration)
+        else:
+            calibration = None
+            if store is not None:
+                calibration = store.get(port)
+            if calibration is None:
+                calibration = GyroCalibration(port)
+        results.append((port, gyro, calibration))
+    if store is not None:
+        store.save()
+    return results
+
+
+class CompensatedGyro():
+    """
+    A gyro with its drift taken out of both the angle and the rate.  Works like a
+    GyroSensor.  The drift taken off the angle is added up a little at every
+    reading, so changing the drift later (at_rest()) only changes the angle from
+    then on.
+
+    gyro - A GyroSensor
+    calibration - A GyroCalibration for it
+    clock - A StopWatch
+
+    example: gyro = CompensatedGyro(GyroSensor(Port.S1), calibration, StopWatch())
+             print(gyro.angle())
+    """
+    def __init__(self, gyro, calibration, clock):
+        self.gyro = gyro
+        self.calibration = calibration
+        self.clock = clock
+        self.drift = calibration.drift
+        # How many readings the drift is based on
+        self.samples = calibration.samples
+        self.correction = 0.0
+        self.time = clock.time()
+        # For at_rest().  The readings since the robot stopped, when the last one was, and
+        # the drift and how many readings it was based on before the robot stopped
+        self.rest = None
+        self.rest_time = 0
+        self.before = (self.drift, self.samples)
+
+    def catch_up(self):
+        now = self.clock.time()
+        self.correction += self.drift * (now - self.time) / 1000
+        self.time = now
+
+    def angle(self):
+        self.catch_up()
+        return self.gyro.angle() - self.correction
+
+    def speed(self):
+        return self.gyro.speed() - self.drift
+
+    def reset_angle(self, angle=0):
+        self.catch_up()
+        self.correction = 0.0
+        self.gyro.reset_angle(angle)
+        self.rest = None
+
+    def at_rest(self, min_ms=1000):
+        """
+        Call regularly while the robot is known to be sitting still (the motors
+        are stopped).  Once the robot has sat still for min_ms, the drift is
+        measured from all the readings since it stopped, and averaged with the
+        drift from before by how many readings each is based on.  The longer the
+        rest, the more it counts.
+        """
+        now = self.clock.time()
+        if self.rest is None:
+            self.rest = RestFit()
+            self.rest_time = now
+            self.before = (self.drift, self.samples)
+        elif now - self.rest_time < GYRO_REST_PERIOD_MS:
+            return
+        self.rest_time = now
+        self.rest.add(now, self.gyro.angle(), self.gyro.speed())
+        if now - self.rest.first[0] < min_ms:
+            return
+        measured = self.rest.calibration(self.calibration.port)
+        (drift, samples) = self.before
+        self.catch_up()
+        self.samples = samples + measured.samples
+        self.drift = (drift * samples + measured.drift * measured.samples) / self.samples
+
+    def moving(self):
+        """
+        Call when the robot starts moving, so the readings from before do not count.
+        """
+        self.rest = None
+
+
+class FusedGyro():
+    """
+    Two (or more) compensated gyros made into one.  The angle and rate are
+    averages weighted by how quiet each gyro was during calibration.  If a gyro
+    stops answering (it was unplugged), the others carry on.  Works like a
+    GyroSensor.
+
+    gyros - A list of CompensatedGyro
+
+    example: gyro = FusedGyro([front, back])
+             sampler = GyroSampler(gyro, StopWatch())
+    """
+    def __init__(self, gyros):
+        self.gyros = list(gyros)
+        self.weights = []
+        for gyro in self.gyros:
+            noise = max(gyro.calibration.noise, 0.1)
+            self.weights.append(1 / (noise * noise))
+
+    def read(self, which):
+        total = 0.0
+        weight = 0.0
+        for i in range(len(self.gyros)):
+            try:
+                if which:
+                    value = self.gyros[i].angle()
+                else:
+                    value = self.gyros[i].speed()
+            except OSError:
+                continue
+            total += value * self.weights[i]
+            weight += self.weights[i]
+        if weight == 0:
+            raise OSError("No gyro answered")
+        return total / weight
+
+    def angle(self):
+        return self.read(True)
+
+    def speed(self):
+        return self.read(False)
+
+    def reset_angle(self, angle=0):
+        for gyro in self.gyros:
+            gyro.reset_angle(angle)
+
+    def at_rest(self):
+        for gyro in self.gyros:
+            gyro.at_rest()
+
+    def moving(self):
+        for gyro in self.gyros:
+            gyro.moving()
+
+
+class GyroSampler():
+    """
+    Reads the gyro no more than once every period_ms, and keeps the readings.
+    sample() can be called as often as you like.
+
+    gyro - A GyroSensor
+    clock - A StopWatch
+    period_ms - The least time between two readings
+
+    example: sampler = GyroSampler(GyroSensor(Port.S1), StopWatch())
+             sampler.sample()
+             print(sampler.angle, sampler.rate)
+    """
+    def __init__(self, gyro, clock, period_ms=GYRO_PERIOD_MS):
+        self.gyro = gyro
+        self.clock = clock
+        self.period_ms = period_ms
+        # The newest readings.  Degrees clockwise, and degrees per second clockwise
+        self.angle = 0
+        self.rate = 0
+        self.time = None
+        # Statistics.  How many times the gyro was actually read
+        self.reads = 0
+
+    def sample(self):
+        """
+        Reads the gyro if the last reading is period_ms old.  Returns True if it did.
+        """
+        now = self.clock.time()
+        if self.time is not None and now - self.time < self.period_ms:
+            return False
+        self.time = now
+        self.angle = self.gyro.angle()
+        self.rate = self.gyro.speed()
+        self.reads += 1
+        return True
+
+
+class HeadingHold():
+    """
+    A PID controller that keeps the robot pointing the way it was pointing when
+    hold() was first called.  Call release() when the driver steers, and the next
+    hold() takes the new heading.
+
+    sampler - A GyroSampler
+    kp, ki, kd - The gains.  See HEADING_KP
+    limit - The most correction either way
+
+    example: heading = HeadingHold(GyroSampler(gyro, StopWatch()))
+             correction = heading.hold()
+             left_motor.dc(forward - correction)
+             right_motor.dc(forward + correction)
+    """
+    def __init__(self, sampler, kp=HEADING_KP, ki=HEADING_KI, kd=HEADING_KD, limit=HEADING_LIMIT):
+        self.sampler = sampler
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.target = None
+        self.integral = 0.0
+        self.time = None
+        self.correction = 0
+        # Statistics.  How many times the heading was taken, and the worst error while holding it
+        self.holds = 0
+        self.error_max = 0
+
+    def release(self):
+        """
+        Stops holding the heading.  The next hold() starts over from the heading then.
+        """
+        self.target = None
+        self.integral = 0.0
+
+    def hold(self):
+        """
+        Returns how much to take off the left wheel's duty cycle and add to the
+        right wheel's, to turn back to the heading.  A whole number.
+        """
+        sampler = self.sampler
+        if not sampler.sample() and self.target is not None:
+            # No new reading, so nothing new to correct
+            return self.correction
+        if self.target is None:
+            self.target = sampler.angle
+            self.integral = 0.0
+            self.time = sampler.time
+            self.correction = 0
+            self.holds += 1
+            return 0
+
+        # Positive error means the robot has turned clockwise (right) off course
+        error = sampler.angle - self.target
+        if abs(error) > self.error_max:
+            self.error_max = abs(error)
+        dt = (sampler.time - self.time) / 1000
+        self.time = sampler.time
+        self.integral += error * dt
+        # Keep the integral from winding up past what the limit can use
+        if self.ki:
+            most = self.limit / self.ki
+            self.integral = max(-most, min(most, self.integral))
+
+        correction = self.kp * error + self.ki * self.integral + self.kd * sampler.rate
+        correction = int(round(max(-self.limit, min(self.limit, correction))))
+        self.correction = correction
+        return correction
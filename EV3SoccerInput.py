@@ -0,0 +1,382 @@
+# Controller input helpers for the EV3Soccer group of programs
+
+import struct
+
+from EV3SoccerUtil import EVENT_BUTTON, VALUE_BUTTON_PRESSED
+from EV3SoccerDevices import input_devices, CONTROLLER_NAME
+from EV3SoccerStats import STAGE_READ, STAGE_UNPACK
+
+# pybricks-micropython calls the module uselect.  Regular Python calls it select
+try:
+    import uselect as select
+except ImportError:
+    import select
+
+# Each event in the event file looks like this:
+# long int, long int, unsigned short, unsigned short, unsigned int
+# (tv_sec, tv_usec, ev_type, code, value)
+EVENT_FORMAT = 'llHHI'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+# The controller sends a "sync" event after every group of changes.  For example,
+# moving the stick diagonally sends 3:0:xx, 3:1:yy and then 0:0:0 to say "that's it for now"
+EV_SYN = 0
+SYN_REPORT = 0
+
+# How many events are read from the controller at most in one go
+MAX_BATCH_EVENTS = 64
+
+# After the controller disconnects, look for it again after this many milliseconds.
+# Each time it is not found, wait twice as long, up to the maximum
+RECONNECT_MIN_MS = 100
+RECONNECT_MAX_MS = 2000
+
+
+class EventReader():
+    """
+    Reads events from the controller event file in batches.  Every time the
+    buffer runs dry, all of the events that are currently waiting in the event
+    file are read in one go into a buffer that is reused over and over again.
+    Events are decoded straight out of that buffer.
+
+    in_file - The file handle for the input from the PS4 controller (already open, binary mode)
+    max_events - The most events to read at one time
+
+    example: reader = EventReader(in_file)
+             event = reader.read()
+             while event:
+                 (tv_sec, tv_usec, ev_type, code, value) = event
+                 ...
+                 event = reader.read()
+    """
+    def __init__(self, in_file, max_events=MAX_BATCH_EVENTS):
+        self.in_file = in_file
+        self.buffer = bytearray(EVENT_SIZE * max_events)
+        self.view = memoryview(self.buffer)
+        # Bytes currently in the buffer, and the offset of the next event to decode
+        self.nbytes = 0
+        self.offset = 0
+        self.eof = False
+        # Regular Python can read whatever is waiting with a single call on the unbuffered
+        # file underneath.  pybricks-micropython reads one event at a time, but only as long
+        # as the poller says there is more waiting
+        raw = getattr(in_file, "raw", None)
+        self.readinto1 = None
+        if raw is not None:
+            self.readinto1 = raw.readinto
+        self.slots = [self.view[i:i + EVENT_SIZE] for i in range(0, len(self.buffer), EVENT_SIZE)]
+        self.poller = select.poll()
+        self.poller.register(in_file, select.POLLIN)
+        # An EventRecorder that gets a copy of every batch, if the session is being recorded
+        self.recorder = None
+        # A StageProfiler that times reading the file and unpacking the events, if profiling
+        self.profiler = None
+        # Statistics.  How many times the file was read, and how many events came back
+        self.fills = 0
+        self.events = 0
+
+    def pending(self):
+        """
+        Returns True if there is at least one more complete event in the buffer.
+        """
+        return self.offset + EVENT_SIZE <= self.nbytes
+
+    def fill(self, timeout=-1):
+        """
+        Waits up to timeout milliseconds (-1 is forever) for events and reads all of
+        the events that are waiting into the buffer.  Events that were not yet decoded
+        are thrown away, so only call this once pending() returns False.
+
+        Returns the number of events now in the buffer.  0 means the timeout expired
+        or the end of the file was reached (check eof).
+        """
+        # Keep a partial event left over from the last read (only happens with recordings)
+        leftover = self.nbytes % EVENT_SIZE
+        if leftover > 0:
+            self.buffer[0:leftover] = self.buffer[self.nbytes - leftover:self.nbytes]
+        self.offset = 0
+        self.nbytes = leftover
+
+        if not self.poller.poll(timeout):
+            return 0
+
+        start = None
+        if self.profiler is not None and self.profiler.enabled:
+            start = self.profiler.start()
+        if self.readinto1 is not None:
+            got = self.readinto1(self.view[leftover:])
+            if got is None:
+                # Opened without blocking, and nothing was waiting after all
+                return 0
+            if not got:
+                self.eof = True
+                return 0
+            self.nbytes += got
+        else:
+            slot = 0
+            while slot < len(self.slots):
+                got = self.in_file.readinto(self.slots[slot])
+                if got is None:
+                    break
+                if not got:
+                    self.eof = True
+                    break
+                self.nbytes += got
+                slot += 1
+                # Stop as soon as nothing else is waiting
+                if not self.poller.poll(0):
+                    break
+
+        if start is not None:
+            self.profiler.stop(STAGE_READ, start)
+        count = self.nbytes // EVENT_SIZE
+        if self.recorder is not None:
+            self.recorder.record(self.view, count * EVENT_SIZE)
+        self.fills += 1
+        self.events += count
+        return count
+
+    def read(self, timeout=-1):
+        """
+        Returns the next event as a tuple (tv_sec, tv_usec, ev_type, code, value).
+        Refills the buffer when it is empty.  Returns None at the end of the file
+        or when no event arrived within timeout milliseconds.
+
+        example: (tv_sec, tv_usec, ev_type, code, value) = reader.read()
+        """
+        if not self.pending():
+            if not self.fill(timeout):
+                return None
+        offset = self.offset
+        self.offset = offset + EVENT_SIZE
+        profiler = self.profiler
+        if profiler is None or not profiler.enabled:
+            return struct.unpack_from(EVENT_FORMAT, self.buffer, offset)
+        start = profiler.start()
+        event = struct.unpack_from(EVENT_FORMAT, self.buffer, offset)
+        profiler.stop(STAGE_UNPACK, start)
+        return event
+
+    def close(self):
+        self.in_file.close()
+
+
+class InputSession():
+    """
+    Keeps the controller connected.  It reads events just like an EventReader, but
+    when the controller goes away (the Bluetooth link drops), it calls on_lost() right
+    away so the motors can be stopped, and then keeps looking for the controller in the
+    devices file.  Once it is back, the event file is opened again, on_found() is called
+    and reading carries on as if nothing happened.
+
+    clock - A StopWatch, used to space out the looks for the controller
+    on_lost - Called with no arguments as soon as the controller is gone
+    on_found - Called with no arguments when the controller is back
+    devices - The InputDevices used to find the controller
+    name - The name of the controller in the devices file
+    wait - The wait() that goes with clock, for waiting between the looks.  pybricks' by default
+
+    example: session = InputSession(StopWatch(), on_lost=stop_motors)
+             if not session.connect():
+                 print("Controller connected?")
+             event = session.read()
+    """
+    def __init__(self, clock, on_lost=None, on_found=None, devices=input_devices, name=CONTROLLER_NAME, wait=None):
+        if wait is None:
+            from pybricks.tools import wait
+        self.clock = clock
+        self.wait = wait
+        self.on_lost = on_lost
+        self.on_found = on_found
+        self.devices = devices
+        self.name = name
+        self.in_file = None
+        self.reader = None
+        # An EventRecorder to hand to every reader, if the session is being recorded
+        self.recorder = None
+        # A StageProfiler to hand to every reader, if profiling
+        self.profiler = None
+        # Never set.  The session keeps waiting for the controller to come back
+        self.eof = False
+        self.retry_ms = RECONNECT_MIN_MS
+        self.next_try = 0
+        # Statistics.  How many times the controller went away
+        self.disconnects = 0
+
+    def connect(self):
+        """
+        Finds the controller and opens its event file.  Returns False if it is
+        not there (yet).
+        """
+        infile_path = self.devices.find_event_file(self.name)
+        if infile_path == "":
+            return False
+        try:
+            # open file in binary mode
+            self.in_file = open(infile_path, "rb")
+        except OSError:
+            return False
+        self.reader = EventReader(self.in_file)
+        self.reader.recorder = self.recorder
+        self.reader.profiler = self.profiler
+        self.retry_ms = RECONNECT_MIN_MS
+        return True
+
+    def connected(self):
+        return self.reader is not None
+
+    def look(self):
+        """
+        Looks for the controller again, but not too often.  Returns True once it
+        is back.
+        """
+        now = self.clock.time()
+        if now < self.next_try:
+            return False
+        if self.connect():
+            if self.on_found:
+                self.on_found()
+            return True
+        self.next_try = now + self.retry_ms
+        self.retry_ms = min(self.retry_ms * 2, RECONNECT_MAX_MS)
+        return False
+
+    def due_in(self):
+        """
+        Returns how many milliseconds until the next look for the controller, or
+        -1 while it is connected.
+        """
+        if self.reader is not None:
+            return -1
+        return max(0, self.next_try - self.clock.time())
+
+    def lost(self):
+        """
+        Closes the event file and tells the program that the controller is gone.
+        """
+        try:
+            self.in_file.close()
+        except OSError:
+            pass
+        self.in_file = None
+        self.reader = None
+        self.disconnects += 1
+        self.next_try = self.clock.time()
+        if self.on_lost:
+            self.on_lost()
+
+    def pending(self):
+        return self.reader is not None and self.reader.pending()
+
+    def fill(self, timeout=-1):
+        """
+        Works like EventReader.fill(), so an InputMux can read the session.  While
+        the controller is gone it only looks for it, when that is due, and returns 0.
+        """
+        if self.reader is None:
+            self.look()
+            return 0
+        try:
+            count = self.reader.fill(timeout)
+        except OSError:
+            # ENODEV.  The controller is gone
+            count = 0
+            self.reader.eof = True
+        if not count and self.reader.eof:
+            self.lost()
+        return count
+
+    def close(self):
+        if self.in_file is not None:
+            self.in_file.close()
+        self.in_file = None
+        self.reader = None
+
+    def read(self, timeout=-1):
+        """
+        Returns the next event, like EventReader.read().  Returns None if no event
+        arrived within timeout milliseconds, also while the controller is gone.
+        """
+        deadline = self.clock.time() + timeout
+        while True:
+            if self.reader is None:
+                if self.look():
+                    continue
+                now = self.clock.time()
+                wake = self.next_try
+                if timeout >= 0 and deadline < wake:
+                    wake = deadline
+                if wake > now:
+                    self.wait(wake - now)
+                if timeout >= 0 and self.clock.time() >= deadline:
+                    return None
+                continue
+
+            remaining = -1
+            if timeout >= 0:
+                remaining = max(deadline - self.clock.time(), 0)
+            try:
+                event = self.reader.read(remaining)
+            except OSError:
+                # ENODEV.  The controller is gone
+                event = None
+                self.reader.eof = True
+            if event is not None or not self.reader.eof:
+                return event
+            self.lost()
+
+
+class EventDispatcher():
+    """
+    Calls the right handler for each controller event, found with a dictionary
+    lookup on the event type and then one on the code.  Handlers are called
+    with the event value.  Adding a button means registering one more handler.
+
+    example: dispatcher = EventDispatcher()
+             dispatcher.register(EVENT_RANGE, CODE_RSTICK_HRANGE, set_stick_x)
+             dispatcher.register_press(CODE_TRIANGLE, toggle_mode)
+             dispatcher.dispatch(ev_type, code, value)
+    """
+    def __init__(self):
+        # The handlers for each event type, by code.  Most events are sync events and stick
+        # moves, so the first lookup either misses straight away or finds a small table
+        self.handlers = {}
+        # dispatch() runs for every event, so it is a closure with the table's get() already
+        # looked up, instead of a method finding self.handlers.get every time.  register()
+        # only ever adds to this one dictionary, so the get() stays right
+        get = self.handlers.get
+
+        def dispatch(ev_type, code, value):
+            """
+            Calls the handler for this event.  Returns False if there isn't one.
+            """
+            codes = get(ev_type)
+            if codes is None:
+                return False
+            handler = codes.get(code)
+            if handler is None:
+                return False
+            handler(value)
+            return True
+        self.dispatch = dispatch
+
+    def register(self, ev_type, code, handler):
+        """
+        Calls handler(value) for every event with this type and code.  Replaces
+        any handler that was already registered for it.
+        """
+        codes = self.handlers.get(ev_type)
+        if codes is None:
+            codes = {}
+            self.handlers[ev_type] = codes
+        codes[code] = handler
+
+    def register_press(self, code, handler):
+        """
+        Calls handler(value) only when the button with this code is pressed,
+        not when it is released.
+        """
+        def on_press(value):
+            if value == VALUE_BUTTON_PRESSED:
+                handler(value)
+        self.register(EVENT_BUTTON, code, on_press)
@@ -0,0 +1,226 @@
+# Motor and sensor inventory for the EV3Soccer group of programs
+#
+# ev3dev makes a folder for every motor and sensor that is plugged in, in /sys/class/tacho-motor
+# and /sys/class/lego-sensor.  The folder has a made up name (motor0, sensor3, ...) and holds,
+# among others, these two files:
+#
+# driver_name - What kind of device it is, for example lego-ev3-l-motor or lego-ev3-gyro
+# address     - Which port it is on, for example ev3-ports:outC or ev3-ports:in4
+#
+# The folder listing is read every scan.  Only folders that are new since the last scan have
+# their files read, so scanning again is cheap when nothing was plugged in or out.  The
+# pybricks Motor or sensor for a device is only made the first time it is asked for.
+#
+# example: inventory = Inventory(backend)
+#          for device in inventory.motors():
+#              print(device.port, device.kind)
+#          left = inventory.motor("B").get()
+
+from os import (listdir)
+
+# What driver_name says for each kind of device
+class MotorType():
+    MEDIUM = "lego-ev3-m-motor"
+    LARGE = "lego-ev3-l-motor"
+
+class SensorType():
+    ULTRASONIC = "lego-ev3-us"
+    GYRO = "lego-ev3-gyro"
+    COLOR = "lego-ev3-color"
+    TOUCH = "lego-ev3-touch"
+    INFRARED = "lego-ev3-ir"
+
+# The backend constructor for each kind of sensor
+SENSOR_CLASSES = {SensorType.ULTRASONIC: "UltrasonicSensor",
+                  SensorType.GYRO: "GyroSensor",
+                  SensorType.COLOR: "ColorSensor",
+                  SensorType.TOUCH: "TouchSensor",
+                  SensorType.INFRARED: "InfraredSensor"}
+
+
+def read_line(path):
+    # Returns the first line of a small sysfs file without the newline, or the null string
+    try:
+        with open(path) as file:
+            return file.readline().strip()
+    except OSError:
+        return ""
+
+
+def parse_address(address):
+    """
+    Returns the port name from an address, for example "C" for "ev3-ports:outC" and
+    "4" for "ev3-ports:in4" or "ev3-ports:in4:i2c1".  Returns the null string if
+    the address is not an EV3 port.
+    """
+    parts = address.split(":")
+    if len(parts) < 2 or parts[0] != "ev3-ports":
+        return ""
+    port = parts[1]
+    for prefix in ("out", "in"):
+        if port.startswith(prefix):
+            return port[len(prefix):]
+    return ""
+
+
+def make_port(Port, name):
+    """
+    Returns the Port for a port name, for example Port.C for "C" and Port.S4 for "4".
+    Returns None for a name that is not a port.
+    """
+    if name.isdigit():
+        name = "S" + name
+    return getattr(Port, name, None)
+
+
+class Device():
+    """
+    One motor or sensor found in /sys/class.
+
+    name - The folder name, for example "motor0"
+    kind - What driver_name says, for example MotorType.LARGE
+    port - The Port it is plugged into, or None
+    port_name - The port as a letter or number, for example "B" or "1"
+    """
+    def __init__(self, name, kind, port_name, port, make):
+        self.name = name
+        self.kind = kind
+        self.port_name = port_name
+        self.port = port
+        self.make = make
+        self.device = None
+
+    def get(self):
+        """
+        Returns the pybricks Motor or sensor for this device, made the first time it
+        is asked for.  Returns None for kinds of device there is no class for.
+        """
+        if self.device is None and self.make is not None and self.port is not None:
+            self.device = self.make(self.port)
+        return self.device
+
+    def __repr__(self):
+        return self.port_name + ":" + self.kind
+
+
+class DeviceFolder():
+    """
+    Keeps track of the devices in one /sys/class folder.
+
+    folder - The folder, for example "/sys/class/tacho-motor"
+    Port - Turns port names into Ports.  None keeps the port names as they are
+    makers - The function that makes the pybricks object, for each kind of device.
+             Under the key None, the one for every other kind
+
+    example: motors = DeviceFolder("/sys/class/tacho-motor")
+             print(motors.ports())
+    """
+    def __init__(self, folder, Port=None, makers=None):
+        self.folder = folder
+        self.Port = Port
+        if makers is None:
+            makers = {}
+        self.makers = makers
+        # The folder listing from the last scan, and the device in each folder
+        self.names = None
+        self.found = {}
+        self.devices = []
+        # Statistics.  How many times the folder was listed, and how many device folders were read
+        self.scans = 0
+        self.reads = 0
+
+    def scan(self):
+        """
+        Returns the list of devices, in port order.  Only folders that showed up since
+        the last scan are read.
+        """
+        self.scans += 1
+        try:
+            names = sorted(listdir(self.folder))
+        except OSError:
+            names = []
+        if names == self.names:
+            return self.devices
+        self.names = names
+
+        found = {}
+        for name in names:
+            device = self.found.get(name)
+            if device is None:
+                device = self.read(name)
+            found[name] = device
+        self.found = found
+        self.devices = sorted(found.values(), key=lambda device: device.port_name)
+        return self.devices
+
+    def read(self, name):
+        # Reads the type and port of the device in one folder
+        self.reads += 1
+        path = self.folder + "/" + name + "/"
+        kind = read_line(path + "driver_name")
+        port_name = parse_address(read_line(path + "address"))
+        port = port_name
+        if self.Port is not None:
+            port = make_port(self.Port, port_name)
+        make = self.makers.get(kind, self.makers.get(None))
+        return Device(name, kind, port_name, port, make)
+
+    def ports(self):
+        """
+        Returns the port names of all the devices, for example ["B", "C"].
+        """
+        return [device.port_name for device in self.scan()]
+
+    def find(self, port_name):
+        """
+        Returns the device on a port (for example "B" or "1"), or None.
+        """
+        for device in self.scan():
+            if device.port_name == port_name:
+                return device
+        return None
+
+
+class Inventory():
+    """
+    The motors and sensors plugged into the brick (or the simulator).
+
+    backend - Where the folders, Port and the Motor and sensor classes come from
+
+    example: inventory = Inventory(get_backend())
+             gyro = inventory.sensor("2")
+             if gyro is not None and gyro.kind == SensorType.GYRO:
+                 print(gyro.get().angle())
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        sensor_makers = {}
+        for kind in SENSOR_CLASSES:
+            sensor_makers[kind] = getattr(backend, SENSOR_CLASSES[kind])
+        self.motor_folder = DeviceFolder(backend.motor_dir, backend.Port, {None: backend.Motor})
+        self.sensor_folder = DeviceFolder(backend.sensor_dir, backend.Port, sensor_makers)
+
+    def motors(self):
+        return self.motor_folder.scan()
+
+    def sensors(self):
+        return self.sensor_folder.scan()
+
+    def motor(self, port_name):
+        return self.motor_folder.find(port_name)
+
+    def sensor(self, port_name):
+        return self.sensor_folder.find(port_name)
+
+
+# One DeviceFolder for each folder, shared by all of the programs, so the folders are not
+# read again every time
+folders = {}
+
+def device_folder(folder):
+    """
+    Returns the shared DeviceFolder, with port names for ports, for a /sys/class folder.
+    """
+    if folder not in folders:
+        folders[folder] = DeviceFolder(folder)
+    return folders[folder]
@@ -0,0 +1,190 @@
+# Logging for the EV3Soccer group of programs
+#
+# When the program runs from VS Code, print() is a write over USB or bluetooth to the
+# debug console, and the program waits for it.  So the programs log into a ring of
+# records kept in memory instead.  The message is only put together (fmt % args) when
+# the record is written out by flush(), which the programs call when they have nothing
+# else to do.  Records below the logger's level are not kept at all.
+#
+# example: from EV3SoccerLog import log, DEBUG
+#          log.set_level(DEBUG)
+#          log.debug("%d:%d:%d", ev_type, code, value)
+#          ...
+#          log.flush()
+
+import sys
+
+# The levels.  OFF turns logging off completely
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+
+# How many records the ring holds.  Once it is full, the oldest records are dropped
+LOG_RECORDS = 256
+
+# The most records one flush() writes out, so that flushing never takes long
+LOG_FLUSH_RECORDS = 16
+
+# flush() waits until this many milliseconds have gone by, or LOG_FLUSH_RECORDS are
+# waiting, so that the records go out several at a time instead of one write each
+LOG_FLUSH_INTERVAL_MS = 100
+
+
+def nothing(fmt, *args):
+    # Stands in for the methods of the levels that are turned off
+    pass
+
+
+class Logger():
+    """
+    Keeps log records in a ring until flush() writes them out.  The ring is
+    made once, up front, so logging does not build any text or lists.
+
+    level - Records below this level are thrown away.  OFF throws them all away
+    size - How many records the ring holds
+    clock - A StopWatch, to put the time on every record.  None leaves the time out
+    path - Write the records to the end of this file.  The null string prints them
+
+    For the busiest places, check the level first so that not even the arguments
+    are worked out when the level is off:
+
+        if log.debug_on:
+            log.debug("stick %d", value)
+
+    example: log = Logger(INFO, clock=StopWatch())
+             log.info("Turn:%d Control Type:%s", 100, "Arc")
+             log.flush()
+    """
+    def __init__(self, level=INFO, size=LOG_RECORDS, clock=None, path=""):
+        self.size = size
+        self.clock = clock
+        self.path = path
+        # The ring.  One list for each part of a record
+        self.times = [0] * size
+        self.levels = [0] * size
+        self.formats = [None] * size
+        self.arguments = [None] * size
+        # Where the next record goes, and how many are waiting to be written out
+        self.next = 0
+        self.waiting = 0
+        # When flush() last wrote something out
+        self.last = 0
+        # Statistics.  How many records were kept, written out and dropped because the ring was full
+        self.records = 0
+        self.written = 0
+        self.dropped = 0
+        self.set_level(level)
+
+    def set_level(self, level):
+        """
+        Changes the level.  The methods for the levels that are off are swapped for
+        ones that do nothing.
+        """
+        self.level = level
+        self.debug_on = level <= DEBUG
+        self.info_on = level <= INFO
+        if self.debug_on:
+            self.debug = self.keep_debug
+        else:
+            self.debug = nothing
+        if self.info_on:
+            self.info = self.keep_info
+        else:
+            self.info = nothing
+        if level <= WARNING:
+            self.warning = self.keep_warning
+        else:
+            self.warning = nothing
+        if level <= ERROR:
+            self.error = self.keep_error
+        else:
+            self.error = nothing
+
+    def keep_debug(self, fmt, *args):
+        self.keep(DEBUG, fmt, args)
+
+    def keep_info(self, fmt, *args):
+        self.keep(INFO, fmt, args)
+
+    def keep_warning(self, fmt, *args):
+        self.keep(WARNING, fmt, args)
+
+    def keep_error(self, fmt, *args):
+        self.keep(ERROR, fmt, args)
+
+    def log(self, level, fmt, *args):
+        """
+        Keeps a record at any level.
+        """
+        if level >= self.level:
+            self.keep(level, fmt, args)
+
+    def keep(self, level, fmt, args):
+        slot = self.next
+        if self.clock is not None:
+            self.times[slot] = self.clock.time()
+        self.levels[slot] = level
+        self.formats[slot] = fmt
+        self.arguments[slot] = args
+        self.next = (slot + 1) % self.size
+        self.records += 1
+        if self.waiting == self.size:
+            self.dropped += 1
+        else:
+            self.waiting += 1
+
+    def flush(self, limit=LOG_FLUSH_RECORDS):
+        """
+        Writes out up to limit of the waiting records, oldest first, once enough
+        are waiting or enough time has gone by.  A limit of 0 writes them all
+        right away.  Returns the number written.
+        """
+        count = self.waiting
+        if count == 0:
+            return 0
+        if limit:
+            if count > limit:
+                count = limit
+            elif self.clock is not None and self.clock.time() - self.last < LOG_FLUSH_INTERVAL_MS:
+                return 0
+        if self.clock is not None:
+            self.last = self.clock.time()
+        lines = []
+        slot = (self.next - self.waiting) % self.size
+        for i in range(count):
+            text = self.formats[slot]
+            args = self.arguments[slot]
+            if args:
+                text = text % args
+            line = LEVEL_NAMES.get(self.levels[slot], "") + " " + text
+            if self.clock is not None:
+                line = str(self.times[slot]) + " " + line
+            lines.append(line)
+            # Let go of the arguments, so they can be freed
+            self.arguments[slot] = None
+            slot = (slot + 1) % self.size
+        self.waiting -= count
+        self.written += count
+        # One write for all of them
+        text = "\n".join(lines) + "\n"
+        if self.path:
+            with open(self.path, "a") as out:
+                out.write(text)
+        else:
+            sys.stdout.write(text)
+        return count
+
+    def report(self):
+        """
+        Returns the logger statistics as text.
+        """
+        return ("Log records:" + str(self.records) + " Written:" + str(self.written) +
+                " Dropped:" + str(self.dropped))
+
+
+# Shared by all of the programs
+log = Logger()
@@ -0,0 +1,208 @@
+# Menus for the EV3Soccer group of programs
+#
+# A menu is a list of items, each with a label at a spot on the screen and, optionally, a value
+# that can be changed.  The D-pad moves the marker from item to item (and changes the value of
+# items that have one) and the Option button picks the item the marker is on.  Everything goes
+# through a Display, so moving the marker only redraws the old and the new marker, and changing
+# a value only redraws that value.
+#
+# example: items = [MenuItem(10, 20, "A", ("N", "Y")), MenuItem(10, 40, "D", ("N", "Y"))]
+#          menu = Menu(display, items, header=((5, 1, "Port"), (95, 1, "Enabled")))
+#          if run_menu(menu, reader, display) is not None:
+#              print(items[0].value, items[1].value)
+
+from EV3SoccerUtil import *
+from EV3SoccerInput import EventDispatcher
+
+# How far left of an item the marker goes, when there are no values
+MARKER_OFFSET = 9
+
+# How far right of an item its value goes, and how far left of the value the marker goes
+VALUE_OFFSET = 90
+VALUE_MARKER_OFFSET = 15
+
+
+def dpad_step(value):
+    """
+    Turns a D-pad value into a step: 1, -1, or 0 when the pad is let go.  Up and
+    left come in as a very large number instead of -1.
+    """
+    if value == 0:
+        return 0
+    if value > 2:
+        return -1
+    return 1
+
+
+class MenuItem():
+    """
+    One thing on a menu.
+
+    x, y - Where the label goes
+    label - The text for it
+    choices - The values it can have, for example ("N", "Y").  None for an item
+              that is only picked
+    value - Which of the choices it starts with.  The first one by default
+    """
+    def __init__(self, x, y, label, choices=None, value=None):
+        self.x = x
+        self.y = y
+        self.label = label
+        self.choices = choices
+        if choices and value not in choices:
+            value = choices[0]
+        self.value = value
+
+    def change(self, step):
+        # Moves to the next (or previous) choice, going round
+        index = self.choices.index(self.value)
+        self.value = self.choices[(index + step) % len(self.choices)]
+
+
+class Menu():
+    """
+    Handles the controller events for a menu and keeps the screen up to date.
+    It never waits for anything, so it can be driven by any loop (see run_menu).
+
+    display - The Display to draw on
+    items - The MenuItems, in the order the D-pad goes through them
+    columns - How many items there are in each row.  D-pad up and down move a whole row
+    header, footer - Text that never changes, as (x, y, text)
+    wait_release - Only finish once the Option button is let go again, so the program
+                   that runs next does not see it being let go
+
+    With values, D-pad left and right change the value of the item the marker is
+    on, instead of moving the marker.
+
+    example: menu = Menu(display, [MenuItem(10, 20, "1"), MenuItem(100, 20, "A")], columns=2)
+             menu.draw()
+             menu.handle_event(ev_type, code, value)
+             if menu.finished:
+                 print(menu.selected().label)
+    """
+    def __init__(self, display, items, columns=1, header=(), footer=(), wait_release=False):
+        self.display = display
+        self.items = items
+        self.columns = columns
+        self.header = header
+        self.footer = footer
+        self.wait_release = wait_release
+        self.has_values = False
+        for item in items:
+            if item.choices:
+                self.has_values = True
+        self.selection = 0
+        self.done = False
+        self.finished = False
+        # Statistics.  How many events were handled
+        self.events = 0
+
+        dispatcher = EventDispatcher()
+        dispatcher.register(EVENT_RANGE, CODE_DPAD_HRANGE, self.dpad_horizontal)
+        dispatcher.register(EVENT_RANGE, CODE_DPAD_VRANGE, self.dpad_vertical)
+        dispatcher.register(EVENT_BUTTON, CODE_OPTION, self.option_button)
+        self.dispatcher = dispatcher
+
+    def marker_spot(self, item):
+        # Where the marker goes for an item
+        if self.has_values:
+            return (item.x + VALUE_OFFSET - VALUE_MARKER_OFFSET, item.y)
+        return (item.x - MARKER_OFFSET, item.y)
+
+    def draw(self):
+        """
+        Puts the whole menu on the display.  Call once, when the menu opens.
+        """
+        display = self.display
+        for (x, y, text) in self.header:
+            display.text(x, y, text)
+        for item in self.items:
+            display.text(item.x, item.y, item.label)
+            if item.choices:
+                display.text(item.x + VALUE_OFFSET, item.y, item.value)
+        for (x, y, text) in self.footer:
+            display.text(x, y, text)
+        (x, y) = self.marker_spot(self.items[self.selection])
+        display.text(x, y, "*")
+
+    def selected(self):
+        return self.items[self.selection]
+
+    def move(self, step):
+        """
+        Moves the marker step items on, going round.
+        """
+        count = len(self.items)
+        selection = (self.selection + step) % count
+        if selection != self.selection:
+            (x, y) = self.marker_spot(self.items[self.selection])
+            self.display.remove(x, y)
+            self.selection = selection
+            (x, y) = self.marker_spot(self.items[selection])
+            self.display.text(x, y, "*")
+
+    def dpad_horizontal(self, value):
+        step = dpad_step(value)
+        if step == 0:
+            return
+        item = self.items[self.selection]
+        if self.has_values:
+            if item.choices:
+                item.change(step)
+                self.display.text(item.x + VALUE_OFFSET, item.y, item.value)
+        else:
+            self.move(step)
+
+    def dpad_vertical(self, value):
+        self.move(dpad_step(value) * self.columns)
+
+    def option_button(self, value):
+        if value == VALUE_BUTTON_PRESSED:
+            self.done = True
+            if not self.wait_release:
+                self.finished = True
+        elif self.done:
+            # Let go of the button that picked the item
+            self.finished = True
+
+    def handle_event(self, ev_type, code, value):
+        """
+        Handles one controller event.  Returns True once the menu is finished.
+        """
+        self.events += 1
+        self.dispatcher.dispatch(ev_type, code, value)
+        return self.finished
+
+
+def run_menu(menu, reader, display, tick=None, tick_ms=-1):
+    """
+    Shows a menu and handles the controller until an item is picked.  Returns the
+    selected MenuItem, or None if the controller went away first.
+
+    reader - The EventReader (or InputSession) for the controller
+    tick - Called at least every tick_ms while the menu is open, for anything that
+           has to keep going meanwhile, like stopping motors when the controller
+           goes quiet.  The menu never waits longer than tick_ms for the controller
+    """
+    menu.draw()
+    display.flush(force=True)
+
+    # Read from the controller.  Stop waiting for it when there is something to draw
+    event = reader.read(0)
+    while event or not reader.eof:
+        if event is not None:
+            (tv_sec, tv_usec, ev_type, code, value) = event
+            if menu.handle_event(ev_type, code, value):
+                return menu.selected()
+        if tick is not None:
+            tick()
+        # Draw the changes once the events that are waiting have been handled
+        if event is None or not reader.pending():
+            display.flush()
+
+        # Finally, read another event
+        timeout = display.due_in()
+        if tick_ms >= 0 and ( timeout < 0 or tick_ms < timeout ):
+            timeout = tick_ms
+        event = reader.read(timeout)
+    return None
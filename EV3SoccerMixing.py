@@ -0,0 +1,176 @@
+# Drive mixing for the EV3Soccer group of programs
+#
+# Turns stick positions (0 - 255) into motor duty cycles (-100 - 100) with table lookups
+# and whole numbers only.  All of the division and multiplication happens once, when the
+# tables are built, instead of for every controller event.
+
+from array import array
+
+# The deadband means ignore any settings below this.  Prevents the robot from moving unless the joystick
+# is really being toggled
+STICK_THRESHOLD = 10
+
+# Where a stick rests when let go.  The middle of 0 - 255, the position closest to a duty cycle of 0
+STICK_CENTER = 128
+
+
+def stick_duty(val, expo=0):
+    """
+    The duty cycle for one stick position, before rounding.  Only used to build the tables.
+    """
+    duty = 100.0 - val * 200.0 / 255
+    if expo:
+        duty = duty * (100 - expo) / 100 + duty * duty * duty * expo / 1000000
+    return duty
+
+
+def build_axis_table(expo=0):
+    """
+    Builds a table that turns a stick position (0 - 255) into a duty cycle.  Pushing
+    the stick up (0) is 100, pulling it down (255) is -100.  The same as
+    scale(val, (0,255), (100,-100)), rounded to a whole number.
+
+    expo - 0 to 100.  How much of an expo curve to add.  0 is a straight line.  The higher
+           the number, the gentler the response around the middle of the stick, while
+           full stick still gives full power.
+
+    example: table = build_axis_table()
+             print(table[0], table[255])
+    """
+    table = array('b', bytes(256))
+    for val in range(256):
+        table[val] = int(round(stick_duty(val, expo)))
+    return table
+
+
+def build_deadband_table(threshold=STICK_THRESHOLD):
+    """
+    Builds a table that says for every stick position (0 - 255) whether it is inside
+    the deadband (1) or not (0).  This uses the unrounded scale so that it agrees with
+    abs(scale(val, (0,255), (100,-100))) < threshold.
+    """
+    table = array('B', bytes(256))
+    for val in range(256):
+        if abs(stick_duty(val)) < threshold:
+            table[val] = 1
+    return table
+
+
+def build_steer_table(turn_multiplier, expo=0):
+    """
+    Builds a table of the turning part of the arcade mix for one turn_multiplier
+    (10 - 100).  It is the axis table scaled down by turn_multiplier percent.
+    """
+    table = array('b', bytes(256))
+    for val in range(256):
+        table[val] = int(round(stick_duty(val, expo) * turn_multiplier / 100))
+    return table
+
+
+# Trigger positions (0 - 255) below this are ignored, so a trigger that does not quite spring
+# back all the way does not creep the motor
+TRIGGER_THRESHOLD = 8
+
+
+def build_trigger_table(curve=0, threshold=TRIGGER_THRESHOLD):
+    """
+    Builds a table that turns an analog trigger position (0 - 255) into a duty
+    cycle from 0 to 100.  Inside the deadband it is 0, and the rest of the trigger
+    travel is spread over the whole duty cycle range, so full trigger is 100.
+
+    curve - 0 to 100.  How much expo curve to add, the same as for the sticks.  The
+            higher the number, the finer the control with the trigger pressed lightly
+
+    example: table = build_trigger_table(50)
+             print(table[128], table[255])
+    """
+    table = array('B', bytes(256))
+    for val in range(threshold, 256):
+        duty = (val - threshold + 1) * 100.0 / (256 - threshold)
+        if curve:
+            duty = duty * (100 - curve) / 100 + duty * duty * duty * curve / 1000000
+        table[val] = int(round(duty))
+    return table
+
+
+def correct(left, right, correction):
+    """
+    Takes correction off the left duty cycle and adds it to the right one, to turn
+    the robot left (a negative correction turns it right).  If that puts one side
+    past full power, the excess comes off both sides, so the difference between
+    them, which is what does the turning, stays the same.  Returns (left, right).
+    """
+    left -= correction
+    right += correction
+    over = max(left, right) - 100
+    if over > 0:
+        left -= over
+        right -= over
+    over = -100 - min(left, right)
+    if over > 0:
+        left += over
+        right += over
+    return (left, right)
+
+
+class DriveMixer():
+    """
+    Works out the left and right duty cycles from the stick positions for arcade
+    and tank controls.  The deadband means both sticks have to be close to the
+    middle before the robot stops, the same as it always has.
+
+    expo - 0 to 100.  How much expo curve to put on the sticks.  See build_axis_table()
+    threshold - The deadband
+
+    example: mixer = DriveMixer()
+             (left, right) = mixer.arcade(stick_x, stick_y, 100)
+    """
+    def __init__(self, expo=0, threshold=STICK_THRESHOLD):
+        self.expo = expo
+        self.axis = build_axis_table(expo)
+        self.dead = build_deadband_table(threshold)
+        # Steering tables already built, by turn_multiplier.  There are only 10 of them
+        self.steer_tables = {}
+        self.turn_multiplier = None
+        self.steer = None
+        self.set_turn(100)
+
+    def set_turn(self, turn_multiplier):
+        """
+        Switches to the steering table for turn_multiplier.  Builds it the first time
+        that turn_multiplier is used.
+        """
+        if turn_multiplier == self.turn_multiplier:
+            return
+        table = self.steer_tables.get(turn_multiplier)
+        if table is None:
+            table = build_steer_table(turn_multiplier, self.expo)
+            self.steer_tables[turn_multiplier] = table
+        self.steer = table
+        self.turn_multiplier = turn_multiplier
+
+    def arcade(self, stick_x, stick_y, turn_multiplier):
+        """
+        Arcade controls.  stick_y drives forward and backwards, stick_x turns.
+        Returns (left, right) duty cycles.
+        """
+        # If none of the stick directions is significant, don't move at all
+        if self.dead[stick_x] and self.dead[stick_y]:
+            return (0, 0)
+        if turn_multiplier != self.turn_multiplier:
+            self.set_turn(turn_multiplier)
+        # If we're steering left, the left motor must run backwards so it has a
+        # -left component.  It has a forward component for going forward too.
+        forward = self.axis[stick_y]
+        left = self.steer[stick_x]
+        return (forward - left, forward + left)
+
+    def tank(self, left_stick_y, right_stick_y):
+        """
+        Tank controls.  Each stick drives the motor on its side.
+        Returns (left, right) duty cycles.
+        """
+        # Don't move if the joystick is really close to 0,0
+        if self.dead[left_stick_y] and self.dead[right_stick_y]:
+            return (0, 0)
+        return (self.axis[left_stick_y], self.axis[right_stick_y])
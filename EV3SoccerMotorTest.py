@@ -0,0 +1,273 @@
+# Motor characterization for the EV3Soccer group of programs
+#
+# Runs a motor through a set of tests with nothing attached to it, and keeps the results:
+#
+# step response - How long the motor takes to get up to speed at full duty cycle
+# top speed     - Degrees per second at full duty cycle, with no load
+# sweep         - The speed at every duty cycle from 10 to 100
+# hold error    - How far off the motor sits after run_target() while holding
+# latency       - How long after dc() the motor has really started to move
+#
+# Every run is added to the end of the results file for its port and motor type, one line each.
+# A motor that is a lot slower or lazier than it was in earlier runs is flagged as worn.
+#
+# example: results = MotorResults()
+#          result = characterize(Motor(Port.B), "B", MotorType.LARGE, StopWatch(), wait)
+#          print(result)
+#          for problem in results.compare(result):
+#              print(problem)
+#          results.add(result)
+
+# The results files go here, one for every port and motor type, for example
+# motor_results_B_lego-ev3-l-motor.csv
+MOTOR_RESULTS_DIR = "/home/robot"
+
+# The duty cycles the sweep measures
+SWEEP_DUTIES = (10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+
+# How long the step response and top speed test runs, and how much of it is left for the
+# motor to get up to speed first
+STEP_MS = 1500
+SETTLE_MS = 500
+
+# How often the step response is sampled
+STEP_SAMPLE_MS = 5
+
+# How long each sweep duty cycle settles, and then how long it is measured for
+SWEEP_SETTLE_MS = 300
+SWEEP_MEASURE_MS = 200
+
+# The target for the hold test, and how long the hold is watched
+HOLD_ANGLE = 360
+HOLD_MS = 500
+
+# The motor has moved once it has turned this many degrees.  Gives up after LATENCY_MAX_MS
+LATENCY_DEGREES = 2
+LATENCY_MAX_MS = 200
+
+# A motor is worn if its top speed drops below this part of the earlier runs, or its step
+# response or latency gets longer than this many times the earlier runs
+WORN_SPEED = 0.85
+WORN_SLOWER = 1.3
+
+# The columns of the results file
+RESULT_FIELDS = ("port", "kind", "rise_ms", "top_speed", "hold_error", "latency_ms", "sweep")
+
+
+class MotorResult():
+    """
+    The results of one characterization run.
+
+    port - The port name, for example "B"
+    kind - The MotorType
+    rise_ms - Milliseconds from dc(100) to 90% of the top speed
+    top_speed - Degrees per second at full duty cycle
+    hold_error - The largest number of degrees off target while holding
+    latency_ms - Milliseconds from dc(100) until the motor turned LATENCY_DEGREES
+    sweep - The speed at each of SWEEP_DUTIES, in degrees per second
+    """
+    def __init__(self, port, kind, rise_ms=0, top_speed=0, hold_error=0, latency_ms=0, sweep=()):
+        self.port = port
+        self.kind = kind
+        self.rise_ms = rise_ms
+        self.top_speed = top_speed
+        self.hold_error = hold_error
+        self.latency_ms = latency_ms
+        self.sweep = list(sweep)
+
+    def line(self):
+        # One line of the results file
+        return ",".join((self.port, self.kind, str(self.rise_ms), str(self.top_speed), str(self.hold_error),
+                         str(self.latency_ms), " ".join(str(speed) for speed in self.sweep)))
+
+    def __str__(self):
+        return (self.port + " " + self.kind + " Rise:" + str(self.rise_ms) + "ms Top:" + str(self.top_speed) +
+                "deg/s Hold:" + str(self.hold_error) + "deg Latency:" + str(self.latency_ms) + "ms")
+
+
+def parse_result(line):
+    """
+    Turns a line of the results file back into a MotorResult.  Returns None for a
+    line that is not one.
+    """
+    fields = line.strip().split(",")
+    if len(fields) != len(RESULT_FIELDS):
+        return None
+    try:
+        return MotorResult(fields[0], fields[1], int(fields[2]), int(fields[3]), int(fields[4]),
+                           int(fields[5]), [int(speed) for speed in fields[6].split()])
+    except ValueError:
+        return None
+
+
+def step_response(motor, clock, wait):
+    """
+    Runs the motor at full duty cycle from standing still.  Returns (rise_ms, top_speed).
+    """
+    motor.reset_angle(0)
+    start = clock.time()
+    motor.dc(100)
+    times = []
+    angles = []
+    now = 0
+    while now < STEP_MS:
+        wait(STEP_SAMPLE_MS)
+        now = clock.time() - start
+        times.append(now)
+        angles.append(motor.angle())
+    motor.stop()
+
+    # The top speed is the average over the part after SETTLE_MS
+    first = 0
+    while times[first] < SETTLE_MS:
+        first += 1
+    top_speed = int(1000 * (angles[-1] - angles[first]) / max(1, times[-1] - times[first]))
+
+    # The first sample where the speed since the sample before got to 90% of the top speed
+    rise_ms = times[-1]
+    for i in range(1, len(times)):
+        speed = 1000 * (angles[i] - angles[i - 1]) / max(1, times[i] - times[i - 1])
+        if speed >= 0.9 * top_speed:
+            rise_ms = times[i]
+            break
+    return (rise_ms, top_speed)
+
+
+def sweep(motor, clock, wait, duties=SWEEP_DUTIES):
+    """
+    Returns the speed at each duty cycle in duties, in degrees per second.
+    """
+    speeds = []
+    for duty in duties:
+        motor.dc(duty)
+        wait(SWEEP_SETTLE_MS)
+        before = motor.angle()
+        start = clock.time()
+        wait(SWEEP_MEASURE_MS)
+        speeds.append(int(1000 * (motor.angle() - before) / max(1, clock.time() - start)))
+    motor.stop()
+    return speeds
+
+
+def hold_error(motor, clock, wait, speed=720):
+    """
+    Runs the motor to HOLD_ANGLE and holds it there.  Returns the largest number of
+    degrees it was off target while holding.
+    """
+    motor.reset_angle(0)
+    motor.run_target(speed, HOLD_ANGLE)
+    worst = 0
+    start = clock.time()
+    while clock.time() - start < HOLD_MS:
+        error = abs(motor.angle() - HOLD_ANGLE)
+        if error > worst:
+            worst = error
+        wait(10)
+    motor.stop()
+    return worst
+
+
+def latency(motor, clock, wait):
+    """
+    Returns how many milliseconds after dc(100) the motor has turned LATENCY_DEGREES.
+    """
+    wait(SETTLE_MS)
+    start_angle = motor.angle()
+    start = clock.time()
+    motor.dc(100)
+    elapsed = LATENCY_MAX_MS
+    while clock.time() - start < LATENCY_MAX_MS:
+        if abs(motor.angle() - start_angle) >= LATENCY_DEGREES:
+            elapsed = clock.time() - start
+            break
+        wait(1)
+    motor.stop()
+    return elapsed
+
+
+def characterize(motor, port, kind, clock, wait):
+    """
+    Runs every test on one motor and returns a MotorResult.  Takes about nine
+    seconds.  Nothing should be attached to the motor.
+    """
+    (rise_ms, top_speed) = step_response(motor, clock, wait)
+    wait(SETTLE_MS)
+    speeds = sweep(motor, clock, wait)
+    wait(SETTLE_MS)
+    error = hold_error(motor, clock, wait)
+    elapsed = latency(motor, clock, wait)
+    return MotorResult(str(port), kind, rise_ms, top_speed, error, elapsed, speeds)
+
+
+class MotorResults():
+    """
+    Every run so far, kept in one file for every port and motor type, one line
+    each, oldest first.  A file is only read when its port and motor type are.
+
+    example: results = MotorResults()
+             print(results.history("B", MotorType.LARGE))
+    """
+    def __init__(self, folder=MOTOR_RESULTS_DIR):
+        self.folder = folder
+        # The runs read so far, by (port, kind)
+        self.results = {}
+
+    def path(self, port, kind):
+        """
+        Returns the name of the results file for a port and motor type.
+        """
+        return self.folder + "/motor_results_" + port + "_" + kind + ".csv"
+
+    def history(self, port, kind):
+        """
+        Returns the earlier runs of the same port and motor type.  Reads their file,
+        once.  A missing file just means no earlier runs.
+        """
+        key = (port, kind)
+        if key in self.results:
+            return self.results[key]
+        runs = []
+        try:
+            with open(self.path(port, kind)) as file:
+                for line in file.read().split("\n"):
+                    result = parse_result(line)
+                    if result is not None and result.port == port and result.kind == kind:
+                        runs.append(result)
+        except OSError:
+            pass
+        self.results[key] = runs
+        return runs
+
+    def add(self, result):
+        """
+        Adds a run to the end of its file.  Returns False if it could not be written.
+        """
+        self.history(result.port, result.kind).append(result)
+        try:
+            with open(self.path(result.port, result.kind), "a") as out:
+                out.write(result.line() + "\n")
+        except OSError:
+            return False
+        return True
+
+    def compare(self, result):
+        """
+        Compares a run with the average of the earlier runs of the same port and motor
+        type.  Returns a list of problems as text.  Empty if the motor looks fine, or
+        there were no earlier runs.
+        """
+        earlier = self.history(result.port, result.kind)
+        if not earlier:
+            return []
+        count = len(earlier)
+        top_speed = sum(old.top_speed for old in earlier) / count
+        rise_ms = sum(old.rise_ms for old in earlier) / count
+        latency_ms = sum(old.latency_ms for old in earlier) / count
+        problems = []
+        if result.top_speed < WORN_SPEED * top_speed:
+            problems.append("Worn: top speed %d, was %d" % (result.top_speed, top_speed))
+        if result.rise_ms > WORN_SLOWER * rise_ms:
+            problems.append("Worn: step response %dms, was %dms" % (result.rise_ms, rise_ms))
+        if result.latency_ms > WORN_SLOWER * latency_ms:
+            problems.append("Worn: latency %dms, was %dms" % (result.latency_ms, latency_ms))
+        return problems
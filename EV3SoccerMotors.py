@@ -0,0 +1,117 @@
+# Motor output helpers for the EV3Soccer group of programs
+
+import time
+
+# Duty cycles closer than this to what the motor already has are not resent.  The
+# motors can't feel a few percent, and it covers a couple of counts of stick jitter
+DUTY_STEP = 4
+
+
+class MotorOutput():
+    """
+    Sits between the program and its motors.  Every call to dc() only records
+    the duty cycle wanted for that port.  flush() then sends the ports that
+    changed, all together, once per control update.  Each dc() on a real motor
+    is a write to a file in /sys/class/tacho-motor, so skipping the ones that
+    would not change anything takes load off the brick.
+
+    step - Duty cycles closer than this to the last one sent are skipped.  Going
+           to 0 is always sent, so the motors really do stop.  0 sends every change
+
+    example: outputs = MotorOutput()
+             outputs.add("B", Motor(Port.B))
+             outputs.dc("B", 50)
+             outputs.flush()
+             print(outputs.writes, outputs.suppressed)
+    """
+    def __init__(self, step=DUTY_STEP):
+        self.step = step
+        self.motors = {}
+        # Last duty cycle sent to each port, and the one asked for since the last flush
+        self.sent = {}
+        self.wanted = {}
+        # Statistics.  How many dc() calls came in, and how many were passed on to the motors
+        self.requests = 0
+        self.writes = 0
+
+    def add(self, port, motor):
+        """
+        Adds a motor.  port is the name used in dc(), for example "A".
+        The motor is assumed to be stopped.
+        """
+        self.motors[port] = motor
+        self.sent[port] = 0
+
+    def dc(self, port, duty):
+        """
+        Asks for a new duty cycle on port.  Nothing is sent until flush().
+        """
+        self.requests += 1
+        self.wanted[port] = duty
+
+    def flush(self):
+        """
+        Sends every duty cycle that changed since the last flush to its motor.
+        Returns the number of motors written to.
+        """
+        count = 0
+        for port in self.wanted:
+            duty = self.wanted[port]
+            last = self.sent[port]
+            if duty == last:
+                continue
+            if duty != 0 and abs(duty - last) < self.step:
+                continue
+            self.motors[port].dc(duty)
+            self.sent[port] = duty
+            count += 1
+        self.wanted.clear()
+        self.writes += count
+        return count
+
+    @property
+    def suppressed(self):
+        # Every dc() call that never made it to a motor
+        return self.requests - self.writes
+
+    def moving(self):
+        """
+        Returns True if any motor was last sent something other than 0.
+        """
+        for port in self.sent:
+            if self.sent[port] != 0:
+                return True
+        return False
+
+    def stop(self):
+        """
+        Sets every motor to 0 right away.
+        """
+        for port in self.motors:
+            self.dc(port, 0)
+        self.flush()
+
+
+class FakeMotor():
+    """
+    Stands in for a pybricks Motor when replaying or benchmarking on a regular
+    computer.  Counts the dc() calls, and can pretend that every call takes as
+    long as a sysfs write on the brick.
+
+    example: motor = FakeMotor(write_cost_us=200)
+    """
+    def __init__(self, write_cost_us=0):
+        self.write_cost_us = write_cost_us
+        self.writes = 0
+        self.duty = 0
+
+    def dc(self, duty):
+        self.writes += 1
+        self.duty = duty
+        if self.write_cost_us:
+            end = time.perf_counter() + self.write_cost_us / 1000000
+            while time.perf_counter() < end:
+                pass
+
+    def stop(self):
+        self.dc(0)
@@ -0,0 +1,341 @@
+# Reading several input devices at once for the EV3Soccer group of programs
+#
+# The PS4 controller shows up as three event files: the buttons and sticks, the motion sensors
+# and the touchpad.  A second controller, for a co-driver on the optional motors, adds three
+# more.  InputMux waits on all of them with one poll() and hands out their events one at a
+# time, like an EventReader, noting which device each came from.  The driver's controller is
+# read through its InputSession, so it can drop out and come back.  RoleRouter then decides
+# which controller is in charge of what:
+#
+# driver      - Drives the robot, and runs the optional motors too when there is no co-driver
+# attachments - The co-driver.  Runs the optional motors (L1, L2, R1, R2 and the triggers)
+#
+# example: mux = InputMux()
+#          mux.add("pad 1", "driver", session)
+#          mux.add("pad 2", "attachments", EventReader(open_event_file("/dev/input/event7")))
+#          router = RoleRouter(mux, control.handle_event, handle_codriver)
+#          event = mux.read()
+#          router.handle_event(event[2], event[3], event[4])
+
+from EV3SoccerUtil import *
+from EV3SoccerInput import EV_SYN, select
+
+# The roles, most important first.  When several devices have events waiting, the events of
+# the more important one are handed out first
+ROLES = ("driver", "attachments")
+
+# The controls that belong to the co-driver when there is one
+ATTACHMENT_CODES = (CODE_L1, CODE_L2, CODE_R1, CODE_R2, CODE_L2_RANGE, CODE_R2_RANGE)
+
+
+def open_event_file(path):
+    """
+    Opens an event file for reading without ever blocking.  InputMux only reads
+    a file once poll() says something is waiting, so this is only a safety net.
+    """
+    in_file = open(path, "rb")
+    try:
+        import os
+        os.set_blocking(in_file.fileno(), False)
+    except (ImportError, AttributeError, OSError):
+        # pybricks-micropython has no set_blocking().  The poll() has to do
+        pass
+    return in_file
+
+
+class InputSource():
+    """
+    One device the mux reads from.
+
+    name - What to call it, for example "pad 2"
+    role - One of ROLES, or anything else for devices that are only listened to
+    reader - The EventReader for its event file, or an InputSession that opens a
+             new one every time the controller comes back
+    """
+    def __init__(self, name, role, reader):
+        self.name = name
+        self.role = role
+        self.reader = reader
+        # Only an InputSession has this.  The session's device never goes away for good
+        self.due_in = getattr(reader, "due_in", None)
+        # The event file registered with the poller, and its file number
+        self.polled = None
+        self.polled_fd = -1
+        if role in ROLES:
+            self.priority = ROLES.index(role)
+        else:
+            self.priority = len(ROLES)
+        self.ended = False
+        # Statistics.  How many events it sent, and how late they were handed out, in ms
+        self.events = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def report(self):
+        average = 0
+        if self.events:
+            average = self.latency_total / self.events
+        return ("%s (%s) Events:%d Latency avg:%.2fms max:%.2fms" %
+                (self.name, self.role, self.events, average, self.latency_max))
+
+
+class InputMux():
+    """
+    Reads events from several event files, waiting on all of them with one poll().
+    Works like an EventReader: read(timeout), pending() and eof.  After read(),
+    source is the InputSource the event came from.
+
+    now - A function that returns the time in seconds on the same clock as the
+          event timestamps (time.time on a regular computer), to measure how late
+          each event is handed out.  None skips that
+    on_lost - Called with the InputSource when one of the devices goes away.  Not
+              for an InputSession, which calls its own on_lost and keeps looking
+
+    example: mux = InputMux()
+             mux.add("pad", "driver", session)
+             event = mux.read(10)
+             if event is not None:
+                 print(mux.source.name, event)
+    """
+    def __init__(self, now=None, on_lost=None):
+        self.now = now
+        self.on_lost = on_lost
+        self.sources = []
+        # Every source ever added, for the report
+        self.added = []
+        # The sources by what poll() gives back for them: the file on the brick, the file
+        # number on a regular computer
+        self.by_poll = {}
+        self.poller = select.poll()
+        self.source = None
+        self.eof = False
+        # Statistics.  How many times poll() waited
+        self.polls = 0
+
+    def add(self, name, role, reader):
+        """
+        Adds a device.  Returns its InputSource.
+        """
+        source = InputSource(name, role, reader)
+        self.sources.append(source)
+        self.added.append(source)
+        # Most important first, so read() can take the first one with something waiting
+        self.sources.sort(key=lambda source: source.priority)
+        self.watch(source)
+        self.eof = False
+        return source
+
+    def watch(self, source):
+        # Polls the source's event file.  An InputSession has a new one after every reconnect,
+        # and none while the controller is gone
+        in_file = source.reader.in_file
+        if in_file is source.polled:
+            return
+        self.unwatch(source)
+        if in_file is not None:
+            self.poller.register(in_file, select.POLLIN)
+            source.polled = in_file
+            source.polled_fd = in_file.fileno()
+            self.by_poll[in_file] = source
+            self.by_poll[source.polled_fd] = source
+
+    def unwatch(self, source):
+        in_file = source.polled
+        if in_file is None:
+            return
+        try:
+            self.poller.unregister(in_file)
+        except ValueError:
+            # Already closed.  Regular Python only knows it by its number now
+            try:
+                self.poller.unregister(source.polled_fd)
+            except KeyError:
+                pass
+        except (OSError, KeyError):
+            pass
+        del self.by_poll[in_file]
+        del self.by_poll[source.polled_fd]
+        source.polled = None
+
+    def has_role(self, role):
+        """
+        Returns True if a device with this role is still there.
+        """
+        for source in self.sources:
+            if source.role == role:
+                return True
+        return False
+
+    def pending(self):
+        for source in self.sources:
+            if source.reader.pending():
+                return True
+        return False
+
+    def remove(self, source):
+        # A device went away.  Stop listening to it
+        self.unwatch(source)
+        source.reader.close()
+        self.sources.remove(source)
+        source.ended = True
+        if not self.sources:
+            self.eof = True
+        if self.on_lost is not None:
+            self.on_lost(source)
+
+    def take(self, source):
+        # Hands out the next event from a source that has one waiting
+        event = source.reader.read(0)
+        self.source = source
+        source.events += 1
+        if self.now is not None:
+            late = 1000 * (self.now() - (event[0] + event[1] / 1000000))
+            source.latency_total += late
+            if late > source.latency_max:
+                source.latency_max = late
+        return event
+
+    def read(self, timeout=-1):
+        """
+        Returns the next event as (tv_sec, tv_usec, ev_type, code, value), from the
+        most important device that has one waiting.  Returns None when nothing came
+        in within timeout milliseconds (-1 is forever), or once every device is gone.
+        """
+        while True:
+            for source in self.sources:
+                if source.reader.pending():
+                    return self.take(source)
+            if self.eof:
+                return None
+
+            # A session whose controller is gone has nothing to poll().  Wake up in time
+            # to look for it again
+            wait_ms = timeout
+            for source in self.sources:
+                if source.due_in is not None:
+                    due = source.due_in()
+                    if due == 0:
+                        source.reader.fill(0)
+                        self.watch(source)
+                        due = source.due_in()
+                    if due > 0 and ( wait_ms < 0 or due < wait_ms ):
+                        wait_ms = due
+
+            self.polls += 1
+            ready = self.poller.poll(wait_ms)
+            if not ready:
+                if wait_ms == timeout:
+                    return None
+                # Only woke up to look for a controller
+                if timeout > 0:
+                    timeout = max(0, timeout - wait_ms)
+                continue
+            for entry in ready:
+                source = self.by_poll.get(entry[0])
+                if source is None or source.ended:
+                    continue
+                try:
+                    source.reader.fill(0)
+                except OSError:
+                    # ENODEV.  The device is gone
+                    source.reader.eof = True
+                if source.due_in is not None:
+                    # A session closes its file when the controller goes away, and opens
+                    # a new one when it comes back
+                    self.watch(source)
+                elif source.reader.eof and not source.reader.pending():
+                    self.remove(source)
+            # Only wait once.  Whatever came in is handed out next time round
+            timeout = 0
+
+    def close(self):
+        """
+        Closes the event files of every device still there.
+        """
+        for source in self.sources:
+            self.unwatch(source)
+            source.reader.close()
+
+    def report(self):
+        """
+        Returns the statistics for every device as text, one line each.
+        """
+        return "\n".join(source.report() for source in self.added)
+
+
+class RoleRouter():
+    """
+    Passes each event from an InputMux on to handle_event(ev_type, code, value),
+    but only if the device it came from is in charge of that control:
+
+    - The optional motor controls (ATTACHMENT_CODES) belong to the co-driver while
+      there is one, and to the driver otherwise
+    - Everything else belongs to the driver
+    - Devices with other roles go to the handler registered for that role, if any
+
+    Only the driver keeps the input watchdog happy, so the robot still stops when
+    the driver's controller goes quiet while the co-driver plays with the motors.
+
+    mux - The InputMux the events come from
+    handle_event - Where the driver's events go, usually SoccerControl.handle_event
+    handle_codriver - Where the co-driver's events go.  Usually SoccerControl.handle_event
+                      with feed=False.  None sends them to handle_event too
+
+    example: router = RoleRouter(mux, control.handle_event, handle_codriver)
+             router.handle_event(ev_type, code, value)   # right after mux.read()
+    """
+    def __init__(self, mux, handle_event, handle_codriver=None):
+        self.mux = mux
+        self.forward = handle_event
+        self.forward_codriver = handle_codriver
+        if handle_codriver is None:
+            self.forward_codriver = handle_event
+        self.others = {}
+        # Statistics.  How many events were passed on, and how many were not the sender's to give
+        self.routed = 0
+        self.dropped = 0
+
+    def register(self, role, handle_event):
+        """
+        Sends the events from devices with this role to handle_event.
+        """
+        self.others[role] = handle_event
+
+    def handle_event(self, ev_type, code, value):
+        source = self.mux.source
+        role = "driver"
+        if source is not None:
+            role = source.role
+        if ev_type == EV_SYN:
+            # The end of a group of changes.  Only the driver's are passed on, so the
+            # co-driver cannot keep the watchdog happy with them
+            if role == "driver":
+                self.forward(ev_type, code, value)
+            return
+        if role in self.others:
+            self.routed += 1
+            self.others[role](ev_type, code, value)
+            return
+        attachment = ( ev_type == EVENT_BUTTON or ev_type == EVENT_RANGE ) and code in ATTACHMENT_CODES
+        if role == "attachments":
+            if attachment:
+                self.routed += 1
+                self.forward_codriver(ev_type, code, value)
+            else:
+                self.dropped += 1
+        elif role == "driver" and ( not attachment or not self.mux.has_role("attachments") ):
+            self.routed += 1
+            self.forward(ev_type, code, value)
+        else:
+            self.dropped += 1
+
+    def release(self, role):
+        """
+        Lets go of every control a device with this role was in charge of.  Call it
+        when the device goes away, so nothing keeps running.
+        """
+        if role == "attachments":
+            for code in (CODE_L1, CODE_L2, CODE_R1, CODE_R2):
+                self.forward_codriver(EVENT_BUTTON, code, VALUE_BUTTON_RELEASED)
+            for code in (CODE_L2_RANGE, CODE_R2_RANGE):
+                self.forward_codriver(EVENT_RANGE, code, 0)
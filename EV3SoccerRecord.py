@@ -0,0 +1,102 @@
+# Recording and replaying controller sessions for the EV3Soccer group of programs
+#
+# A recording is just the raw controller events, one after the other, exactly as they came
+# out of the event file, kernel timestamps and all.  So a recording can be read with an
+# EventReader, and a copy of the event file (cat /dev/input/event4 > session.bin) is a
+# recording too.
+
+from EV3SoccerInput import EventReader, EVENT_SIZE, EV_SYN, SYN_REPORT
+
+# How many events the recorder keeps.  About a minute of hard driving
+RECORD_EVENTS = 16384
+
+
+class EventRecorder():
+    """
+    Keeps a copy of the newest controller events in memory.  Once it is full, the
+    oldest events are overwritten.  save() writes them to a file, oldest first.
+    Hook it up to an EventReader (reader.recorder = recorder) and every batch the
+    reader gets is copied in with one slice assignment.
+
+    path - The file to save to
+    max_events - How many events to keep
+
+    example: recorder = EventRecorder("/home/robot/session.bin")
+             reader.recorder = recorder
+             ...
+             recorder.save()
+    """
+    def __init__(self, path, max_events=RECORD_EVENTS):
+        self.path = path
+        self.ring = bytearray(EVENT_SIZE * max_events)
+        self.view = memoryview(self.ring)
+        # Where the next event goes, and whether the ring has gone all the way round
+        self.offset = 0
+        self.wrapped = False
+        # Statistics.  How many events were recorded altogether
+        self.events = 0
+
+    def record(self, data, nbytes):
+        """
+        Copies the first nbytes of data (whole events) into the ring.
+        """
+        size = len(self.ring)
+        self.events += nbytes // EVENT_SIZE
+        start = 0
+        while start < nbytes:
+            count = min(nbytes - start, size - self.offset)
+            self.view[self.offset:self.offset + count] = data[start:start + count]
+            start += count
+            self.offset += count
+            if self.offset == size:
+                self.offset = 0
+                self.wrapped = True
+
+    def save(self):
+        """
+        Writes the recorded events to the file, oldest first.
+        """
+        with open(self.path, "wb") as out:
+            if self.wrapped:
+                out.write(self.view[self.offset:])
+            out.write(self.view[:self.offset])
+
+
+def replay(path, control, realtime=False, clock=None, wait=None):
+    """
+    Feeds a recording into control (a SoccerControl, usually with FakeMotors) the way
+    EV3Soccer does: every event goes to handle_event(), and the motors are updated
+    at the end of every group of events, as if each group had just arrived.
+
+    realtime - Wait between events as long as the controller did when it was recorded.
+               Otherwise go as fast as possible.
+    clock, wait - A StopWatch and the wait() that goes with it.  Only needed for realtime
+
+    Returns the number of events replayed.
+
+    example: outputs = MotorOutput()
+             outputs.add("B", FakeMotor())
+             outputs.add("C", FakeMotor())
+             print(replay("session.bin", SoccerControl(outputs, False, True, True, False)))
+    """
+    events = 0
+    first = None
+    with open(path, "rb") as in_file:
+        reader = EventReader(in_file)
+        event = reader.read()
+        while event:
+            (tv_sec, tv_usec, ev_type, code, value) = event
+            if realtime:
+                # Milliseconds since the first event, on the recording and on the clock
+                recorded = tv_sec * 1000 + tv_usec // 1000
+                if first is None:
+                    first = recorded - clock.time()
+                ahead = recorded - first - clock.time()
+                if ahead > 0:
+                    wait(ahead)
+            control.handle_event(ev_type, code, value)
+            if ev_type == EV_SYN and code == SYN_REPORT:
+                control.update_motors()
+            events += 1
+            event = reader.read()
+    return events
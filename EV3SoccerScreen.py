@@ -0,0 +1,141 @@
+# Screen drawing for the EV3Soccer group of programs
+#
+# Drawing on the EV3 screen is slow, and the program cannot read the controller while it
+# is drawing.  So the programs do not draw straight onto the screen.  They tell a Display
+# what text should be where, and the Display draws only the text that actually changed,
+# no more often than every DISPLAY_INTERVAL_MS, when the program has nothing else to do.
+
+# The fastest the screen is redrawn
+DISPLAY_INTERVAL_MS = 100
+
+
+class Display():
+    """
+    Remembers what text should be on the screen and what is on it now.  text()
+    and clear() only change what should be there.  flush() then draws the
+    differences: new or changed text is drawn, and text that got shorter or was
+    removed is blanked out with spaces, so the screen only has to be cleared
+    when everything on it is going away.
+
+    screen - The screen to draw on (ev3.screen)
+    clock - A StopWatch, for limiting how often flush() draws.  None draws every time
+    interval_ms - The least time between two flushes that draw something
+    background - The background color for text, so that spaces erase what was there
+
+    example: display = Display(ev3.screen, StopWatch(), background=Color.WHITE)
+             display.text(1, 80, "Turn:100% Arc")
+             display.flush()
+    """
+    def __init__(self, screen, clock=None, interval_ms=DISPLAY_INTERVAL_MS, background=None):
+        self.screen = screen
+        self.clock = clock
+        self.interval_ms = interval_ms
+        self.background = background
+        # The text that should be on the screen, and what was drawn, by (x, y)
+        self.wanted = {}
+        self.shown = {}
+        self.cleared = False
+        self.dirty = False
+        self.last = None
+        # Statistics.  How many text() calls came in, and how many draws and clears were done
+        self.requests = 0
+        self.draws = 0
+        self.clears = 0
+
+    def text(self, x, y, text):
+        """
+        Puts text at x, y, replacing whatever text was at exactly that spot.
+        """
+        self.requests += 1
+        text = str(text)
+        if self.wanted.get((x, y)) != text:
+            self.wanted[(x, y)] = text
+            self.dirty = True
+
+    def remove(self, x, y):
+        """
+        Takes away the text at x, y.
+        """
+        if (x, y) in self.wanted:
+            del self.wanted[(x, y)]
+            self.dirty = True
+
+    def clear(self):
+        """
+        Takes away all of the text.  Anything put back with text() before the next
+        flush() that is the same as before is not drawn again.
+        """
+        self.wanted = {}
+        self.cleared = True
+        self.dirty = True
+
+    def due_in(self):
+        """
+        How many milliseconds until flush() will draw the changes.  -1 if
+        nothing changed.  Use it as the timeout when reading the controller, so
+        the last change is drawn even if the controller goes quiet.
+        """
+        if not self.dirty:
+            return -1
+        if self.clock is None or self.last is None:
+            return 0
+        return max(0, self.last + self.interval_ms - self.clock.time())
+
+    def flush(self, force=False):
+        """
+        Draws whatever changed, unless the last draw was less than interval_ms ago.
+        force draws anyway.  Returns how many pieces of text were drawn.
+        """
+        if not self.dirty:
+            return 0
+        if not force and self.due_in() > 0:
+            return 0
+        if self.clock is not None:
+            self.last = self.clock.time()
+        screen = self.screen
+        shown = self.shown
+        wanted = self.wanted
+        count = 0
+
+        # Clear the screen only if none of what is on it is staying
+        if self.cleared:
+            self.cleared = False
+            keep = False
+            for spot in shown:
+                if wanted.get(spot) == shown[spot]:
+                    keep = True
+                    break
+            if shown and not keep:
+                screen.clear()
+                self.clears += 1
+                shown.clear()
+
+        # Blank out text that is gone
+        for spot in list(shown):
+            if spot not in wanted:
+                self.draw(spot[0], spot[1], " " * len(shown[spot]))
+                del shown[spot]
+                count += 1
+
+        # Draw text that is new or changed.  Pad it with spaces if it got shorter
+        for spot in wanted:
+            text = wanted[spot]
+            old = shown.get(spot)
+            if old == text:
+                continue
+            if old is not None and len(old) > len(text):
+                self.draw(spot[0], spot[1], text + " " * (len(old) - len(text)))
+            else:
+                self.draw(spot[0], spot[1], text)
+            shown[spot] = text
+            count += 1
+
+        self.dirty = False
+        self.draws += count
+        return count
+
+    def draw(self, x, y, text):
+        if self.background is None:
+            self.screen.draw_text(x, y, text)
+        else:
+            self.screen.draw_text(x, y, text, background_color=self.background)
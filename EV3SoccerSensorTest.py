@@ -0,0 +1,202 @@
+# Sensor read benchmark for the EV3Soccer group of programs
+#
+# Every pybricks sensor reading is a read from a file in /sys/class/lego-sensor, and asking for a
+# different mode (reflection after color, speed after angle) first switches the sensor over,
+# which takes much longer.  This measures, for every sensor and mode:
+#
+# samples/sec - How many readings a second the sensor gives, read back to back
+# p50, p99    - How long one reading takes, half of them and 99 out of 100 of them, in us
+# switch      - How long the first reading after switching to the mode took, in us
+# noise       - How much the readings wander while nothing moves (the standard deviation)
+#
+# load() then shows how much of a control loop period reading several sensors every update
+# takes, which is how much sensor polling the soccer loop can afford.
+#
+# example: for device in inventory.sensors():
+#              for result in test_sensor(device.get(), device.port_name, device.kind):
+#                  print(result)
+
+import time
+
+from EV3SoccerInventory import SensorType
+
+# time.ticks_us() on the brick.  On a regular computer, the same thing from perf_counter()
+if hasattr(time, "ticks_us"):
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+else:
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+# The readings each kind of sensor has, one per mode
+SENSOR_MODES = {SensorType.GYRO: ("angle", "speed"),
+                SensorType.COLOR: ("reflection", "ambient", "color", "rgb"),
+                SensorType.INFRARED: ("distance",),
+                SensorType.TOUCH: ("pressed",),
+                SensorType.ULTRASONIC: ("distance",)}
+
+# How many readings to take of each mode
+SENSOR_SAMPLES = 200
+
+# The control loop period load() works out the share of
+LOAD_PERIOD_MS = 10
+
+
+class SensorResult():
+    """
+    How one mode of one sensor did.  See the top of the file.
+    """
+    def __init__(self, port, kind, mode, samples, per_sec, p50_us, p99_us, switch_us, noise):
+        self.port = port
+        self.kind = kind
+        self.mode = mode
+        self.samples = samples
+        self.per_sec = per_sec
+        self.p50_us = p50_us
+        self.p99_us = p99_us
+        self.switch_us = switch_us
+        self.noise = noise
+
+    def __str__(self):
+        noise = "-"
+        if self.noise is not None:
+            noise = "%.2f" % self.noise
+        return ("%s %s %s %d/s p50:%dus p99:%dus switch:%dus noise:%s" %
+                (self.port, self.kind, self.mode, self.per_sec, self.p50_us, self.p99_us, self.switch_us, noise))
+
+
+def percentile(ordered, part):
+    """
+    Returns the value part (0 to 1) of the way through a sorted list.
+    """
+    return ordered[min(len(ordered) - 1, int(part * len(ordered)))]
+
+
+def noise(values):
+    """
+    Returns the standard deviation of the readings.  Readings with several parts (rgb)
+    give the average over the parts.  Returns None for readings that are not numbers,
+    like Color.
+    """
+    first = values[0]
+    if isinstance(first, tuple):
+        parts = [noise([value[i] for value in values]) for i in range(len(first))]
+        if None in parts:
+            return None
+        return sum(parts) / len(parts)
+    if not isinstance(first, (int, float)):
+        return None
+    mean = sum(values) / len(values)
+    return (sum((value - mean) ** 2 for value in values) / len(values)) ** 0.5
+
+
+def test_mode(sensor, port, kind, mode, samples=SENSOR_SAMPLES):
+    """
+    Reads one mode of a sensor samples times, back to back.  Returns a SensorResult.
+    """
+    read = getattr(sensor, mode)
+    # The first reading switches the sensor to this mode
+    start = ticks_us()
+    read()
+    switch_us = ticks_diff(ticks_us(), start)
+
+    times = []
+    values = []
+    first = ticks_us()
+    for i in range(samples):
+        start = ticks_us()
+        value = read()
+        times.append(ticks_diff(ticks_us(), start))
+        values.append(value)
+    total = ticks_diff(ticks_us(), first)
+    times.sort()
+    return SensorResult(port, kind, mode, samples, int(samples * 1000000 / max(1, total)),
+                        percentile(times, 0.5), percentile(times, 0.99), switch_us, noise(values))
+
+
+def test_sensor(sensor, port, kind, samples=SENSOR_SAMPLES):
+    """
+    Tests every mode the sensor has, one after the other.  Returns a list of SensorResults.
+    """
+    results = []
+    for mode in SENSOR_MODES.get(kind, ()):
+        if hasattr(sensor, mode):
+            results.append(test_mode(sensor, port, kind, mode, samples))
+    return results
+
+
+def load(readers, period_ms=LOAD_PERIOD_MS, updates=100):
+    """
+    Works out how much of a control loop period reading sensors every update takes.
+    readers is a list of functions, each taking one reading, for example gyro.angle.
+    Tries 0, 1, 2 ... of them every update.  Returns a list of
+    (count, average us, worst us, percent of the period on average).
+    """
+    results = []
+    for count in range(len(readers) + 1):
+        used = readers[:count]
+        # Switch every sensor to its mode before timing
+        for read in used:
+            read()
+        total = 0
+        worst = 0
+        for i in range(updates):
+            start = ticks_us()
+            for read in used:
+                read()
+            took = ticks_diff(ticks_us(), start)
+            total += took
+            if took > worst:
+                worst = took
+        average = total / updates
+        results.append((count, int(average), worst, 100 * average / (period_ms * 1000)))
+    return results
+
+
+class FakeSensor():
+    """
+    Stands in for a pybricks sensor when benchmarking on a regular computer.  Every
+    reading takes read_cost_us, and switch_cost_us more when it is a different mode
+    from the last reading, and wanders by noise around value.
+
+    example: gyro = FakeSensor(SensorType.GYRO, read_cost_us=300, noise=0.5)
+    """
+    def __init__(self, kind, read_cost_us=0, switch_cost_us=0, noise=0.0, value=0):
+        import random
+        self.kind = kind
+        self.read_cost_us = read_cost_us
+        self.switch_cost_us = switch_cost_us
+        self.noise = noise
+        self.value = value
+        self.random = random.Random(kind)
+        self.mode = None
+        self.reads = 0
+        self.switches = 0
+        for mode in SENSOR_MODES.get(kind, ()):
+            setattr(self, mode, self.reader(mode))
+
+    def reader(self, mode):
+        def read():
+            return self.read(mode)
+        return read
+
+    def read(self, mode):
+        self.reads += 1
+        cost = self.read_cost_us
+        if mode != self.mode:
+            self.mode = mode
+            self.switches += 1
+            cost += self.switch_cost_us
+        if cost:
+            end = time.perf_counter() + cost / 1000000
+            while time.perf_counter() < end:
+                pass
+        value = self.value + self.random.gauss(0, self.noise)
+        if mode == "rgb":
+            return (int(round(value)), int(round(value)), int(round(value)))
+        if mode == "pressed":
+            return False
+        return int(round(value))
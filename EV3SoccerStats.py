@@ -0,0 +1,304 @@
+# Latency statistics and profiling for the EV3Soccer group of programs
+#
+# The kernel stamps every controller event with the time it came in (tv_sec, tv_usec).  Comparing
+# that with the time the program gets to the event, and with the time the motor duty cycle it
+# caused is written, shows how responsive the robot really is:
+#
+# wait - How long events sat in the event file and the reader's buffer before being handled
+# lag  - How long from an event coming in to the motor being told about it, end to end
+#
+# Both are kept in a LatencyHistogram, which never grows however long the program runs.
+#
+# StageProfiler adds up how long each stage of the control loop takes (see STAGES), to show
+# where the time goes.  It can be switched on and off while the program runs.
+#
+# example: latency = InputLatency(backend.event_time_us)
+#          reader = TimedReader(session, latency)
+#          ...
+#          writes = outputs.writes
+#          control.update_motors()
+#          latency.updated(outputs.writes > writes)
+#          print(latency.report())
+
+import time
+from array import array
+
+# time.ticks_us() on the brick.  On a regular computer, the same thing from perf_counter_ns()
+if hasattr(time, "ticks_us"):
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+else:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+# The histogram buckets.  Each doubling of the latency is split into this many buckets, so a
+# reading is never more than 1/BUCKET_STEPS off
+BUCKET_STEPS = 4
+
+# The largest latency the histogram tells apart, as a power of two microseconds (about 67 s).
+# Anything longer goes in the last bucket
+BUCKET_DOUBLINGS = 26
+
+# The stages of the control loop StageProfiler times, by number
+STAGE_READ = 0
+STAGE_UNPACK = 1
+STAGE_DISPATCH = 2
+STAGE_MIXING = 3
+STAGE_MOTORS = 4
+STAGE_LOG = 5
+STAGE_SCREEN = 6
+STAGES = ("read", "unpack", "dispatch", "mixing", "motors", "log", "screen")
+
+
+def bucket_index(value):
+    """
+    Returns the histogram bucket for a latency of value microseconds.
+    """
+    if value < BUCKET_STEPS:
+        return max(0, int(value))
+    value = int(value)
+    shift = 0
+    while value >= 2 * BUCKET_STEPS:
+        value >>= 1
+        shift += 1
+    return min(BUCKET_STEPS * (shift + 1) + value - BUCKET_STEPS, BUCKET_STEPS * (BUCKET_DOUBLINGS + 1) - 1)
+
+
+def bucket_low(index):
+    """
+    Returns the smallest latency, in microseconds, that goes in bucket index.
+    """
+    if index < BUCKET_STEPS:
+        return index
+    shift = index // BUCKET_STEPS - 1
+    return (BUCKET_STEPS + index % BUCKET_STEPS) << shift
+
+
+class LatencyHistogram():
+    """
+    Counts latencies in buckets that get wider as the latency gets longer, so the
+    memory it takes is fixed.  percentile() is accurate to the width of a bucket.
+
+    name - What to call it in the report
+
+    example: histogram = LatencyHistogram("lag")
+             histogram.add(1500)
+             print(histogram.percentile(0.99), histogram.report())
+    """
+    def __init__(self, name):
+        self.name = name
+        self.counts = array("L", [0] * (BUCKET_STEPS * (BUCKET_DOUBLINGS + 1)))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        """
+        Adds a latency in microseconds.
+        """
+        if value < 0:
+            # Clocks that do not quite agree
+            value = 0
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def percentile(self, part):
+        """
+        Returns the latency, in microseconds, that part (0 to 1) of the latencies
+        are no longer than.  Never more than the longest one.
+        """
+        if not self.count:
+            return 0
+        wanted = part * self.count
+        seen = 0
+        for index in range(len(self.counts)):
+            seen += self.counts[index]
+            if seen >= wanted and seen > 0:
+                return min(bucket_low(index + 1) - 1, self.max)
+        return self.max
+
+    def short(self):
+        # For the screen: p50/p99/max in milliseconds
+        return "%d/%d/%dms" % (self.percentile(0.5) // 1000, self.percentile(0.99) // 1000, self.max // 1000)
+
+    def report(self):
+        """
+        Returns the statistics as text, in milliseconds.
+        """
+        return ("%s Count:%d p50:%.1fms p95:%.1fms p99:%.1fms max:%.1fms" %
+                (self.name, self.count, self.percentile(0.5) / 1000, self.percentile(0.95) / 1000,
+                 self.percentile(0.99) / 1000, self.max / 1000))
+
+
+class InputLatency():
+    """
+    Measures the wait and the lag (see the top of the file).  handled() is called
+    with the timestamp of every event as the program gets to it, and updated()
+    after every motor update.  The lag runs from the oldest event handled since
+    the last motor write.  When an update writes nothing, the events before it
+    changed nothing and are forgotten.
+
+    now_us - A function that returns the time in microseconds, on the clock the
+             events are stamped with
+    """
+    def __init__(self, now_us):
+        self.now_us = now_us
+        self.wait = LatencyHistogram("Wait")
+        self.lag = LatencyHistogram("Lag")
+        # When the oldest event that has not reached the motors yet came in
+        self.oldest = None
+
+    def handled(self, tv_sec, tv_usec):
+        stamp = tv_sec * 1000000 + tv_usec
+        self.wait.add(self.now_us() - stamp)
+        if self.oldest is None:
+            self.oldest = stamp
+
+    def updated(self, wrote):
+        """
+        Call after updating the motors.  wrote is True if a duty cycle was written.
+        """
+        if self.oldest is None:
+            return
+        if wrote:
+            self.lag.add(self.now_us() - self.oldest)
+        self.oldest = None
+
+    def report(self):
+        return self.wait.report() + "\n" + self.lag.report()
+
+
+class TimedReader():
+    """
+    Passes the events from a reader (an EventReader, InputSession or InputMux)
+    through, telling an InputLatency about each one.  Works like the reader.
+    """
+    def __init__(self, reader, latency):
+        self.reader = reader
+        self.latency = latency
+        self.eof = reader.eof
+
+    def pending(self):
+        return self.reader.pending()
+
+    def read(self, timeout=-1):
+        event = self.reader.read(timeout)
+        self.eof = self.reader.eof
+        if event is not None:
+            self.latency.handled(event[0], event[1])
+        return event
+
+
+class StageProfiler():
+    """
+    Adds up how many times each stage ran, how long it took all together and the
+    longest it ever took.  Everything is set aside up front, so timing a stage
+    costs two clock reads and a few additions:
+
+    read     - Reading the event file (EventReader), not counting waiting for it
+    unpack   - Turning the bytes into events (EventReader)
+    dispatch - Handling each event, including logging it (SoccerControl.handle_event)
+    mixing   - Working out the duty cycles (SoccerControl.update_motors)
+    motors   - Writing them to the motors (MotorOutput.flush)
+    log      - Writing out the log while there is nothing else to do
+    screen   - Drawing the screen (Display.flush)
+
+    start() returns the time to pass to stop(), or None while switched off, and
+    stop() returns the time again, so the next stage can start from it.  Code
+    that runs for every event checks enabled first, so a profiler that is
+    switched off costs it nothing more than that.
+
+    enabled - Whether to start out switched on
+
+    example: profiler = StageProfiler()
+             start = profiler.start()
+             display.flush()
+             profiler.stop(STAGE_SCREEN, start)
+             print(profiler.report())
+    """
+    def __init__(self, enabled=True, stages=STAGES):
+        self.stages = stages
+        self.counts = array("L", [0] * len(stages))
+        self.totals = array("d", [0.0] * len(stages))
+        self.worst = array("L", [0] * len(stages))
+        self.enabled = False
+        # How long it has been switched on, in microseconds, and since when
+        self.profiled_us = 0
+        self.since = 0
+        if enabled:
+            self.enable(True)
+
+    def enable(self, on):
+        """
+        Switches the profiler on or off.  Stages already started still count.
+        """
+        if on == self.enabled:
+            return
+        now = ticks_us()
+        if on:
+            self.since = now
+        else:
+            self.profiled_us += ticks_diff(now, self.since)
+        self.enabled = on
+
+    def toggle(self):
+        self.enable(not self.enabled)
+        return self.enabled
+
+    def reset(self):
+        for i in range(len(self.stages)):
+            self.counts[i] = 0
+            self.totals[i] = 0.0
+            self.worst[i] = 0
+        self.profiled_us = 0
+        self.since = ticks_us()
+
+    def start(self):
+        if not self.enabled:
+            return None
+        return ticks_us()
+
+    def stop(self, stage, start):
+        if start is None:
+            return None
+        now = ticks_us()
+        took = ticks_diff(now, start)
+        self.counts[stage] += 1
+        self.totals[stage] += took
+        if took > self.worst[stage]:
+            self.worst[stage] = took
+        return now
+
+    def report(self):
+        """
+        Returns the statistics as text, one line for every stage, with its share
+        of the time the profiler was switched on.
+        """
+        profiled = self.profiled_us
+        if self.enabled:
+            profiled += ticks_diff(ticks_us(), self.since)
+        lines = ["Profiled:%.1fms" % (profiled / 1000)]
+        for i in range(len(self.stages)):
+            count = self.counts[i]
+            average = 0
+            if count:
+                average = self.totals[i] / count
+            share = 0
+            if profiled:
+                share = 100 * self.totals[i] / profiled
+            lines.append("%-8s Calls:%d Total:%.1fms Avg:%.1fus Max:%dus Share:%.1f%%" %
+                         (self.stages[i], count, self.totals[i] / 1000, average, self.worst[i], share))
+        return "\n".join(lines)
@@ -0,0 +1,134 @@
+# Encoder drive straight for the EV3Soccer group of programs
+#
+# In arcade mode the left stick drives dead straight forward and backward (and turns on
+# the spot when pushed sideways), the way GyroTest first sketched it.  While driving
+# straight, both wheels should turn the same amount.  DriveStraight compares how far
+# each wheel has turned since the left stick was pushed, and evens them out.
+
+# How often the wheel encoders are read
+ENCODER_PERIOD_MS = 10
+
+# Drive straight gains, tuned on the simulator with EV3SoccerBench.bench_drive_straight().
+# The correction is in duty cycle percent: KP per degree one wheel is ahead of the
+# other, and KI per degree second
+STRAIGHT_KP = 0.5
+STRAIGHT_KI = 2.0
+
+# The most drive straight may change the duty cycle of either wheel
+STRAIGHT_LIMIT = 30
+
+
+class EncoderSampler():
+    """
+    Reads the angles of the two wheel motors no more than once every period_ms,
+    and keeps the readings.  sample() can be called as often as you like.
+
+    left_motor, right_motor - The wheel Motors
+    clock - A StopWatch
+    period_ms - The least time between two readings
+
+    example: sampler = EncoderSampler(Motor(Port.B), Motor(Port.C), StopWatch())
+             sampler.sample()
+             print(sampler.left, sampler.right)
+    """
+    def __init__(self, left_motor, right_motor, clock, period_ms=ENCODER_PERIOD_MS):
+        self.left_motor = left_motor
+        self.right_motor = right_motor
+        self.clock = clock
+        self.period_ms = period_ms
+        # The newest readings, in degrees
+        self.left = 0
+        self.right = 0
+        self.time = None
+        # Statistics.  How many times the encoders were actually read
+        self.reads = 0
+
+    def sample(self):
+        """
+        Reads the encoders if the last reading is period_ms old.  Returns True if it did.
+        """
+        now = self.clock.time()
+        if self.time is not None and now - self.time < self.period_ms:
+            return False
+        self.time = now
+        self.left = self.left_motor.angle()
+        self.right = self.right_motor.angle()
+        self.reads += 1
+        return True
+
+
+class DriveStraight():
+    """
+    A PI controller that keeps both wheels turning the same amount.  The first
+    hold() after release() starts counting from where the wheels are then, so
+    nothing from before (turns, other driving) counts.  Works like HeadingHold:
+    take hold() off the left wheel and add it to the right one.
+
+    sampler - An EncoderSampler
+    kp, ki - The gains.  See STRAIGHT_KP
+    limit - The most correction either way
+
+    example: straight = DriveStraight(EncoderSampler(left_motor, right_motor, StopWatch()))
+             correction = straight.hold()
+             left_motor.dc(forward - correction)
+             right_motor.dc(forward + correction)
+    """
+    def __init__(self, sampler, kp=STRAIGHT_KP, ki=STRAIGHT_KI, limit=STRAIGHT_LIMIT):
+        self.sampler = sampler
+        self.kp = kp
+        self.ki = ki
+        self.limit = limit
+        self.engaged = False
+        self.left_start = 0
+        self.right_start = 0
+        self.integral = 0.0
+        self.time = None
+        self.correction = 0
+        # Statistics.  How many times it engaged, and the most one wheel got ahead
+        self.engages = 0
+        self.error_max = 0
+
+    def release(self):
+        """
+        Stops driving straight.
+        """
+        self.engaged = False
+
+    def hold(self):
+        """
+        Returns how much to take off the left wheel's duty cycle and add to the
+        right wheel's, to even the wheels out.  A whole number.
+        """
+        sampler = self.sampler
+        if not self.engaged:
+            # Start counting from here.  Read the encoders now, whatever the rate
+            sampler.time = None
+            sampler.sample()
+            self.left_start = sampler.left
+            self.right_start = sampler.right
+            self.integral = 0.0
+            self.time = sampler.time
+            self.correction = 0
+            self.engaged = True
+            self.engages += 1
+            return 0
+        if not sampler.sample():
+            # No new reading, so nothing new to correct
+            return self.correction
+
+        # Positive error means the left wheel has gone further (forward) than the right
+        error = (sampler.left - self.left_start) - (sampler.right - self.right_start)
+        if abs(error) > self.error_max:
+            self.error_max = abs(error)
+        dt = (sampler.time - self.time) / 1000
+        self.time = sampler.time
+        self.integral += error * dt
+        # Keep the integral from winding up past what the limit can use
+        if self.ki:
+            most = self.limit / self.ki
+            self.integral = max(-most, min(most, self.integral))
+
+        correction = self.kp * error + self.ki * self.integral
+        correction = int(round(max(-self.limit, min(self.limit, correction))))
+        self.correction = correction
+        return correction
@@ -0,0 +1,182 @@
+# Acceleration limiting and traction control for the EV3Soccer group of programs
+#
+# Flipping a stick from full forward to full backward asks the wheels to go from +100 to -100
+# in one go.  The tyres cannot push the robot that hard, so the wheels spin, the robot gets
+# going later than it could, and the gears take a beating.  Two stages sit between the stick
+# mixing and the motors, and either or both can be used:
+#
+# SlewLimiter     - The duty cycle of each wheel can only change so fast, with separate rates
+#                   for speeding up and slowing down, and for each drive mode
+# TractionControl - Reads the wheel speed from the encoder and keeps the duty cycle close
+#                   enough to how fast the robot can really be going that the tyre grips
+#
+# example: ramp = SlewLimiter(StopWatch())
+#          left = ramp.limit("B", left, "Arc")
+#          traction = TractionControl(Motor(Port.B), StopWatch())
+#          left = traction.limit(left)
+
+# How fast the duty cycle may change, in percent per second: (speeding up, slowing down),
+# for each drive mode.  The fastest rates that never spin the simulated wheels on a stick
+# flip, found with EV3SoccerBench.bench_traction().  The simulated tyres grip the same in
+# both modes, so both come out the same there.  They are kept apart so each mode can be
+# tuned on the real robot, where turning on the spot in tank mode loads the tyres differently.
+# Traction control on its own gets the robot going quicker than any ramp, so the ramps are
+# mostly for when the wheel speeds cannot be read
+RAMPS = {"Arc": (250, 400), "Tank": (250, 400)}
+
+# How often the wheel speed is read for traction control
+TRACTION_PERIOD_MS = 10
+
+# How fast the tyres can speed the robot up, in wheel degrees per second per second, and how
+# far ahead of the robot a wheel may be asked to go, in degrees per second.  Tuned on the
+# simulator with EV3SoccerBench.bench_traction()
+TRACTION_GRIP = 3000
+TRACTION_HEADROOM = 700
+
+# The wheel is spinning if it is this many degrees per second faster than the robot could be
+SLIP_SPEED = 100
+
+# Degrees per second at full duty cycle.  EV3SoccerMotorTest measures it for each motor
+MAX_SPEED = 1050
+
+
+class SlewLimiter():
+    """
+    Limits how fast the duty cycle of each motor can change.  Going through zero
+    (forward to backward) slows down to zero first and then speeds up again.
+
+    clock - A StopWatch
+    ramps - (speeding up, slowing down) in percent per second, for each drive mode
+
+    example: ramp = SlewLimiter(StopWatch())
+             outputs.dc("B", ramp.limit("B", left_speed, "Arc"))
+    """
+    def __init__(self, clock, ramps=None):
+        self.clock = clock
+        if ramps is None:
+            ramps = RAMPS
+        self.ramps = ramps
+        # The last duty cycle given out, and when, for each port
+        self.duties = {}
+        self.times = {}
+        # Statistics.  How many times a duty cycle was held back
+        self.limited = 0
+
+    def reset(self, port, duty=0):
+        """
+        Starts a port over from duty, for example after the motors were stopped.
+        """
+        self.duties[port] = duty
+        self.times[port] = self.clock.time()
+
+    def limit(self, port, duty, mode="Arc"):
+        """
+        Returns the duty cycle to send to the motor on port, as close to duty as the
+        ramps for mode allow since the last time.
+        """
+        now = self.clock.time()
+        last = self.duties.get(port)
+        if last is None:
+            last = 0.0
+            self.times[port] = now
+        if duty == last:
+            self.times[port] = now
+            return duty
+        (up, down) = self.ramps.get(mode, RAMPS["Arc"])
+        dt = now - self.times[port]
+        self.times[port] = now
+
+        if ( last >= 0 and duty > last ) or ( last <= 0 and duty < last ):
+            step = up * dt / 1000
+        else:
+            step = down * dt / 1000
+        if duty > last:
+            new = min(duty, last + step)
+            if last < 0 and new > 0:
+                # Stop at zero on the way through
+                new = 0.0
+        else:
+            new = max(duty, last - step)
+            if last > 0 and new < 0:
+                new = 0.0
+        if new != duty:
+            self.limited += 1
+        self.duties[port] = new
+        return int(round(new))
+
+
+class TractionControl():
+    """
+    Keeps one wheel from spinning.  The wheel speed is read from the encoder every
+    period_ms, and from it, how fast the robot can really be going: never faster
+    than the tyre can have sped it up by.  The duty cycle is then held to at most
+    headroom degrees per second either side of that, which is about as hard as the
+    tyre can push without slipping.
+
+    motor - The wheel Motor
+    clock - A StopWatch
+    max_speed - The motor's speed at full duty cycle
+    grip, headroom - See TRACTION_GRIP
+
+    example: traction = TractionControl(Motor(Port.B), StopWatch())
+             outputs.dc("B", traction.limit(left_speed))
+    """
+    def __init__(self, motor, clock, max_speed=MAX_SPEED, grip=TRACTION_GRIP, headroom=TRACTION_HEADROOM,
+                 period_ms=TRACTION_PERIOD_MS):
+        self.motor = motor
+        self.clock = clock
+        self.max_speed = max_speed
+        self.grip = grip
+        self.headroom = headroom
+        self.period_ms = period_ms
+        self.time = None
+        # The newest wheel speed, and how fast the robot is reckoned to be going
+        self.speed = 0
+        self.ground = 0.0
+        # Statistics.  How many times the speed was read, and how many of those the wheel was spinning
+        self.reads = 0
+        self.slips = 0
+        self.limited = 0
+
+    def sample(self):
+        """
+        Reads the wheel speed if the last reading is period_ms old.  Returns True if it did.
+        """
+        now = self.clock.time()
+        if self.time is not None and now - self.time < self.period_ms:
+            return False
+        dt = 0
+        if self.time is not None:
+            dt = (now - self.time) / 1000
+        self.time = now
+        self.speed = self.motor.speed()
+        self.reads += 1
+        # The robot follows the wheel, but only as fast as the tyre can push it
+        most = self.grip * dt
+        difference = self.speed - self.ground
+        if difference > most:
+            self.ground += most
+        elif difference < -most:
+            self.ground -= most
+        else:
+            self.ground = self.speed
+        if abs(self.speed - self.ground) > SLIP_SPEED:
+            self.slips += 1
+        return True
+
+    def limit(self, duty):
+        """
+        Returns duty, held back if it would push the wheel harder than the tyre grips.
+        """
+        self.sample()
+        goal = duty * self.max_speed / 100
+        high = self.ground + self.headroom
+        low = self.ground - self.headroom
+        if goal > high:
+            goal = high
+        elif goal < low:
+            goal = low
+        else:
+            return duty
+        self.limited += 1
+        return int(round(goal * 100 / self.max_speed))
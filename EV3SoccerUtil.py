@@ -1,6 +1,7 @@
 # Utility functions for the EV3Soccer group of programs
 
-from os import (listdir)
+from EV3SoccerDevices import input_devices, CONTROLLER_NAME
+from EV3SoccerInventory import device_folder
 
 # A helper function for converting stick values (0 - 255)
 # to more usable numbers (-100 - 100)
@@ -19,50 +20,18 @@ def scale(val, src, dst):
 
 def getInputFilename():
     """
-    Parses the devices file to find the name of the event file that represents the controller
+    Looks through the devices file to find the name of the event file that represents the controller
     and returns the full path to the event file.
 
     Returns the null string if the controller is not found
 
     example: print(getInputFilename())
     """
-    # Find the PS3 Gamepad:
-    # Robust finding the Gamepad:
-    # The /proc/bus/input/devices file contains a descriptive listing of the devices
-    # that are attached to this device (EV3 Brain).  We are only interested in the one
-    # that has entries that look like this (among others)
-    #
-    # N: Name="Wireless Controller"
-    # H: Handlers=event???
-
-    # So, open the file, read it line by line looking for the first entry.  Then continue
-    # looking for the second entry and grab the "eventX" portion of it to figure out what
-    # the correct name is.
-
-    # The event file is in the /dev/input folder
-
-    eventfilename=""
-    foundeventfile=False
-    # Open the device file
-    with open("/proc/bus/input/devices") as file:
-        # iterate through the file line by line
-        for line in file:
-            # Search for the Wireless Controller entry
-            if ( line.startswith("N: Name=\"Wireless Controller\"") ):
-                foundeventfile = True
-            # Only searching for the handler name once the Wireless Controller entry has been found
-            if ( foundeventfile ):
-                # Search for the Handler name line
-                if line.startswith("H: Handlers=event") :
-                    # Found the event handler name.  Create the full pathname of the event file
-                    eventfilename="/dev/input/" + line[12:].rstrip()
-                    # and return it.  Note the file handle is automatically closed upon exit from the loop
-                    return(eventfilename)
-    # Didn't find the Wireless Controller.  Return the null string                
-    return("")
+    # The devices file is only parsed again if it changed since last time.  See EV3SoccerDevices
+    return input_devices.find_event_file(CONTROLLER_NAME)
 
     
-def getMotors():
+def getMotors(motor_dir="/sys/class/tacho-motor"):
     """
     Finds all the tacho-motors that the system has found and return a list of motor ports.
     For example, it would return [B][C] if there is a motor on ports B and C.
@@ -71,22 +40,8 @@ def getMotors():
 
     example: print getMotors()
     """
-
-    motor_dir = "/sys/class/tacho-motor"
-    port_file = "address" #Sensor: ev3-ports:in4  Motor: ev3-ports:outC
-
-    motors = []
-    # Get the list of directories
-    dirs = listdir(motor_dir)
-    for dir in dirs:
-        # Open the /sys/class/tacho-motor/XXX/+portfile in each directory
-        f = open(motor_dir + "/" + dir + "/" +port_file)
-        # Find the motor referenced in the last character of the line in the file
-        port = f.readline()[-2:-1]
-        # Append it to the list of motors
-        motors.append(port)
-    # Return the list of motors
-    return motors
+    # The motor folders are only read again if some were plugged in or out.  See EV3SoccerInventory
+    return device_folder(motor_dir).ports()
 
 #PS4 Controller Constants
 EVENT_BUTTON = 1
@@ -11,199 +11,153 @@
 # This program uses input from the PS4 Controller to run various tests on EV3 Devices.
 # First up is a motor tester.
 
-from pybricks import ev3brick as brick
-from pybricks.hubs import EV3Brick
-from pybricks.ev3devices import (Motor, TouchSensor, ColorSensor,
-                                 InfraredSensor, UltrasonicSensor, GyroSensor)
-from pybricks.parameters import (Port, Stop, Direction, Button, Color,
-                                 SoundFile, ImageFile, Align)
-from pybricks.tools import print, wait, StopWatch
-from pybricks.robotics import DriveBase
-
-import struct
-
-# for listing filesystem directories
-from os import (listdir)
-
-
-# Used to display on the brick screen
-ev3 = EV3Brick()
-
-motor_dir = "/sys/class/tacho-motor"
-sensor_dir = "/sys/class/lego-sensor"
-type_file = "driver_name"
-port_file = "address" #Sensor: ev3-ports:in4  Motor: ev3-ports:outC
-
-class MotorType():
-    MEDIUM = "lego-ev3-m-motor"
-    LARGE = "lego-ev3-l-motor"
-
-class SensorType():
-    ULTRASONIC = "lego-ev3-us"
-    GYRO = "lego-ev3-gyro"
-    COLOR = "lego-ev3-color"
-    TOUCH = "lego-ev3-touch"
-    INFRARED = "lego-ev3-ir"
+from EV3SoccerUtil import *
+from EV3SoccerBackend import get_backend
+from EV3SoccerMenu import Menu, MenuItem, run_menu
+from EV3SoccerScreen import Display
+from EV3SoccerInventory import Inventory, MotorType, SensorType
+from EV3SoccerInventory import make_port as inventory_port
+from EV3SoccerMotorTest import characterize, MotorResults, SWEEP_DUTIES
+from EV3SoccerSensorTest import test_sensor, load, SENSOR_MODES, LOAD_PERIOD_MS
+
+
+# The brick, or the simulator when not running on the brick
+backend = get_backend()
+Motor = backend.Motor
+Port = backend.Port
+Color = backend.Color
+TouchSensor = backend.TouchSensor
+ColorSensor = backend.ColorSensor
+InfraredSensor = backend.InfraredSensor
+UltrasonicSensor = backend.UltrasonicSensor
+GyroSensor = backend.GyroSensor
+StopWatch = backend.StopWatch
+wait = backend.wait
+
+# Used to display on the brick screen.  Only the text that changed is drawn
+ev3 = backend.ev3
+display = Display(ev3.screen, StopWatch(), background=Color.WHITE)
+
+# The motors and sensors plugged in.  Their Motor and sensor objects are only made when used
+inventory = Inventory(backend)
+
+# Every motor test so far, to compare the new ones with
+motor_results = MotorResults()
 
 def make_port(port):
-    if port=="A":
-        return Port.A
-    elif port=="B":
-        return Port.B
-    elif port=="C":
-        return Port.C
-    elif port=="D":
-        return Port.D
-    elif port=="1":
-        return Port.S1
-    elif port=="2":
-        return Port.S2
-    elif port=="3":
-        return Port.S3
-    elif port=="4":
-        return Port.S4
-
-# Returns a list of Tuples with (MotorType, Port, Motor)
+    return inventory_port(Port, port)
+
+# Returns a list of Devices.  device.kind is the MotorType, device.port the Port, and
+# device.get() makes the Motor
 def get_motors():
-    motors = []
-    dirs = listdir(motor_dir)
-    for dir in dirs:
-        f = open(motor_dir + "/" + dir + "/" +type_file)
-        motor_type = f.readline().rstrip()
-        f = open(motor_dir + "/" + dir + "/" +port_file)
-        port = make_port(f.readline()[-2:-1])
-        motors.append((motor_type,port, Motor(port)))
-    return motors
-
-# Returns a list of Tuples with (SensorType, Port, Sensor--Pybricks sensor object)
+    return inventory.motors()
+
+# Returns a list of Devices.  device.kind is the SensorType, device.port the Port, and
+# device.get() makes the Pybricks sensor object
 def get_sensors():
-    sensors = []
-    dirs = listdir(sensor_dir)
-    for dir in dirs:
-        f = open(sensor_dir + "/" + dir + "/" +type_file)
-        motor_type = f.readline().rstrip()
-        f = open(sensor_dir + "/" + dir + "/" +port_file)
-        port = make_port(f.readline()[-2:-1])
-        if motor_type == SensorType.COLOR:
-            sensors.append((SensorType.COLOR,port, ColorSensor(port)))
-        elif motor_type == SensorType.GYRO:
-            sensors.append((SensorType.COLOR,port, GyroSensor(port)))
-        elif motor_type == SensorType.INFRARED:
-            sensors.append((SensorType.COLOR,port, InfraredSensor(port)))
-        elif motor_type == SensorType.TOUCH:
-            sensors.append((SensorType.COLOR,port, TouchSensor(port)))
-        elif motor_type == SensorType.ULTRASONIC:
-            sensors.append((SensorType.COLOR,port, UltrasonicSensor(port)))            
-    return sensors
+    return inventory.sensors()
 
 def motor_test( portLetter ):
-    # Turn on motor for 5 seconds and see how far it goes and what its max RPM is
+    # Runs the motor through the characterization tests (see EV3SoccerMotorTest) and
+    # compares it with the earlier runs on the same port, to find worn motors.
     # This should be a no-load test for a motor.  That is, have it completely
     # disconnected from everything.
-    
-    port = make_port( portLetter )
-    motor = Motor(port)
-    # Zero out the encoder
-    motor.reset_angle(0)
-    motor.dc(100)
-    wait(1000)
-    motor.stop()
-    print("Distance in 1 second:" + str(motor.angle()) + " Expected 880 ")
-
-    wait(1000)
-    motor.reset_angle(0)
-    motor.run_angle(720, 3600, wait=True)
-    print("Run to Distance 3600 @ 2 Rotations/second.  Final Angle:" + str(motor.angle()) + "Expected 3600")
-    wait(1000)
-    
-
-
-
-
+    device = inventory.motor( portLetter )
+    if device is None:
+        display.text(10,100,"No motor on " + portLetter)
+        display.flush(force=True)
+        return None
+
+    display.text(10,100,"Testing " + portLetter + "...")
+    display.flush(force=True)
+    result = characterize(device.get(), portLetter, device.kind, StopWatch(), wait)
+    print(result)
+    print("Sweep " + str(SWEEP_DUTIES) + ": " + str(result.sweep))
+
+    problems = motor_results.compare(result)
+    motor_results.add(result)
+    for problem in problems:
+        print(problem)
+    display.clear()
+    display.text(1,1,   portLetter + " Top:" + str(result.top_speed))
+    display.text(1,21,  "Rise:" + str(result.rise_ms) + "ms")
+    display.text(1,41,  "Hold:" + str(result.hold_error) + " Lag:" + str(result.latency_ms))
+    if problems:
+        display.text(1,80, "WORN MOTOR")
+    else:
+        display.text(1,80, "Motor OK")
+    display.flush(force=True)
+    return result
+
+
+def sensor_test( portNumber ):
+    # Measures how fast every mode of the sensor can be read, and how noisy it is.  Then
+    # shows how much of a control loop period reading all of the sensors takes
+    device = inventory.sensor( portNumber )
+    if device is None or device.get() is None:
+        display.text(10,100,"No sensor on " + portNumber)
+        display.flush(force=True)
+        return None
+
+    display.text(10,100,"Testing " + portNumber + "...")
+    display.flush(force=True)
+    results = test_sensor(device.get(), portNumber, device.kind)
+    for result in results:
+        print(result)
+
+    # One reading of the first mode of every sensor, every control update
+    readers = []
+    for other in get_sensors():
+        modes = SENSOR_MODES.get(other.kind, ())
+        if modes and other.get() is not None:
+            readers.append(getattr(other.get(), modes[0]))
+    for (count, average, worst, percent) in load(readers):
+        print("%d sensors: %dus avg %dus worst  %.1f%% of %dms" % (count, average, worst, percent, LOAD_PERIOD_MS))
+
+    display.clear()
+    row = 1
+    for result in results:
+        display.text(1,row, result.mode[:6] + " " + str(result.per_sec) + "/s")
+        row += 20
+    display.flush(force=True)
+    return results
 
 # Display the menu and get a response from the user
-def handle_menu( in_file ):
-    done = False
-    selection = 0
-    header = ( 5,  1,  "Port"), (95,  1,  "Port")
-    menu = (( 10, 20, "1"   ), (100, 20, "A"   ),
-            ( 10, 40, "2"   ), (100, 40, "B"   ),
-            ( 10, 60, "3"   ), (100, 60, "C"   ),
-            ( 10, 80, "4"   ), (100, 80, "D"   ) )
-    #Number of selectable elements
-    numel = len( menu )
-
-    # Display the header elements
-    for row in header:
-        ev3.screen.draw_text( row[0], row[1], row[2] )
-
-    # Display the menu elements
-    for row in menu:
-        ev3.screen.draw_text( row[0], row[1], row[2] )
-
-    # Display the current selection marker
-    ev3.screen.draw_text( menu[selection][0] - 9, menu[selection][1], "*")
-
-    # Read from the file
-    # long int, long int, unsigned short, unsigned short, unsigned int
-    FORMAT = 'llHHI'    
-    EVENT_SIZE = struct.calcsize(FORMAT)
-    event = in_file.read(EVENT_SIZE)
-
-    while event:
-        (tv_sec, tv_usec, ev_type, code, value) = struct.unpack(FORMAT, event)
-
-        # When the direction pad should be returning negative one, I am seeing a very large number
-        # Just adjusting the value to what I need here
-        """
-            if value > 2:
-            value = -1
-        """
-        if ev_type != 0:
-            outtext = str(ev_type) + ":" + str(code) + ":" + str(value) + ":" + str(selection) + "     "
-            ev3.screen.draw_text( 10,100, outtext, background_color=Color.WHITE)
-        """
-        cur_selection = selection
-        # Directional Pad Horizontal
-        if ev_type == 3 and code == 16:
-            selection = ( selection + value + numel ) % numel
-        # Directional Pad Horizontal
-        if ev_type == 3 and code == 17:
-            selection = ( selection + value*2 + numel ) % numel
-
-        # Option Button to select this entry
-        if ev_type == 1 and code == 315 and value == 1:
-            break
-
-        if selection != cur_selection:
-            # Clear the current selection marker
-            ev3.screen.draw_text( menu[cur_selection][0] - 10, menu[cur_selection][1], "  ", background_color=Color.WHITE)
-            # Display the current selection marker
-            ev3.screen.draw_text( menu[selection][0] - 10, menu[selection][1], "*")
-        """        
-        # Finally, read another event
-        event = in_file.read(EVENT_SIZE)
-
-    return menu[selection][2]
-
-# Find the PS3 Gamepad:
-# /dev/input/event3 is the usual file handler for the gamepad.
-# look at contents of /proc/bus/input/devices if it doesn't work.
-infile_path = "/dev/input/event4"
-
-# open file in binary mode
-in_file = open(infile_path, "rb")
+def handle_menu( reader ):
+    items = [MenuItem( 10, 20, "1" ), MenuItem(100, 20, "A" ),
+             MenuItem( 10, 40, "2" ), MenuItem(100, 40, "B" ),
+             MenuItem( 10, 60, "3" ), MenuItem(100, 60, "C" ),
+             MenuItem( 10, 80, "4" ), MenuItem(100, 80, "D" )]
+    menu = Menu(display, items, columns=2, header=(( 5,  1,  "Port"), (95,  1,  "Port")))
+    # If the controller goes away, go with the port the marker is on
+    run_menu(menu, reader, display)
+    return menu.selected().label
+
+# Find the gamepad and open its event file
+session = backend.open_input()
+if not session.connect():
+    display.text(10,70,"ERR Controller")
+    display.text(10,90," ? connected ?")
+    display.flush(force=True)
+    print("ERROR: Could not find Wireless Controller entry in the devices file")
+    wait(5000)
+    raise SystemExit
 
 # which port does the user want to test  
-port = handle_menu( in_file )
+port = handle_menu( session )
 
 #mymotors = get_motors()
 #print( mymotors )
 
-#motor_test("B")
+# Characterize the motor if a motor port was picked, or benchmark the sensor
+if port in ("A", "B", "C", "D"):
+    motor_test( port )
+else:
+    sensor_test( port )
 
-in_file.close()
+session.close()
 
 #ev3.screen.draw_text( 10,100,port)
 wait(1000)
+backend.close()
 
@@ -13,19 +13,22 @@
 # Test 2
 #      Drive in a very small square using the gyro to make the 90 degree turns.  Drive the square twice.
 
-from pybricks import ev3brick as brick
-from pybricks.hubs import EV3Brick
-from pybricks.ev3devices import (Motor, TouchSensor, ColorSensor,
-                                 InfraredSensor, UltrasonicSensor, GyroSensor)
-from pybricks.parameters import (Port, Stop, Direction, Button, Color,
-                                 SoundFile, ImageFile, Align)
-from pybricks.tools import print, wait, StopWatch
-from pybricks.robotics import DriveBase
-
-import struct
+from EV3SoccerUtil import *
+from EV3SoccerBackend import get_backend
+from EV3SoccerGyro import (GyroSampler, HeadingHold, calibrate_gyros, CalibrationStore,
+                           CompensatedGyro, FusedGyro, GYRO_PERIOD_MS)
+
+# The brick, or the simulator when not running on the brick.  The simulated robot
+# has the two gyros this test expects
+backend = get_backend(sensors={"1": "lego-ev3-gyro", "2": "lego-ev3-gyro"})
+Motor = backend.Motor
+Port = backend.Port
+GyroSensor = backend.GyroSensor
+StopWatch = backend.StopWatch
+wait = backend.wait
 
 # Used to display on the brick screen
-ev3 = EV3Brick()
+ev3 = backend.ev3
 
 # Declare motors 
 left_motor = Motor(Port.B)
@@ -35,6 +38,102 @@ right_motor = Motor(Port.C)
 front_gyro = GyroSensor(Port.S1)
 back_gyro = GyroSensor(Port.S2)
 
+TESTSPEED = 50
+
+TEST_CIRCLE = 1
+TEST_SQUARE = 2
+curTest = TEST_CIRCLE
+
+# Used in a 90 degree turn.  The first item is the number of steps.  Each step is
+# the angle, and how fast to go until you get to that angle
+turn_90 = (4, [70, 50], [80, 50], [85, 30], [89, 10])
+
+def right_turn_with_gyro( speed, l_motor, g_sensor ):
+    # Pivots right on the stopped right wheel, slowing down as the turn comes to an end
+    index = 1
+    g_sensor.reset_angle(0)
+    ev3.screen.clear()
+    while True:
+        new_speed = speed[index][1]
+        ev3.screen.draw_text(10,10,index)
+        ev3.screen.draw_text(10,40,new_speed)
+        l_motor.dc( new_speed )
+        while g_sensor.angle() <= speed[index][0]:
+            wait(GYRO_PERIOD_MS)
+        index += 1
+        if index > speed[0]:
+            l_motor.stop()
+            break
+
+def drive_straight_with_gyro( speed, time, sampler ):
+    # Drives forward for time milliseconds, with the heading hold keeping it straight
+    heading = HeadingHold(sampler)
+    watch = StopWatch()
+    while watch.time() < time:
+        correction = heading.hold()
+        left_motor.dc(speed - correction)
+        right_motor.dc(speed + correction)
+        wait(GYRO_PERIOD_MS)
+    left_motor.stop()
+    right_motor.stop()
+    return heading.error_max
+
+def circle_test():
+    # Drive in a circle and beep after every 45 degree turn.  Drive the circle twice.
+    left_motor.dc(TESTSPEED)
+    right_motor.dc(TESTSPEED * 0.80)
+    front_gyro.reset_angle(0)
+    back_gyro.reset_angle(0)
+    lastBeepPos = 0
+
+    wait(1000)
+    while True:
+        gyro_sensor_value = front_gyro.angle()
+        if ( gyro_sensor_value > 720 ):
+            left_motor.stop()
+            right_motor.stop()
+            break
+
+        if gyro_sensor_value > lastBeepPos + 45:
+            lastBeepPos += 45
+            ev3.speaker.beep(500,100)
+        wait(GYRO_PERIOD_MS)
+
+    print("Circle.  Front:" + str(round(front_gyro.angle())) + " Back:" + str(round(back_gyro.angle())) +
+          " Both:" + str(round(both_gyros.angle())))
+
+def square_test():
+    # Drive in a very small square using the gyro to make the 90 degree turns.  Drive the square twice.
+    # The turns reset the front gyro, so the back one keeps the heading
+    sampler = GyroSampler(back_gyro, StopWatch())
+    front_gyro.reset_angle(0)
+    back_gyro.reset_angle(0)
+    for side in range(8):
+        error = drive_straight_with_gyro(TESTSPEED, 500, sampler)
+        right_turn_with_gyro(turn_90, left_motor, front_gyro)
+        print("Side " + str(side + 1) + ".  Worst heading error:" + str(error))
+
+    print("Square.  Back:" + str(round(back_gyro.angle())) + " Expected 720")
+
+# Calibrate both gyros while the robot sits still, and take their drift out
+# A gyro that moves while calibrating gets the calibration from the last run instead
+store = CalibrationStore()
+store.load()
+calibrations = calibrate_gyros([(Port.S1, front_gyro), (Port.S2, back_gyro)], StopWatch(), wait, store)
+for (port, gyro, calibration) in calibrations:
+    print("Calibration " + str(calibration))
+front_gyro = CompensatedGyro(front_gyro, calibrations[0][2], StopWatch())
+back_gyro = CompensatedGyro(back_gyro, calibrations[1][2], StopWatch())
+both_gyros = FusedGyro([front_gyro, back_gyro])
+
+if curTest == TEST_CIRCLE:
+    circle_test()
+square_test()
+backend.close()
+
+# Driving with the controller, with the left stick for driving straight.  Not finished,
+# and kept for reference
+'''
 # Find the PS3 Gamepad for control:
 # /dev/input/event3 is the usual file handler for the gamepad.
 # look at contents of /proc/bus/input/devices if it doesn't work.
@@ -49,67 +148,6 @@ FORMAT = 'llHHI'
 EVENT_SIZE = struct.calcsize(FORMAT)
 event = in_file.read(EVENT_SIZE)
 
-GYRO_CALIBRATION_LOOP_COUNT = 200
-INT TESTSPEED = 50
-
-int TEST_CIRCLE = 1
-int TEST_SQUARE = 2
-int curTest = TEST_CIRCLE
-
-# Used in a 90 degree turn.  First tuple is the angle, 
-# second tuple is how fast to go until you get to that angle
-turn_90 = (4, [70, 50], [80, 50], [85, 30], [89, 10])
-
-def right_turn_with_gyro( speed, l_motor, g_sensor )
-    index = 1
-    g_sensor.reset_angle(0)
-    while True
-        new_speed = speed[index][1]
-        ev3.screen.draw_text(10,10,index)
-        ev3.screen.draw_text(10,40,speed)
-        l_motor.dc( speed )
-        if  g_sensor(angle) > speed[index][0] 
-           index += 1
-        if index > speed[0]
-            l_motor.stop() 
-            break;
-
-right_turn_with_gyro( turn_90, left_motor, front_gyro)
-
-'''
-left_motor.dc(TESTSPEED)
-right_motor.dc(TESTSPEED * 0.80)
-front_gyro.reset_angle(0)
-back_gyro.reset_angle(0)
-lastPos = 0
-lastBeepPos = 0
-
-sleep(1000)
-while True
-    gyro_sensor_value = front_gyro.angle()
-    if ( gyro_sensor_value > 720 )
-        left_motor.stop()
-        right_motor.stop()
-        break
-
-    if gyro_sensor_value > lastBeepPos + 45
-        lastBeepPos += 45
-        ev3.speaker.beep(500,100)
-
-front_gyro.reset_angle(0)
-back_gyro.reset_angle(0)
-sleep(1000)    
-while True
-    left_motor.dc(TESTSPEED)
-    right_motor.dc(TESTSPEED)
-    sleep(500)
-
-    right_motor.stop()
-    while ( front_gyro.angle < 90 )
-    
-rightTurnPID( speed, theLeftMotor  )
-    left_motor
-
 while event:
     (tv_sec, tv_usec, ev_type, code, value) = struct.unpack(FORMAT, event)
     if ev_type == 3 and code == 3: